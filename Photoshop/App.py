@@ -1,9 +1,26 @@
 from PyQt6.QtWidgets import (QMainWindow, QApplication, QMenu, QMenuBar, QToolBar, QLabel, QGraphicsItem, QInputDialog,
-                             QComboBox, QGraphicsScene, QToolButton, QMessageBox, QFileDialog, QGraphicsPixmapItem)
-from PyQt6.QtGui import QPixmap, QAction, QIcon
+                             QComboBox, QGraphicsScene, QToolButton, QMessageBox, QFileDialog, QGraphicsPixmapItem,
+                             QProgressBar)
+from PyQt6.QtGui import QPixmap, QAction, QIcon, QImage, QColor
 from ImageTransformations import ImageTransformations
-from PyQt6.QtCore import Qt, QPointF
+from PyQt6.QtCore import Qt, QPointF, QTimer, QThreadPool
 from CustomView import CustomView
+from TiledImageItem import TiledImageItem
+from MipmapItem import MipmapItem
+from PixelBuffer import PixelBuffer
+from Batch import PIPELINE_STEPS, parse_pipeline
+from Jobs import Job, JobRunner
+from ImageLoader import ImageLoader
+from Exporter import Exporter, ExportOptions, ExportDialog
+from History import History, AddItems, RemoveItems, EditRegion
+from HistogramDock import HistogramDock
+from ProfileDock import ProfileDock
+from Profiler import profiler
+import numpy as np
+import argparse
+import os
+import logging
+import time
 import sys
 
 
@@ -11,7 +28,6 @@ class Application(QMainWindow):
     def __init__(self) -> None:
         self.WINDOW_WIDTH: int = 1000
         self.WINDOW_HEIGHT: int = 700
-        self.image: [QPixmap, None] = None
         self.toolbar_menus: dict = {}
         self.current_file = None
         self.image_transformations = ImageTransformations()
@@ -32,6 +48,7 @@ class Application(QMainWindow):
 
         # Connect to the zoom_changed signal
         self.view.zoom_changed.connect(self.update_zoom_combobox)
+        self.view.zoom_changed.connect(self.image_transformations.store.set_display_scale)
 
         main_menubar = self.menuBar()
         file_menu = main_menubar.addMenu("&File")
@@ -41,11 +58,74 @@ class Application(QMainWindow):
         self.time_label = QLabel(f"Time: 0.0s\t\t")
         main_menubar.setCornerWidget(self.time_label, Qt.Corner.TopRightCorner)
 
+        # Transformations run in the background, with their progress shown in the status bar
+        self.job_runner = JobRunner()
+        self.image_transformations.runner = self.job_runner
+        self.image_transformations.lazy = True  # Edits made within one event loop pass are evaluated together
+        # Large images first show a result computed at the zoom level, until the full resolution one is done
+        self.image_transformations.viewport = lambda: (self.view.scale_factor, self.view.visible_rect())
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFixedWidth(200)
+        self.progress_bar.hide()
+        self.cancel_button = QToolButton()
+        self.cancel_button.setText("Cancel")
+        self.cancel_button.clicked.connect(self.job_runner.cancel_all)
+        self.cancel_button.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+
+        # Opened files are decoded in the background, shown as a preview until their full resolution arrives
+        self.image_loader = ImageLoader()
+        self.image_loader.preview_ready.connect(self.on_image_preview)
+        self.image_loader.loaded.connect(self.on_image_loaded)
+        self.image_loader.failed.connect(self.on_image_failed)
+        self.opening: list[list[QGraphicsItem]] = []  # Files opened together, added to the history once all loaded
+
+        # Saving and exporting snapshot the pixels, the encoding runs on its own pool, in parallel per file
+        self.exporter = Exporter(self.image_transformations)
+        self.export_options = ExportOptions()
+        self.export_runner = JobRunner(QThreadPool())
+        self.export_runner.job_started.connect(self.on_export_started)
+        self.export_runner.job_finished.connect(self.on_job_finished)
+        self.cancel_button.clicked.connect(self.export_runner.cancel_all)
+
+        # Undone copies keep how to recompute them, other undone pixels are kept compressed
+        self.history = History()
+
+        # Memory held by the selected image and by all of them, copies count only the pixels they changed
+        self.memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.memory_label)
+        self.scene.selectionChanged.connect(self.update_memory)
+        self.scene.changed.connect(self.update_memory)
+
+        # Histogram of the selection, recomputed shortly after the scene settles (cached until an image changes)
+        self.histogram_dock = HistogramDock(self)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.histogram_dock)
+        self.histogram_dock.hide()
+        self.histogram_timer = QTimer(self)
+        self.histogram_timer.setSingleShot(True)
+        self.histogram_timer.setInterval(100)
+        self.histogram_timer.timeout.connect(self.update_histogram)
+        self.scene.selectionChanged.connect(self.histogram_timer.start)
+        self.scene.changed.connect(self.histogram_timer.start)
+        self.histogram_dock.visibilityChanged.connect(self.histogram_timer.start)
+
+        # Time and bytes of each stage of the transformations, recorded only while asked to
+        self.profile_dock = ProfileDock(profiler, self)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.profile_dock)
+        self.profile_dock.hide()
+        view_menu = main_menubar.addMenu("&View")
+        view_menu.addAction(self.histogram_dock.toggleViewAction())
+        view_menu.addAction(self.profile_dock.toggleViewAction())
+
+        self.job_runner.job_started.connect(self.on_job_started)
+        self.job_runner.job_finished.connect(self.on_job_finished)
+
         # Actions for the main menu
         main_menu_actions: list[[(str, [str, None], str), None]] = [
             (QIcon.fromTheme("document-save"), None, self.save),
-            # (QIcon.fromTheme("edit-undo"), "Ctrl+Z", self.undo),
-            # (QIcon.fromTheme("edit-redo"), "Ctrl+Y", self.redo),
+            (QIcon.fromTheme("edit-undo"), "Ctrl+Z", self.undo),
+            (QIcon.fromTheme("edit-redo"), "Ctrl+Y", self.redo),
             ("Send to Back", None, self.send_image_back),
             ("Send to Front", None, self.send_image_front),
         ]
@@ -57,6 +137,9 @@ class Application(QMainWindow):
             None,
             ("Save", "Ctrl+S", self.save),
             ("Save as", None, self.save_as),
+            ("Export Images...", "Ctrl+E", self.export_images),
+            None,
+            ("Scratch Disk...", None, self.scratch_disk),
             None,
             ("Exit", None, self.exit),
         ]
@@ -66,6 +149,9 @@ class Application(QMainWindow):
             ("Cut", "Ctrl+X", self.cut),
             ("Copy", "Ctrl+C", self.copy),
             ("Paste", "Ctrl+V", self.paste),
+            ("Paste Into", "Ctrl+Shift+V", self.paste_into),
+            None,
+            ("History Budget...", None, self.history_budget),
         ]
 
         self.create_menu_items(file_menu, file_menu_actions)
@@ -96,9 +182,11 @@ class Application(QMainWindow):
         self.create_toolbar_action_items(main_toolbar, "Histograms", "Equalize Histogram", self.hist_eq)
         self.create_toolbar_action_items(main_toolbar, "Filters", "Box Filter", self.filter_box)
         self.create_toolbar_action_items(main_toolbar, "Filters", "Gauss Filter", self.filter_gauss)
+        self.create_toolbar_action_items(main_toolbar, "Filters", "Custom Kernel", self.filter_kernel)
         self.create_toolbar_action_items(main_toolbar, "Edge Detections", "Sobel Edge Detection", self.edge_sobel)
         self.create_toolbar_action_items(main_toolbar, "Edge Detections", "Laplace Edge Detection", self.edge_laplace)
         self.create_toolbar_action_items(main_toolbar, None, "Point Detection", self.point)
+        self.create_toolbar_action_items(main_toolbar, None, "Pipeline", self.pipeline)
 
         self.setMouseTracking(True)
 
@@ -116,6 +204,68 @@ class Application(QMainWindow):
         zoom_percentage = int(zoom_factor * 100)
         self.zoom_combobox.setCurrentText(f"{zoom_percentage}%")
 
+    def show_time(self, total: float, timings: [list[tuple[QGraphicsItem, float]], None] = None) -> None:
+        """Display the aggregate time of the last transformation, with the per-image times as tooltip"""
+        timings = self.image_transformations.last_timings if timings is None else timings
+        if len(timings) > 1:
+            self.time_label.setText(f"Time: {total:.4f}s ({len(timings)} images, "
+                                    f"max {max(t for _, t in timings):.4f}s)\t\t")
+        else:
+            self.time_label.setText(f"Time: {total:.4f}s\t\t")
+        self.time_label.setToolTip("\n".join(f"Image {i + 1}: {t:.4f}s" for i, (_, t) in enumerate(timings)))
+
+    def update_memory(self) -> None:
+        """Display the memory of the selected image(s) and of every image in the status bar"""
+        store = self.image_transformations.store
+        images = [item for item in self.scene.items() if isinstance(item, QGraphicsPixmapItem)]
+        selected = store.memory([item for item in images if item.isSelected()])
+        total = store.memory(images)
+        self.memory_label.setText(f"Layer: {selected / 2 ** 20:.1f} MiB | Total: {total / 2 ** 20:.1f} MiB")
+
+    def update_histogram(self) -> None:
+        """Show the histogram of the selected image(s) in the dock, skipping images still being computed"""
+        if not self.histogram_dock.isVisible():
+            return
+        transformations = self.image_transformations
+        items = [item for item in self.scene.selectedItems()
+                 if not transformations.is_pending(item) and not self.is_busy(item)]
+        histograms = [transformations.histogram(item, HistogramDock.SAMPLES) for item in items]
+        self.histogram_dock.set_histograms([histogram for histogram in histograms if histogram is not None])
+
+    def on_job_started(self, job: Job) -> None:
+        job.progress.connect(self.on_job_progress)
+        job.finished.connect(lambda total: self.show_time(total, job.timings))
+        job.cancelled.connect(self.remove_items)
+        job.failed.connect(lambda message: QMessageBox.warning(self, "Transformation Failed", message))
+        self.progress_bar.setRange(0, 0)  # Busy indicator until the first image is done
+        self.progress_bar.show()
+        self.cancel_button.show()
+
+    def on_export_started(self, job: Job) -> None:
+        job.progress.connect(self.on_job_progress)
+        job.finished.connect(lambda total: self.statusBar().showMessage(
+            f"Exported {len(job.timings)} image(s) in {total:.2f}s", 5000))
+        job.failed.connect(lambda message: QMessageBox.warning(self, "Export Failed", message))
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.cancel_button.show()
+
+    def on_job_progress(self, done: int, total: int) -> None:
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    def on_job_finished(self, job: Job) -> None:
+        if not self.job_runner.jobs and not self.export_runner.jobs:
+            self.progress_bar.hide()
+            self.cancel_button.hide()
+
+    def remove_items(self, items: list[QGraphicsItem]) -> None:
+        """Remove the given items from the scene, e.g. the copies of a cancelled transformation"""
+        self.history.discard(items)
+        for item in items:
+            self.image_transformations.discard(item)
+            self.scene.removeItem(item)
+
     def dialog_no_selection(self, selected_items: [list[QGraphicsItem], list], text: str) -> None:
         if not selected_items:
             QMessageBox.information(self, "No Selection", text)
@@ -150,31 +300,179 @@ class Application(QMainWindow):
             self.save()
         elif reply == QMessageBox.StandardButton.Cancel:
             return
+        self.job_runner.abandon_all()  # Results still queued for the GUI thread would commit into deleted items
+        self.job_runner.pool.waitForDone()
+        self.export_runner.pool.waitForDone()  # Files being saved are written completely
+        self.image_loader.cancel_all()
+        self.opening = []
         self.scene.clear()
-        self.image = None
+        self.history.clear()
+        self.image_transformations.clear()
+        MipmapItem.cache.clear()
+        TiledImageItem.cache.clear()
+        self.current_file = None
 
     def open(self) -> None:
-        """Opens an image file and loads it into the scene"""
-        filename, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Images (*.png *.xpm *.jpg *.jpeg *.bmp)")
-        if filename:
-            self.image = QPixmap(filename)
-            # self.scene.clear()
-            self.create_selectable_image(self.image)
-            self.view.setSceneRect(self.image.rect().adjusted(0, 0, 0, 0).toRectF())
+        """Opens image files side by side, placeholders appear at once and the pixels as they are decoded"""
+        filenames, _ = QFileDialog.getOpenFileNames(self, "Open Image", "",
+                                                    "Images (*.png *.xpm *.jpg *.jpeg *.bmp *.tif *.tiff *.npy)")
+        items, errors, x = [], [], 0.0
+        for filename in filenames:
+            try:
+                item = self.open_file(filename)
+            except ValueError as error:
+                errors.append(str(error))
+                continue
+            item.setPos(x, 0)
+            x += item.sceneBoundingRect().width() + 20
+            items.append(item)
+        if errors:
+            QMessageBox.warning(self, "Open Image", "\n".join(errors))
+        if items:
+            rect = items[0].sceneBoundingRect()
+            for item in items[1:]:
+                rect = rect.united(item.sceneBoundingRect())
+            self.view.setSceneRect(rect)
+            self.opening.append(items)
+            self.finish_opening()
+
+    def open_file(self, filename: str) -> QGraphicsItem:
+        """Add an item for the file to the scene, decoded in the background unless it is opened tiled"""
+        if TiledImageItem.should_tile(filename):
+            # Too large for a single pixmap, only the visible tiles are decoded
+            item = TiledImageItem.from_file(filename, self.image_transformations.store.scratch)
+            item.failed.connect(lambda message: QMessageBox.warning(self, "Open Image", message))
+            item.setFlags(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable |
+                          QGraphicsItem.GraphicsItemFlag.ItemIsMovable)
+            self.scene.addItem(item)
+            return item
+
+        # A tiny gray stand-in scaled up to the size of the image, read from the header of the file
+        size = ImageLoader.size(filename)
+        factor = max(1, max(size.width(), size.height()) // 256)
+        placeholder = QPixmap(max(1, size.width() // factor), max(1, size.height() // factor))
+        placeholder.fill(QColor(200, 200, 200))
+        item = MipmapItem(placeholder)
+        item.setScale(size.width() / placeholder.width())
+        item.setFlags(QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable |
+                      QGraphicsPixmapItem.GraphicsItemFlag.ItemIsMovable)
+        self.scene.addItem(item)
+        self.image_loader.load(filename, item, size)
+        item.setData(0, os.path.splitext(os.path.basename(filename))[0])  # Name of the exported file
+        return item
+
+    def on_image_preview(self, item: MipmapItem, image: QImage) -> None:
+        """Show the reduced-size preview at the size of the full image"""
+        width = item.pixmap().width() * item.scale()
+        item.setPixmap(QPixmap.fromImage(image))
+        item.setScale(width / image.width())
+
+    def on_image_loaded(self, item: MipmapItem, image: QImage) -> None:
+        item.setPixmap(QPixmap.fromImage(image))
+        item.setScale(1.0)
+        self.image_transformations.store.discard(item)  # Nothing may have decoded the preview, but be sure
+        if self.image_transformations.store.scratch is not None:
+            self.image_transformations.store.get(item)  # Move the pixels to the scratch disk right away
+        self.finish_opening()
+
+    def on_image_failed(self, item: MipmapItem, message: str) -> None:
+        if item.scene() is not None:
+            self.scene.removeItem(item)
+        for items in self.opening:
+            if item in items:
+                items.remove(item)
+        QMessageBox.warning(self, "Open Image", message)
+        self.finish_opening()
+
+    def finish_opening(self) -> None:
+        """Add the files opened together to the history as one step once none of them is loading anymore"""
+        for items in list(self.opening):
+            if not any(self.image_loader.is_loading(item) for item in items):
+                self.opening.remove(items)
+                if items:
+                    self.history.push(AddItems(self.scene, self.image_transformations, items))
+
+    def is_busy(self, item: QGraphicsItem) -> bool:
+        """Whether the pixels of the item are still being loaded or written by a job"""
+        if isinstance(item, TiledImageItem) and not item.source.ready():
+            return True  # The file is still being decoded
+        return self.job_runner.is_busy(item) or self.image_loader.is_loading(item)
+
+    def export_items(self) -> list[QGraphicsItem]:
+        """The selected images, or every image when none is selected, in the order they are placed"""
+        images = [item for item in self.scene.items() if item.parentItem() is None and
+                  isinstance(item, (QGraphicsPixmapItem, TiledImageItem))]
+        selected = [item for item in images if item.isSelected()]
+        return sorted(selected or images, key=lambda item: (item.pos().y(), item.pos().x()))
+
+    def can_export(self, items: list[QGraphicsItem]) -> bool:
+        if not items:
+            QMessageBox.information(self, "Nothing to Export", "Please open or paste an image first.")
+            return False
+        if any(self.is_busy(item) for item in items):
+            QMessageBox.information(self, "Image Busy", "Please wait until the images are processed.")
+            return False
+        return True
 
     def save(self) -> None:
-        """Saves the current file"""
-        if not hasattr(self, 'current_file') or self.current_file is None:
+        """Saves the selected image(s), or all of them, flattened into the current file in the background"""
+        if self.current_file is None:
             self.save_as()
-        else:
-            self.image.save(self.current_file)
+            return
+        items = self.export_items()
+        if not self.can_export(items):
+            return
+        try:
+            job = self.exporter.export_flattened(items, self.current_file, self.export_options)
+        except ValueError as error:
+            QMessageBox.warning(self, "Save Image", str(error))
+            return
+        self.export_runner.submit(job)
 
     def save_as(self) -> None:
-        file_name, _ = QFileDialog.getSaveFileName(self, "Save Image As", "", "Images (*.png *.jpg *.bmp)")
-        if file_name:
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save Image As", "",
+                                                   "Images (*.png *.jpg *.jpeg *.webp *.tif *.tiff *.bmp)")
+        if not file_name:
+            return
+        extension = os.path.splitext(file_name)[1].lower()
+        extension = {".jpeg": ".jpg", ".tiff": ".tif"}.get(extension, extension)
+        if extension not in ExportOptions.FORMATS:
+            extension = self.export_options.extension
+            file_name += extension
+        self.export_options.extension = extension
+        dialog = ExportDialog(self.export_options, choose_format=False, parent=self)
+        if dialog.exec():
+            self.export_options = dialog.options()
             self.current_file = file_name
             self.save()
-            print("saved")
+
+    def export_images(self) -> None:
+        """Write the selected images, or all of them, to a directory as separate files, encoded in parallel"""
+        items = self.export_items()
+        if not self.can_export(items):
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Export Images")
+        if not directory:
+            return
+        dialog = ExportDialog(self.export_options, parent=self)
+        if not dialog.exec():
+            return
+        self.export_options = dialog.options()
+        paths = [os.path.join(directory, f"{item.data(0) or 'image'}-{index + 1:03d}{self.export_options.extension}")
+                 for index, item in enumerate(items)]
+        try:
+            job = self.exporter.export_items(items, paths, self.export_options)
+        except ValueError as error:
+            QMessageBox.warning(self, "Export Images", str(error))
+            return
+        self.export_runner.submit(job)
+
+    def scratch_disk(self) -> None:
+        """Keep the pixels of new layers in memory-mapped files, so large images do not have to fit in RAM"""
+        store = self.image_transformations.store
+        directory = QFileDialog.getExistingDirectory(self, "Scratch Disk", store.scratch or "")
+        if directory:
+            store.use_scratch(directory)
 
     def exit(self) -> None:
         reply = self.dialog_question("Exit Application", "Do you want to save changes before exiting?")
@@ -182,47 +480,109 @@ class Application(QMainWindow):
             self.save()
         elif reply == QMessageBox.StandardButton.Cancel:
             return
+        self.job_runner.abandon_all()
+        self.job_runner.pool.waitForDone()  # Running kernels may still write into the scratch files
+        self.export_runner.pool.waitForDone()  # Files being saved are written completely
+        self.image_transformations.clear()  # Removes the scratch files
         QApplication.quit()
 
     def cut(self) -> None:
         """Cuts the selected item to the clipboard"""
         selected_items = self.scene.selectedItems()
-        if selected_items:
+        if selected_items and self.is_busy(selected_items[0]):
+            QMessageBox.information(self, "Image Busy", "Please wait until the selected image is loaded.")
+        elif selected_items:
             item = selected_items[0]
-            self.clipboard.setPixmap(item.pixmap())
-            self.scene.removeItem(item)
+            self.clipboard.setPixmap(self.image_transformations.pixmap(item))
+            self.history.push(RemoveItems(self.scene, self.image_transformations, [item]))
 
     def copy(self) -> None:
         """Copies the selected item."""
         selected_items = self.scene.selectedItems()
-        if selected_items:
+        if selected_items and self.is_busy(selected_items[0]):
+            QMessageBox.information(self, "Image Busy", "Please wait until the selected image is loaded.")
+        elif selected_items:
             item = selected_items[0]
-            self.clipboard.setPixmap(item.pixmap())
+            self.clipboard.setPixmap(self.image_transformations.pixmap(item))
 
     def paste(self) -> None:
         """Pastes the clipboard image content"""
         pixmap = self.clipboard.pixmap()
         if not pixmap.isNull():
-            self.image = pixmap
-            self.create_selectable_image(pixmap)
+            item = self.create_selectable_image(pixmap)
+            self.history.push(AddItems(self.scene, self.image_transformations, [item]))
+
+    def paste_into(self) -> None:
+        """Pastes the clipboard image into the selected image, at the top-left corner of its visible part"""
+        selected_items = [item for item in self.scene.selectedItems() if isinstance(item, QGraphicsPixmapItem)]
+        if not selected_items:
+            self.dialog_no_selection(selected_items, "Please select an image to paste into.")
+            return
+        pixmap = self.clipboard.pixmap()
+        if pixmap.isNull():
+            return
+        if self.job_runner.jobs or self.is_busy(selected_items[0]):
+            QMessageBox.information(self, "Image Busy", "Please wait until the images are processed.")
+            return
+        item = selected_items[0]
+        visible = item.mapFromScene(self.view.visible_rect()).boundingRect().intersected(item.boundingRect())
+        corner = visible.topLeft() * item.scale()  # Array coordinates, the pixmap may be shown below full resolution
+        start_time = time.perf_counter()
+
+        def pasted(rect: tuple[int, int, int, int], delta: np.ndarray) -> None:
+            self.show_time(time.perf_counter() - start_time, [])
+            self.history.push(EditRegion(self.image_transformations, item, rect, delta))
+        self.image_transformations.paste_into(item, PixelBuffer.from_pixmap(pixmap).array,
+                                              int(corner.x()), int(corner.y()), pasted)
+
+    def undo(self) -> None:
+        """Undo the last edit of the scene"""
+        if self.job_runner.jobs:
+            QMessageBox.information(self, "Image Busy", "Please wait until the images are processed.")
+            return
+        self.history.undo()
+
+    def redo(self) -> None:
+        """Redo the last undone edit of the scene"""
+        if self.job_runner.jobs:
+            QMessageBox.information(self, "Image Busy", "Please wait until the images are processed.")
+            return
+        self.history.redo()
+
+    def history_budget(self) -> None:
+        """Set the memory the undo history may hold, the oldest edits are forgotten beyond it"""
+        budget, ok = QInputDialog.getInt(self, "History Budget", "Memory for undo (MiB):",
+                                         self.history.budget // 2 ** 20, 0, 65536)
+        if ok:
+            self.history.set_budget(budget * 2 ** 20)
 # endregion
 
 # region ToolBar Buttons
-    def negate(self) -> None:
-        """Invert the colors of the selected image(s)"""
+    def apply_transformation(self, method: callable, text: str, **kwargs) -> None:
+        """Copy the selected image(s) and record the transformation on the copies, evaluated in the background"""
         selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image to negate.")
+        self.dialog_no_selection(selected_items, text)
+        if any(self.is_busy(item) for item in selected_items):
+            QMessageBox.information(self, "Image Busy", "Please wait until the selected image is processed.")
+            return
+        profiler.operation = method.__name__  # Copying and decoding are accounted to the transformation
         items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.negate, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        try:
+            method(items, **kwargs)
+        except ValueError as error:
+            QMessageBox.warning(self, "Transformation Failed", str(error))
+            self.remove_items(items)
+            return
+        if items:
+            self.history.push(AddItems(self.scene, self.image_transformations, items))
+
+    def negate(self) -> None:
+        """Invert the colors of the selected image(s)"""
+        self.apply_transformation(self.image_transformations.negate, "Please select an image to negate.")
 
     def grayscale(self) -> None:
         """Convert the selected image(s) to grayscale"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image to grayscale.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.grayscale, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.grayscale, "Please select an image to grayscale.")
 
     def trans_gamma(self) -> None:
         """Apply gamma transformation on the selected image(s)"""
@@ -230,67 +590,83 @@ class Application(QMainWindow):
                                                  10.0, 2)
         if not ok:
             return
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for gamma correction.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.gamma_transformation,
-                                                       items, gamma_value=gamma_value)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.gamma_transformation,
+                                  "Please select an image for gamma correction.", gamma_value=gamma_value)
 
     def trans_log(self) -> None:
         """Apply logarithmic transformation on the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for gamma logarithmic transformation.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.logarithmic_transformation,items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.logarithmic_transformation,
+                                  "Please select an image for gamma logarithmic transformation.")
 
     def hist_create(self) -> None:
         """Create a histogram of the selected image(s)"""
         selected_items = self.scene.selectedItems()
         self.dialog_no_selection(selected_items, "Please select an image to create a histogram.")
-        time = self.image_transformations.measure_time(self.image_transformations.histogram_create, selected_items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        total = self.image_transformations.measure_time(self.image_transformations.histogram_create, selected_items)
+        self.show_time(total)
+        self.histogram_dock.show()  # Follows the selection from now on
 
     def hist_eq(self) -> None:
         """Apply histogram equalization to the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for histogram equalization.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.histogram_equalize, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        modes = {"Per channel (RGB)": "rgb", "Joint RGB": "joint", "Luminance": "luminance", "CLAHE": "clahe"}
+        name, ok = QInputDialog.getItem(self, "Histogram Equalization", "Mode:", list(modes), 0, False)
+        if not ok:
+            return
+        mode, clip_limit = modes[name], 2.0
+        if mode == "clahe":
+            clip_limit, ok = QInputDialog.getDouble(self, "CLAHE", "Enter clip limit:", 2.0, 0.1, 40.0, 1)
+            if not ok:
+                return
+        shared = False
+        if mode != "clahe" and len(self.scene.selectedItems()) > 1:
+            shared = QMessageBox.question(self, "Histogram Equalization",
+                                          "Equalize the images with a shared reference histogram?") \
+                == QMessageBox.StandardButton.Yes
+        self.apply_transformation(self.image_transformations.histogram_equalize,
+                                  "Please select an image for histogram equalization.",
+                                  mode=mode, shared=shared, clip_limit=clip_limit)
 
     def filter_box(self) -> None:
         """Apply a box filter (mean filter) on the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for box filtering.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.filter_box, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        size, ok = QInputDialog.getInt(self, "Box Filter", "Enter kernel size:", 5, 1, 255, 1)
+        if not ok:
+            return
+        self.apply_transformation(self.image_transformations.filter_box,
+                                  "Please select an image for box filtering.", size=size)
 
     def filter_gauss(self) -> None:
         """Apply Gaussian filter on the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for Gaussian filtering.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.filter_gauss, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        sigma, ok = QInputDialog.getDouble(self, "Gauss Filter", "Enter sigma:", 2.0, 0.1, 100.0, 2)
+        if not ok:
+            return
+        self.apply_transformation(self.image_transformations.filter_gauss,
+                                  "Please select an image for Gaussian filtering.", sigma=sigma)
+
+    def filter_kernel(self) -> None:
+        """Apply a user-defined convolution kernel on the selected image(s)"""
+        text, ok = QInputDialog.getText(self, "Custom Kernel",
+                                        "Enter rows separated by ';' (e.g., 0 -1 0; -1 5 -1; 0 -1 0):")
+        if not ok:
+            return
+        try:
+            kernel = np.array([[float(value) for value in row.split()] for row in text.split(';')])
+            if kernel.ndim != 2 or kernel.size == 0:
+                raise ValueError
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Kernel", "Every row must contain the same number of values.")
+            return
+        self.apply_transformation(self.image_transformations.filter_kernel,
+                                  "Please select an image to apply the kernel on.", kernel=kernel)
 
     def edge_sobel(self) -> None:
         """Apply Sobel edge detection on the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image for Sobel edge detection.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.edge_sobel, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.edge_sobel,
+                                  "Please select an image for Sobel edge detection.")
 
     def edge_laplace(self) -> None:
         """Apply Laplacian edge detection on the selected image(s)"""
-        selected_items = self.scene.selectedItems()
-        self.dialog_no_selection(selected_items, "Please select an image to apply Laplacian edge detection.")
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.edge_laplace, items)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.edge_laplace,
+                                  "Please select an image to apply Laplacian edge detection.")
 
     def point(self) -> None:
         """Detect characteristic corners using the Lucas-Kanade (Shi-Tomasi) Operator on the selected image(s)"""
@@ -300,10 +676,23 @@ class Application(QMainWindow):
                                               200, 10, 1000, 1)
         if not ok:
             return
-        items = self.create_copy(selected_items)
-        time = self.image_transformations.measure_time(self.image_transformations.corner_detection_kanade,
-                                                       items, max_corners=max_corners)
-        self.time_label.setText(f"Time: {time:.4f}s\t\t")
+        self.apply_transformation(self.image_transformations.corner_detection_kanade,
+                                  "Please select an image to apply characteristic point detection.",
+                                  max_corners=max_corners)
+
+    def pipeline(self) -> None:
+        """Apply a chain of transformations on the selected image(s), evaluated in a single fused pass"""
+        text, ok = QInputDialog.getText(self, "Pipeline", "Enter steps separated by '|' "
+                                                          "(e.g., grayscale | gamma:2.2 | gauss:2):")
+        if not ok or not text.strip():
+            return
+        try:
+            steps = [(PIPELINE_STEPS[name][0], args) for name, args in parse_pipeline(text)]
+        except ValueError as error:
+            QMessageBox.warning(self, "Invalid Pipeline", str(error))
+            return
+        self.apply_transformation(self.image_transformations.apply_steps,
+                                  "Please select an image to apply the pipeline on.", steps=steps)
 
     def rotate_right(self) -> None:
         pass
@@ -352,11 +741,14 @@ class Application(QMainWindow):
                 toolbar.addWidget(menu_button)
                 self.toolbar_menus[menu_name] = menu_button
 
-    def create_selectable_image(self, pixmap: QPixmap) -> None:
-        pixmap_item = QGraphicsPixmapItem(pixmap)
+    def create_selectable_image(self, pixmap: QPixmap) -> MipmapItem:
+        pixmap_item = MipmapItem(pixmap)
         pixmap_item.setFlags(QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable |
                              QGraphicsPixmapItem.GraphicsItemFlag.ItemIsMovable)
         self.scene.addItem(pixmap_item)
+        if self.image_transformations.store.scratch is not None:
+            self.image_transformations.store.get(pixmap_item)  # Move the pixels to the scratch disk right away
+        return pixmap_item
 
     def create_copy(self, selected_items: list[QGraphicsItem]) -> list[QGraphicsPixmapItem]:
         """Copies the selected image(s), applies the desired transformation, and places them next to the original."""
@@ -366,11 +758,16 @@ class Application(QMainWindow):
         copied_items = []
 
         for item in selected_items:
-            original_pixmap = item.pixmap()
-            copied_item = QGraphicsPixmapItem(original_pixmap)
+            if isinstance(item, TiledImageItem):
+                copied_item = item.copy()  # Shares the file, the tiles are decoded when they become visible
+            else:
+                self.image_transformations.store.flush(item)
+                copied_item = MipmapItem(item.pixmap())  # The displayed pixmap, it may be below full resolution
+                copied_item.setScale(item.scale())
+                self.image_transformations.derive(item, copied_item)  # Continue from its recorded operations
 
             original_pos = item.pos()
-            copied_item.setPos(QPointF(original_pos.x() + original_pixmap.width() + 20, original_pos.y()))
+            copied_item.setPos(QPointF(original_pos.x() + item.sceneBoundingRect().width() + 20, original_pos.y()))
 
             copied_item.setFlags(QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable |
                                  QGraphicsPixmapItem.GraphicsItemFlag.ItemIsMovable)
@@ -382,7 +779,17 @@ class Application(QMainWindow):
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile-log", default=None, metavar="PATH",
+                        help="record the stages of every transformation, one JSON object per line")
+    args, qt_args = parser.parse_known_args()
+    if args.profile_log:
+        handler = logging.FileHandler(args.profile_log)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        profiler.logger.addHandler(handler)
+        profiler.logger.setLevel(logging.DEBUG)
+        profiler.enabled = True
+    app = QApplication(sys.argv[:1] + qt_args)
     w = Application()
     w.show()
     sys.exit(app.exec())
@@ -0,0 +1,204 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from TileScheduler import TileScheduler
+from LookupTable import LookupTable
+from Operations import Operations
+import numpy as np
+import argparse
+import time
+import glob
+import sys
+import os
+import cv2
+
+IMAGE_EXTENSIONS: tuple = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def _equalize_mode(value: str) -> str:
+    if value not in Operations.EQUALIZE_MODES:
+        raise ValueError(f"Unknown equalization mode '{value}', choose from: {', '.join(Operations.EQUALIZE_MODES)}")
+    return value
+
+
+# Pipeline step name -> (Operations method, argument converters)
+PIPELINE_STEPS: dict[str, tuple[str, list[type]]] = {
+    "negate": ("negate", []),
+    "grayscale": ("grayscale", []),
+    "gamma": ("gamma_transformation", [float]),
+    "log": ("logarithmic_transformation", []),
+    "equalize": ("histogram_equalize", [_equalize_mode]),
+    "box": ("filter_box", [int]),
+    "gauss": ("filter_gauss", [float]),
+    "sobel": ("edge_sobel", []),
+    "laplace": ("edge_laplace", []),
+    "laplace-abs": ("edge_laplace_optimized", []),
+    "corners": ("corner_detection_kanade", [int, float, int, int]),
+}
+
+# Steps that are lookup tables, consecutive ones are fused into a single pass
+POINT_STEPS: dict[str, callable] = {
+    "negate": LookupTable.negate,
+    "gamma": LookupTable.gamma,
+    "log": LookupTable.logarithmic,
+}
+
+
+def parse_pipeline(text: str) -> list[tuple[str, list]]:
+    """Parse 'grayscale | gamma:2.2 | gauss:2' into (step, arguments) pairs"""
+    steps = []
+    for part in text.split("|"):
+        name, _, arguments = part.strip().partition(":")
+        if name not in PIPELINE_STEPS:
+            raise ValueError(f"Unknown pipeline step '{name}', choose from: {', '.join(PIPELINE_STEPS)}")
+        converters = PIPELINE_STEPS[name][1]
+        values = [value for value in arguments.split(",") if value] if arguments else []
+        if len(values) > len(converters):
+            raise ValueError(f"Step '{name}' takes at most {len(converters)} argument(s)")
+        steps.append((name, [convert(value) for convert, value in zip(converters, values)]))
+    return steps
+
+
+def compile_pipeline(steps: list[tuple[str, list]], operations: Operations) -> list[callable]:
+    """Turn the parsed steps into array callables, fusing runs of point operations into one lookup table"""
+    compiled = []
+    tables = []
+    for name, arguments in steps + [(None, [])]:
+        if name in POINT_STEPS:
+            tables.append(POINT_STEPS[name](*arguments))
+            continue
+        if tables:
+            table = LookupTable.compose(*tables)
+            compiled.append(lambda img_array, table=table:
+                            operations.point_operation(img_array, table, out=img_array))
+            tables = []
+        if name is not None:
+            method = getattr(operations, PIPELINE_STEPS[name][0])
+            compiled.append(lambda img_array, method=method, arguments=arguments:
+                            method(img_array, *arguments, out=img_array))
+    return compiled
+
+
+def collect_inputs(patterns: list[str]) -> list[str]:
+    """Expand directories and glob patterns into a sorted list of image files"""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        files.update(path for path in candidates if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path))
+    return sorted(files)
+
+
+def read_rgba(path: str) -> np.ndarray:
+    """Decode an image file into an (H, W, 4) RGBA uint8 array"""
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Cannot decode {path}")
+    if image.dtype != np.uint8:
+        image = (image / (np.iinfo(image.dtype).max / 255)).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGBA)
+    if image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGBA)
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+
+
+def write_rgba(path: str, img_array: np.ndarray, params: [list[int], None] = None) -> None:
+    """Encode an RGBA array, dropping the alpha channel for formats without one
+
+    params are OpenCV's (flag, value, ...) encoder options, e.g. [cv2.IMWRITE_JPEG_QUALITY, 90].
+    """
+    if path.lower().endswith((".jpg", ".jpeg", ".bmp")):
+        image = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
+    else:
+        image = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGRA)
+    if not cv2.imwrite(path, image, params or []):
+        raise ValueError(f"Cannot encode {path}")
+
+
+_worker: dict = {}
+
+
+def _init_worker(pipeline: str, threads: int) -> None:
+    """Build the pipeline once per process, with the threads each process may use"""
+    cv2.setNumThreads(threads)
+    operations = Operations(tiles=TileScheduler(workers=threads))
+    _worker["pipeline"] = compile_pipeline(parse_pipeline(pipeline), operations)
+
+
+def process_file(source: str, target: str) -> float:
+    """Read, transform and write a single image inside a worker process, returning the seconds spent"""
+    start_time = time.perf_counter()
+    img_array = read_rgba(source)
+    for step in _worker["pipeline"]:
+        img_array = step(img_array)
+    write_rgba(target, img_array)
+    return time.perf_counter() - start_time
+
+
+def output_path(source: str, output_dir: str, suffix: str, extension: [str, None]) -> str:
+    stem, source_extension = os.path.splitext(os.path.basename(source))
+    return os.path.join(output_dir, f"{stem}{suffix}{extension or source_extension}")
+
+
+def run(pipeline: str, inputs: list[str], output_dir: str, workers: int, max_in_flight: int, suffix: str = "",
+        extension: [str, None] = None, threads: int = 1) -> int:
+    """Stream the files through a process pool, at most max_in_flight images are decoded at any time"""
+    parse_pipeline(pipeline)  # Fail fast on a typo, before any process is started
+    os.makedirs(output_dir, exist_ok=True)
+    total, done, failures = len(inputs), 0, 0
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pipeline, threads)) as pool:
+        pending = {}
+        sources = iter(inputs)
+        while True:
+            for source in sources:
+                target = output_path(source, output_dir, suffix, extension)
+                pending[pool.submit(process_file, source, target)] = (source, target)
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                source, target = pending.pop(future)
+                done += 1
+                try:
+                    print(f"[{done}/{total}] {source} -> {target} ({future.result():.3f}s)")
+                except Exception as error:
+                    failures += 1
+                    print(f"[{done}/{total}] {source} failed: {error}", file=sys.stderr)
+
+    print(f"Processed {total - failures}/{total} image(s) in {time.perf_counter() - start_time:.2f}s")
+    return 1 if failures else 0
+
+
+def main(argv: [list[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Apply a transformation pipeline to many images without a display")
+    parser.add_argument("pipeline", help=f"steps separated by '|', e.g. 'grayscale | gamma:2.2 | gauss:2'. "
+                                         f"Steps: {', '.join(PIPELINE_STEPS)}")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker process")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of images queued or being processed (default: 2 x workers)")
+    parser.add_argument("--suffix", default="", help="appended to the output file names")
+    parser.add_argument("--format", default=None, help="output extension, e.g. .png (default: same as input)")
+    args = parser.parse_args(argv)
+
+    try:
+        parse_pipeline(args.pipeline)
+    except ValueError as error:
+        parser.error(str(error))
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("no input images found")
+    extension = args.format if args.format is None or args.format.startswith(".") else f".{args.format}"
+    return run(args.pipeline, inputs, args.output, args.workers, args.max_in_flight or 2 * args.workers,
+               args.suffix, extension, args.threads)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
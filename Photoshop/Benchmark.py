@@ -0,0 +1,222 @@
+from Operations import Operations
+from LookupTable import LookupTable
+import numpy as np
+import argparse
+import platform
+import json
+import math
+import time
+import sys
+import os
+import cv2
+
+_BINOMIAL: np.ndarray = np.array([1, 4, 6, 4, 1], dtype=np.float64) / 16
+SEPARABLE_KERNEL: np.ndarray = np.outer(_BINOMIAL, _BINOMIAL)  # Rank 1, filtered as two 1-D passes
+DIRECT_KERNEL: np.ndarray = np.array([[0, 0, -1, 0, 0], [0, -1, -2, -1, 0], [-1, -2, 17, -2, -1],
+                                      [0, -1, -2, -1, 0], [0, 0, -1, 0, 0]], dtype=np.float64)  # Sharpen, rank > 1
+FFT_KERNEL: np.ndarray = np.random.default_rng(0).random((31, 31)) / (31 * 31 / 2)  # Past the FFT threshold
+# Gamma, logarithm and a contrast curve, fused into one table
+POINT_TABLES: tuple[LookupTable, ...] = (LookupTable.gamma(2.2), LookupTable.logarithmic(),
+                                         LookupTable.curve([(0, 0), (64, 32), (192, 224), (255, 255)]))
+
+# Operation name (as in ImageTransformations) -> call on an image, writing into a preallocated output
+OPERATIONS: dict[str, callable] = {
+    "point_operation": lambda ops, img, out: ops.point_operation(img, *POINT_TABLES, out=out),
+    "negate": lambda ops, img, out: ops.negate(img, out=out),
+    "grayscale": lambda ops, img, out: ops.grayscale(img, out=out),
+    "gamma_transformation": lambda ops, img, out: ops.gamma_transformation(img, 2.2, out=out),
+    "logarithmic_transformation": lambda ops, img, out: ops.logarithmic_transformation(img, out=out),
+    "histogram_create": lambda ops, img, out: ops.histogram(img),
+    "histogram_equalize": lambda ops, img, out: ops.histogram_equalize(img, "rgb", out=out),
+    "histogram_equalize_luminance": lambda ops, img, out: ops.histogram_equalize(img, "luminance", out=out),
+    "histogram_equalize_clahe": lambda ops, img, out: ops.histogram_equalize(img, "clahe", out=out),
+    "filter_box": lambda ops, img, out: ops.filter_box(img, 5, out=out),
+    "filter_gauss": lambda ops, img, out: ops.filter_gauss(img, 2.0, out=out),
+    "filter_kernel": lambda ops, img, out: ops.filter_kernel(img, DIRECT_KERNEL, out=out),
+    "filter_kernel_separable": lambda ops, img, out: ops.filter_kernel(img, SEPARABLE_KERNEL, out=out),
+    "filter_kernel_fft": lambda ops, img, out: ops.filter_kernel(img, FFT_KERNEL, out=out),
+    "edge_sobel": lambda ops, img, out: ops.edge_sobel(img, out=out),
+    "edge_laplace": lambda ops, img, out: ops.edge_laplace(img, out=out),
+    "edge_laplace_optimized": lambda ops, img, out: ops.edge_laplace_optimized(img, out=out),
+    "corner_detection_kanade": lambda ops, img, out: (ops.features.clear(), ops.corner_detection_kanade(img, out=out)),
+    "corner_detection_cached": lambda ops, img, out: ops.corner_detection_kanade(img, 100, out=out),
+}
+
+LAYOUTS: dict[str, int] = {"rgb": 3, "rgba": 4}  # Layout -> channels
+PERCENTILES: tuple[int, ...] = (5, 50, 90, 99)
+DEFAULT_SIZES: str = "256,1024"  # Larger ones, e.g. 4096 or 100M, are opt-in with --sizes
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    """Width and height from '1024' (square), '1920x1080' or '100M' (a square of that many megapixels)"""
+    text = text.strip().lower()
+    if text.endswith("m"):
+        side = round(math.sqrt(float(text[:-1]) * 1000 * 1000))
+        return side, side
+    width, _, height = text.partition("x")
+    return int(width), int(height or width)
+
+
+def make_image(width: int, height: int, channels: int, seed: int = 0) -> np.ndarray:
+    """Deterministic test image, smooth gradients with noise, so the filters and detectors have real work to do"""
+    rng = np.random.default_rng(seed)
+    img_array = np.empty((height, width, channels), dtype=np.uint8)
+    ramp_x = np.linspace(0, 160, width, dtype=np.float32)
+    ramp_y = np.linspace(0, 160, height, dtype=np.float32)[:, None]
+    rows = max(1, 2 ** 22 // width)  # Chunked, so a 100 MP image does not need float copies of itself
+    for y in range(0, height, rows):
+        chunk = img_array[y:y + rows]
+        noise = rng.integers(0, 96, chunk.shape[:2] + (3,), dtype=np.uint8)
+        for channel, base in enumerate((ramp_x + ramp_y[y:y + rows], ramp_x[::-1] + ramp_y[y:y + rows],
+                                        np.abs(ramp_x - 80) + ramp_y[y:y + rows])):
+            chunk[..., channel] = np.minimum(base * 0.6, 159).astype(np.uint8) + noise[..., channel]
+        if channels == 4:
+            chunk[..., 3] = 255
+    return img_array
+
+
+def statistics(samples_ns: list[int]) -> dict:
+    """Summary of the trial times, in nanoseconds"""
+    samples = np.asarray(samples_ns, dtype=np.float64)
+    stats = {"min": int(samples.min()), "max": int(samples.max()), "mean": int(samples.mean()),
+             "stdev": int(samples.std(ddof=1)) if len(samples) > 1 else 0}
+    stats.update({f"p{p}": int(np.percentile(samples, p)) for p in PERCENTILES})
+    return stats
+
+
+def measure(func: callable, warmup: int, repeat: int, min_repeat: int, max_seconds: float) -> list[int]:
+    """Run func warmup times untimed, then time up to repeat trials with perf_counter_ns
+
+    The trials stop early once max_seconds are spent, after at least min_repeat of them.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    deadline = time.perf_counter_ns() + int(max_seconds * 1e9)
+    while len(samples) < repeat:
+        start_time = time.perf_counter_ns()
+        func()
+        end_time = time.perf_counter_ns()
+        samples.append(end_time - start_time)
+        if len(samples) >= min_repeat and end_time > deadline:
+            break
+    return samples
+
+
+def environment(threads: int) -> dict:
+    return {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "threads": threads, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def run(operations: list[str], sizes: list[tuple[int, int]], layouts: list[str], warmup: int, repeat: int,
+        min_repeat: int, max_seconds: float, threads: int) -> dict:
+    """Benchmark every operation on every size and layout, one freshly generated image per case"""
+    cv2.setNumThreads(threads)
+    ops = Operations()
+    ops.tiles.configure(workers=threads)
+    results = []
+    for width, height in sizes:
+        for layout in layouts:
+            img_array = make_image(width, height, LAYOUTS[layout])
+            out = np.empty_like(img_array)
+            for name in operations:
+                samples = measure(lambda: OPERATIONS[name](ops, img_array, out), warmup, repeat, min_repeat,
+                                  max_seconds)
+                stats = statistics(samples)
+                results.append({"operation": name, "width": width, "height": height, "layout": layout,
+                                 "trials": len(samples), "samples_ns": samples, "stats_ns": stats,
+                                 "megapixels_per_s": width * height / stats["p50"] * 1000 if stats["p50"] else None})
+                print(f"{name:<30} {width}x{height} {layout:<4} median {stats['p50'] / 1e6:10.3f} ms  "
+                      f"p90 {stats['p90'] / 1e6:10.3f} ms  ({len(samples)} trials)", file=sys.stderr)
+            del img_array, out
+    return {"environment": environment(threads), "warmup": warmup, "results": results}
+
+
+def _key(result: dict) -> tuple:
+    return result["operation"], result["width"], result["height"], result["layout"]
+
+
+def compare(report: dict, baseline: dict, tolerance: float, statistic: str = "p50",
+            noise_ns: int = 50_000) -> list[dict]:
+    """Cases whose statistic grew by more than tolerance (a fraction) over the baseline
+
+    Differences below noise_ns are never flagged, timer and scheduler jitter dominate such short runs.
+    """
+    previous = {_key(result): result for result in baseline["results"]}
+    comparisons = []
+    for result in report["results"]:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        before, after = old["stats_ns"][statistic], result["stats_ns"][statistic]
+        ratio = after / before if before else math.inf
+        comparisons.append({"operation": result["operation"], "width": result["width"], "height": result["height"],
+                            "layout": result["layout"], "baseline_ns": before, "current_ns": after, "ratio": ratio,
+                            "regression": ratio > 1 + tolerance and after - before > noise_ns})
+    return comparisons
+
+
+def main(argv: [list[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time every image operation across sizes and channel layouts")
+    parser.add_argument("-O", "--operations", default=",".join(OPERATIONS),
+                        help=f"comma separated operations (default: all). Operations: {', '.join(OPERATIONS)}")
+    parser.add_argument("-s", "--sizes", default=DEFAULT_SIZES,
+                        help="comma separated sizes: 1024 (square), 1920x1080 or 100M (megapixels, square), "
+                             f"default: {DEFAULT_SIZES}")
+    parser.add_argument("-l", "--layouts", default=",".join(LAYOUTS),
+                        help=f"comma separated channel layouts: {', '.join(LAYOUTS)}")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed runs before the trials")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="timed trials per case")
+    parser.add_argument("--min-repeat", type=int, default=3, help="trials run even past --max-seconds")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="time after which a case stops its trials")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="tile and OpenCV threads")
+    parser.add_argument("-o", "--output", default=None, help="JSON report file (default: standard output)")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="JSON report of an earlier run, exits with 1 when a case regressed")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed growth of the median before it counts as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    operations = [name.strip() for name in args.operations.split(",") if name.strip()]
+    layouts = [name.strip() for name in args.layouts.split(",") if name.strip()]
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error(f"unknown operation '{name}', choose from: {', '.join(OPERATIONS)}")
+    for name in layouts:
+        if name not in LAYOUTS:
+            parser.error(f"unknown layout '{name}', choose from: {', '.join(LAYOUTS)}")
+    try:
+        sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    except ValueError as error:
+        parser.error(f"invalid size: {error}")
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)  # Read first, so a bad path fails before a long run
+
+    report = run(operations, sizes, layouts, args.warmup, args.repeat, args.min_repeat, args.max_seconds,
+                 args.threads)
+    status = 0
+    if baseline is not None:
+        report["comparison"] = compare(report, baseline, args.tolerance)
+        for case in report["comparison"]:
+            if case["regression"]:
+                status = 1
+                print(f"REGRESSION {case['operation']} {case['width']}x{case['height']} {case['layout']}: "
+                      f"{case['baseline_ns'] / 1e6:.3f} ms -> {case['current_ns'] / 1e6:.3f} ms "
+                      f"(x{case['ratio']:.2f})", file=sys.stderr)
+        regressions = sum(case["regression"] for case in report["comparison"])
+        print(f"{regressions} regression(s) in {len(report['comparison'])} compared case(s)", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
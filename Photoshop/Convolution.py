@@ -0,0 +1,99 @@
+from scipy.signal import fftconvolve
+import numpy as np
+import cv2
+
+
+class Convolution:
+    """Kernel filtering engine choosing separable, direct, FFT or integral image execution"""
+    FFT_THRESHOLD: int = 25 * 25  # Non-separable kernels with more taps than this are filtered in the frequency domain
+    SEPARABLE_TOLERANCE: float = 1e-6
+
+    def __init__(self, fft_threshold: int = FFT_THRESHOLD) -> None:
+        self.fft_threshold: int = fft_threshold
+
+    @staticmethod
+    def separate(kernel: np.ndarray, tolerance: float = SEPARABLE_TOLERANCE) -> [tuple[np.ndarray, np.ndarray], None]:
+        """Split a rank-1 kernel into its column and row vectors, None if it is not separable"""
+        kernel = np.asarray(kernel, dtype=np.float64)
+        if kernel.ndim == 2 and kernel.shape[1] == 1:
+            return kernel.reshape(-1, 1), np.ones((1, 1))  # A column, the row factor is the identity
+        if kernel.ndim != 2 or kernel.shape[0] == 1:
+            return np.ones((1, 1)), kernel.reshape(1, -1)
+        u, s, vt = np.linalg.svd(kernel)
+        if s[0] == 0 or s[1] > tolerance * s[0]:
+            return None
+        column, row = u[:, 0] * s[0], vt[0]
+        # Normalize the column by its smallest tap, which recovers the exact integers of kernels like Sobel
+        scale = np.min(np.abs(column[np.abs(column) > tolerance * np.abs(column).max()]))
+        scale *= np.sign(column[np.argmax(np.abs(column))])
+        column, row = column / scale, row * scale
+        if np.allclose(column, np.rint(column)) and np.allclose(row, np.rint(row)):
+            column, row = np.rint(column), np.rint(row)
+        return column.reshape(-1, 1), row.reshape(1, -1)
+
+    def method(self, kernel: np.ndarray) -> str:
+        """The execution strategy chosen for the kernel"""
+        kernel = np.asarray(kernel, dtype=np.float64)
+        if self.separate(kernel) is not None:
+            return "separable"
+        if kernel.size > self.fft_threshold:
+            return "fft"
+        return "direct"
+
+    def filter(self, arr: np.ndarray, kernel: np.ndarray, dtype: type = np.uint8, method: str = "auto") -> np.ndarray:
+        """Correlate an (H, W) or (H, W, C) image with the kernel, like cv2.filter2D with reflected borders
+
+        The result is rounded and saturated for uint8, otherwise returned as float32
+        method: "auto", "separable", "direct" or "fft"
+        """
+        kernel = np.asarray(kernel, dtype=np.float64)
+        arr = np.ascontiguousarray(arr)
+        ddepth = cv2.CV_8U if dtype == np.uint8 else cv2.CV_32F
+
+        if method == "auto":
+            method = self.method(kernel)
+
+        if method == "separable":
+            column, row = self.separate(kernel)
+            return cv2.sepFilter2D(arr, ddepth, row.astype(np.float32), column.astype(np.float32))
+        if method == "fft":
+            return self._filter_fft(arr, kernel, dtype)
+        return cv2.filter2D(arr, ddepth, kernel.astype(np.float32))
+
+    @staticmethod
+    def _filter_fft(arr: np.ndarray, kernel: np.ndarray, dtype: type) -> np.ndarray:
+        """Frequency domain filtering, cost independent of the kernel size"""
+        k_h, k_w = kernel.shape
+        # Same anchor and border handling as cv2.filter2D
+        top, left = k_h // 2, k_w // 2
+        padded = cv2.copyMakeBorder(arr, top, k_h - 1 - top, left, k_w - 1 - left, cv2.BORDER_REFLECT_101)
+        padded = padded.astype(np.float32).reshape(padded.shape[0], padded.shape[1], -1)
+        flipped = kernel[::-1, ::-1].astype(np.float32)[..., None]  # Convolution of the flipped kernel is correlation
+        result = fftconvolve(padded, flipped, mode="valid", axes=(0, 1)).reshape(arr.shape)
+        if dtype == np.uint8:
+            return np.rint(result).clip(0, 255).astype(np.uint8)
+        return result.astype(np.float32)
+
+    @staticmethod
+    def box(arr: np.ndarray, size: int) -> np.ndarray:
+        """Mean filter of any size from an integral image, four lookups per pixel whatever the size"""
+        arr = np.ascontiguousarray(arr)
+        before = size // 2
+        after = size - 1 - before
+        padded = cv2.copyMakeBorder(arr, before, after, before, after, cv2.BORDER_REFLECT_101)
+        sums = cv2.integral(padded, sdepth=cv2.CV_64F)  # Exact for any realistic image size
+        sums = sums.reshape(sums.shape[0], sums.shape[1], -1)
+        height, width = arr.shape[:2]
+        total = (sums[size:size + height, size:size + width] - sums[:height, size:size + width]
+                 - sums[size:size + height, :width] + sums[:height, :width])
+        return np.rint(total / (size * size)).clip(0, 255).astype(arr.dtype).reshape(arr.shape)
+
+    @staticmethod
+    def gaussian_radius(sigma: float, truncate: float = 4.0) -> int:
+        return max(int(truncate * sigma + 0.5), 1)
+
+    def gaussian(self, arr: np.ndarray, sigma: float, truncate: float = 4.0) -> np.ndarray:
+        """Gaussian blur as two 1-D passes, cost grows with the radius instead of the kernel area"""
+        radius = self.gaussian_radius(sigma, truncate)
+        taps = cv2.getGaussianKernel(2 * radius + 1, sigma)
+        return cv2.sepFilter2D(np.ascontiguousarray(arr), -1, taps, taps, borderType=cv2.BORDER_REFLECT_101)
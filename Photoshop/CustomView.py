@@ -1,6 +1,6 @@
 from PyQt6.QtGui import QPainter, QWheelEvent
 from PyQt6.QtWidgets import QGraphicsView
-from PyQt6.QtCore import pyqtSignal
+from PyQt6.QtCore import pyqtSignal, QRectF
 
 
 class CustomView(QGraphicsView):
@@ -48,4 +48,7 @@ class CustomView(QGraphicsView):
             self.scale(factor, factor)
             self.scale_factor = factor
             self.zoom_changed.emit(self.scale_factor)
-    
\ No newline at end of file
+
+    def visible_rect(self) -> QRectF:
+        """The part of the scene currently shown in the viewport"""
+        return self.mapToScene(self.viewport().rect()).boundingRect()
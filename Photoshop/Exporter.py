@@ -0,0 +1,234 @@
+from PyQt6.QtWidgets import (QDialog, QWidget, QFormLayout, QComboBox, QSpinBox, QCheckBox, QDialogButtonBox,
+                             QGraphicsItem)
+from PyQt6.QtGui import QPainter, QTransform
+from PyQt6.QtCore import QRectF, Qt
+from ImageTransformations import ImageTransformations
+from TiledImageItem import TiledImageItem
+from OperationGraph import Node
+from PixelBuffer import PixelBuffer
+from Batch import write_rgba
+from Jobs import Job
+import numpy as np
+import os
+import cv2
+
+
+class ExportOptions:
+    """Encoder settings, turned into the OpenCV parameters of the format written"""
+    FORMATS: dict[str, str] = {".png": "PNG", ".jpg": "JPEG", ".webp": "WebP", ".tif": "TIFF", ".bmp": "BMP"}
+    # Row filters tried before compressing, the filter option only exists in newer OpenCV versions
+    PNG_FILTERS: dict[str, int] = {name: getattr(cv2, flag) for name, flag in (
+        ("none", "IMWRITE_PNG_FILTER_NONE"), ("sub", "IMWRITE_PNG_FILTER_SUB"), ("up", "IMWRITE_PNG_FILTER_UP"),
+        ("average", "IMWRITE_PNG_FILTER_AVG"), ("paeth", "IMWRITE_PNG_FILTER_PAETH"),
+        ("fast", "IMWRITE_PNG_FAST_FILTERS"), ("all", "IMWRITE_PNG_ALL_FILTERS")) if hasattr(cv2, flag)}
+    PNG_STRATEGIES: dict[str, int] = {
+        "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT, "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+        "huffman only": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY, "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+        "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+    }
+    TIFF_COMPRESSIONS: dict[str, int] = {
+        "none": 1, "lzw": 5, "deflate": 8,  # libtiff COMPRESSION_* values
+    }
+
+    def __init__(self, extension: str = ".png", quality: int = 95, progressive: bool = False,
+                 optimize: bool = False, compression: int = 3, png_filter: [str, None] = None,
+                 png_strategy: str = "default", tiff_compression: str = "lzw") -> None:
+        self.extension: str = extension
+        self.quality: int = quality  # JPEG and WebP, 0-100
+        self.progressive: bool = progressive
+        self.optimize: bool = optimize  # Optimal Huffman tables, smaller JPEGs at a little more time
+        self.compression: int = compression  # zlib level of PNGs, 0-9
+        self.png_filter: [str, None] = png_filter  # None leaves the choice to libpng
+        self.png_strategy: str = png_strategy
+        self.tiff_compression: str = tiff_compression
+
+    def params(self, path: str) -> list[int]:
+        """The OpenCV (flag, value, ...) list for writing path, chosen by its extension"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension in (".jpg", ".jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality, cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.progressive),
+                    cv2.IMWRITE_JPEG_OPTIMIZE, int(self.optimize)]
+        if extension == ".png":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.compression,
+                      cv2.IMWRITE_PNG_STRATEGY, self.PNG_STRATEGIES[self.png_strategy]]
+            if self.png_filter is not None:
+                params += [cv2.IMWRITE_PNG_FILTER, self.PNG_FILTERS[self.png_filter]]
+            return params
+        if extension == ".webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, max(1, self.quality)]
+        if extension in (".tif", ".tiff"):
+            return [cv2.IMWRITE_TIFF_COMPRESSION, self.TIFF_COMPRESSIONS[self.tiff_compression]]
+        return []
+
+
+class ExportDialog(QDialog):
+    """Asks for the encoder options, showing only those of the chosen format"""
+
+    def __init__(self, options: ExportOptions, choose_format: bool = True, parent: [QWidget, None] = None) -> None:
+        super(ExportDialog, self).__init__(parent)
+        self.setWindowTitle("Export Options")
+        layout = QFormLayout(self)
+
+        self.format = QComboBox()
+        for extension, name in ExportOptions.FORMATS.items():
+            self.format.addItem(name, extension)
+        self.format.setCurrentIndex(max(0, self.format.findData(options.extension)))
+        self.format.currentIndexChanged.connect(self._show_options)
+        self.quality = QSpinBox()
+        self.quality.setRange(0, 100)
+        self.quality.setValue(options.quality)
+        self.progressive = QCheckBox("Progressive")
+        self.progressive.setChecked(options.progressive)
+        self.optimize = QCheckBox("Optimize Huffman tables")
+        self.optimize.setChecked(options.optimize)
+        self.compression = QSpinBox()
+        self.compression.setRange(0, 9)
+        self.compression.setValue(options.compression)
+        self.png_filter = QComboBox()
+        self.png_filter.addItem("automatic", None)
+        for name in ExportOptions.PNG_FILTERS:
+            self.png_filter.addItem(name, name)
+        self.png_filter.setCurrentIndex(max(0, self.png_filter.findData(options.png_filter)))
+        self.png_strategy = QComboBox()
+        self.png_strategy.addItems(list(ExportOptions.PNG_STRATEGIES))
+        self.png_strategy.setCurrentText(options.png_strategy)
+        self.tiff_compression = QComboBox()
+        self.tiff_compression.addItems(list(ExportOptions.TIFF_COMPRESSIONS))
+        self.tiff_compression.setCurrentText(options.tiff_compression)
+
+        self.rows: dict[str, list[QWidget]] = {
+            ".jpg": [self.quality, self.progressive, self.optimize], ".webp": [self.quality],
+            ".png": [self.compression, self.png_filter, self.png_strategy], ".tif": [self.tiff_compression],
+        }
+        if choose_format:
+            layout.addRow("Format:", self.format)
+        layout.addRow("Quality:", self.quality)
+        layout.addRow("", self.progressive)
+        layout.addRow("", self.optimize)
+        layout.addRow("Compression level:", self.compression)
+        if ExportOptions.PNG_FILTERS:
+            layout.addRow("Row filter:", self.png_filter)
+        layout.addRow("Compression strategy:", self.png_strategy)
+        layout.addRow("Compression:", self.tiff_compression)
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self._show_options()
+
+    def _show_options(self) -> None:
+        layout = self.layout()
+        shown = self.rows.get(self.format.currentData(), [])
+        for widgets in self.rows.values():
+            for widget in widgets:
+                if layout.indexOf(widget) >= 0:
+                    layout.setRowVisible(widget, any(widget is other for other in shown))
+
+    def options(self) -> ExportOptions:
+        return ExportOptions(self.format.currentData(), self.quality.value(), self.progressive.isChecked(),
+                             self.optimize.isChecked(), self.compression.value(), self.png_filter.currentData(),
+                             self.png_strategy.currentText(), self.tiff_compression.currentText())
+
+
+class Exporter:
+    """Encodes scene items to files on worker threads
+
+    On the GUI thread the pixels are only shared copy-on-write, so the images can be edited while they are
+    written. Copying them, evaluating pending operations and flattening several items run on the worker.
+    Tiled images are rendered tile by tile into a memory-mapped file, the encoder reads its rows as it goes.
+    """
+    STREAMED: tuple[str, ...] = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")  # libwebp needs the whole image
+
+    def __init__(self, transformations: ImageTransformations) -> None:
+        self.transformations: ImageTransformations = transformations
+
+    @staticmethod
+    def _encoder(path: str, options: ExportOptions, fill: [callable, None] = None) -> callable:
+        def encode(img_array: np.ndarray) -> None:
+            if fill is not None:
+                fill(img_array)  # Pending operations, or the flattened items
+            write_rgba(path, img_array, options.params(path))
+        encode.name = "export"
+        return encode
+
+    @staticmethod
+    def _tiled_encoder(item: TiledImageItem, path: str, options: ExportOptions) -> callable:
+        params = options.params(path)
+        channels = 3 if path.lower().endswith((".jpg", ".jpeg", ".bmp")) else 4  # Without alpha, as write_rgba
+        conversion = cv2.COLOR_RGBA2BGR if channels == 3 else cv2.COLOR_RGBA2BGRA
+
+        def render_and_encode(img_array: np.ndarray) -> None:
+            # The mapped file is reused as a packed image in the channel order of OpenCV, so it is encoded as is
+            height, width = img_array.shape[:2]
+            image = img_array.reshape(-1)[:height * width * channels].reshape(height, width, channels)
+            size = item.TILE_SIZE
+            for ty in range(-(-height // size)):
+                for tx in range(-(-width // size)):
+                    tile = cv2.cvtColor(item.render_region(0, tx, ty), conversion)
+                    image[ty * size:ty * size + tile.shape[0], tx * size:tx * size + tile.shape[1]] = tile
+            if not cv2.imwrite(path, image, params):
+                raise ValueError(f"Cannot encode {path}")
+        render_and_encode.name = "export"
+        return render_and_encode
+
+    def _job(self, work: list[tuple[QGraphicsItem, PixelBuffer, callable]], pins: list[Node]) -> Job:
+        job = Job(work, lambda item, buffer: None)
+        job.finished.connect(lambda _: self.transformations.graph.release(pins))
+        return job
+
+    def export_items(self, items: list[QGraphicsItem], paths: list[str], options: ExportOptions) -> Job:
+        """A job writing each item to its path, the items are encoded in parallel"""
+        for item, path in zip(items, paths):
+            if isinstance(item, TiledImageItem) and not path.lower().endswith(self.STREAMED):
+                name = ExportOptions.FORMATS.get(os.path.splitext(path)[1].lower(), "These")
+                raise ValueError(f"{name} files are encoded from the whole image, tiled images cannot be written")
+        work, pins = [], []
+        for item, path in zip(items, paths):
+            if isinstance(item, TiledImageItem):
+                buffer = self.transformations.store.allocate(item.source.width, item.source.height, mapped=True)
+                work.append((item, buffer, self._tiled_encoder(item, path, options)))
+            else:
+                buffer, evaluate = self.transformations.snapshot(item, pins)
+                work.append((item, buffer, self._encoder(path, options, evaluate)))
+        return self._job(work, pins)
+
+    def flatten(self, items: list[QGraphicsItem], pins: list[Node]) -> tuple[PixelBuffer, callable]:
+        """A buffer covering the items and the kernel drawing them into it, to be run on the worker
+
+        The items are drawn in their stacking order, at one pixel per scene unit.
+        """
+        if any(isinstance(item, TiledImageItem) for item in items):
+            raise ValueError("Tiled images are too large to be flattened, export them on their own")
+        rect = QRectF()
+        for item in items:
+            rect = rect.united(item.mapRectToScene(QRectF(item.pixmap().rect())))
+        rect = rect.toAlignedRect()
+        order = {id(item): index for index, item in enumerate(items[0].scene().items(Qt.SortOrder.AscendingOrder))}
+        layers = []
+        for item in sorted(items, key=lambda item: order[id(item)]):
+            transform = item.sceneTransform() * QTransform.fromTranslate(-rect.x(), -rect.y())
+            layers.append((transform, QRectF(item.pixmap().rect()), *self.transformations.snapshot(item, pins)))
+        buffer = self.transformations.store.allocate(rect.width(), rect.height())
+
+        def draw(img_array: np.ndarray) -> None:
+            img_array[...] = 0  # Transparent where no item covers the image
+            painter = QPainter(buffer.image)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            while layers:
+                transform, target, snapshot, evaluate = layers.pop(0)  # Its pixels are freed once drawn
+                pixels = snapshot.array  # Copies the shared pixels here, or evaluates the pending operations
+                if evaluate is not None:
+                    evaluate(pixels)
+                image = snapshot.image  # At full resolution, the item may show it at a lower one
+                painter.setTransform(transform)
+                painter.drawImage(target, image, QRectF(image.rect()))
+            painter.end()
+        draw.name = "flatten"
+        return buffer, draw
+
+    def export_flattened(self, items: list[QGraphicsItem], path: str, options: ExportOptions) -> Job:
+        """A job writing the items flattened into a single image"""
+        pins = []
+        buffer, draw = self.flatten(items, pins)
+        encode = self._encoder(path, options, draw)
+        return self._job([(None, buffer, encode)], pins)
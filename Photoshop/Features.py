@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from TileScheduler import TileScheduler
+from Pyramid import Pyramid
+import numpy as np
+import threading
+import math
+import zlib
+import cv2
+
+
+class Features:
+    """Shi-Tomasi corner detection for large images, the same corners as `cv2.goodFeaturesToTrack`
+
+    The minimum eigenvalue map and its 3x3 local maxima are computed over halo-padded tiles in parallel,
+    then merged globally: thresholded by the quality level, sorted by response and thinned to the minimum
+    distance. The sorted candidates are cached by image content, so detecting again on the same pixels with
+    another corner count, quality level or distance skips the eigenvalue map. Images larger than
+    DETECT_PIXELS are detected on a pyramid level and the corners refined at full resolution.
+    """
+    BLOCK_SIZE: int = 3  # Neighbourhood of the covariance matrix, as in goodFeaturesToTrack
+    MIN_QUALITY: float = 0.01  # Weaker candidates are not cached, lower quality levels detect again
+    CHUNK: int = 4096  # Candidates converted to Python numbers at a time while thinning
+    DETECT_PIXELS: int = 4096 * 4096  # Larger images are detected on the first pyramid level below this size
+    CACHE_BYTES: int = 64 * 1024 * 1024
+    MARKER_RADIUS: int = 5
+
+    def __init__(self, tiles: [TileScheduler, None] = None, cache_bytes: int = CACHE_BYTES) -> None:
+        self.tiles: TileScheduler = tiles or TileScheduler()
+        self.cache_bytes: int = cache_bytes
+        # (shape, checksum, level) -> (quality floor, x y positions, responses, peak response), least recent first
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def gray(img_array: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(img_array, cv2.COLOR_RGBA2GRAY if img_array.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+
+    def _local_maxima(self, gray: np.ndarray) -> np.ndarray:
+        """The minimum eigenvalue where it is the maximum of its 3x3 neighbourhood, 0 elsewhere"""
+        eigenvalues = cv2.cornerMinEigenVal(gray, self.BLOCK_SIZE, ksize=3)
+        eigenvalues[eigenvalues != cv2.dilate(eigenvalues, None)] = 0
+        return eigenvalues
+
+    def candidates(self, gray: np.ndarray, min_quality: float = MIN_QUALITY) -> tuple[np.ndarray, np.ndarray, float]:
+        """(N, 2) x, y positions of the local maxima, strongest first, their responses and the peak response
+
+        Only maxima of at least min_quality times the peak are kept. Ties come in reverse raster order, like
+        goodFeaturesToTrack, which sorts equal responses by descending address.
+        """
+        # Sobel and block sums read BLOCK_SIZE // 2 + 1 pixels around each output pixel, the dilation one more
+        maxima = self.tiles.run(self._local_maxima, gray, halo=self.BLOCK_SIZE // 2 + 2)
+        maxima[[0, -1], :] = 0  # goodFeaturesToTrack skips the one pixel border
+        maxima[:, [0, -1]] = 0
+        peak = float(maxima.max(initial=0.0))
+        ys, xs = np.nonzero(maxima > max(peak * min_quality, 0.0))
+        ys, xs = ys[::-1], xs[::-1]  # Reverse raster order, kept for equal responses by the stable sort
+        responses = maxima[ys, xs]
+        order = np.argsort(-responses, kind="stable")
+        positions = np.stack((xs[order], ys[order]), axis=1).astype(np.int32)
+        return positions, responses[order], peak
+
+    def _cached_candidates(self, gray: np.ndarray, level: int,
+                           quality_level: float) -> tuple[np.ndarray, np.ndarray, float]:
+        key = (gray.shape, zlib.crc32(gray), level)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] <= quality_level:
+                self._cache.move_to_end(key)
+                return entry[1:]
+
+        floor = min(self.MIN_QUALITY, quality_level)
+        positions, responses, peak = self.candidates(Pyramid(gray).level(level) if level else gray, floor)
+        with self._lock:
+            self._cache[key] = (floor, positions, responses, peak)
+            used = sum(entry[1].nbytes + entry[2].nbytes for entry in self._cache.values())
+            while used > self.cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)  # Also the new entry, if it alone is too large
+                used -= evicted[1].nbytes + evicted[2].nbytes
+        return positions, responses, peak
+
+    @classmethod
+    def select(cls, positions: np.ndarray, responses: np.ndarray, peak: float, max_corners: int,
+               quality_level: float, min_distance: float) -> np.ndarray:
+        """Greedily keep the strongest candidates at least min_distance from every corner kept before them"""
+        count = int(np.searchsorted(-responses, -peak * quality_level, side="left"))
+        positions = positions[:count]
+        limit = max_corners if max_corners > 0 else len(positions)  # goodFeaturesToTrack: 0 means no limit
+        if min_distance < 1:
+            return positions[:limit]
+
+        cell = math.ceil(min_distance)
+        distance_sq = min_distance * min_distance
+        grid: dict[tuple[int, int], list[tuple[int, int]]] = {}  # Cell -> corners kept in it
+        kept = []
+        for start in range(0, len(positions), cls.CHUNK):  # Usually only the first chunks are needed
+            for index, (x, y) in enumerate(positions[start:start + cls.CHUNK].tolist(), start):
+                cx, cy = x // cell, y // cell
+                if any((x - ox) ** 2 + (y - oy) ** 2 < distance_sq for gx in (cx - 1, cx, cx + 1)
+                       for gy in (cy - 1, cy, cy + 1) for ox, oy in grid.get((gx, gy), ())):
+                    continue
+                grid.setdefault((cx, cy), []).append((x, y))
+                kept.append(index)
+                if len(kept) == limit:
+                    return positions[kept]
+        return positions[kept]
+
+    def level_for(self, gray: np.ndarray) -> int:
+        """The first pyramid level with at most DETECT_PIXELS pixels"""
+        pixels = gray.shape[0] * gray.shape[1]
+        return max(0, math.ceil(math.log(pixels / self.DETECT_PIXELS, 4))) if pixels > self.DETECT_PIXELS else 0
+
+    def _refine(self, gray: np.ndarray, corners: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+        """Move corners found on a pyramid level to the strongest full resolution pixel of the area they cover"""
+        height, width = gray.shape
+        scale_x, scale_y = width / shape[1], height / shape[0]
+        radius = math.ceil(max(scale_x, scale_y) / 2)
+        halo = self.BLOCK_SIZE // 2 + 1
+        refined = np.empty_like(corners)
+        for index, (x, y) in enumerate(corners.tolist()):
+            cx, cy = int((x + 0.5) * scale_x), int((y + 0.5) * scale_y)
+            x0, x1 = max(cx - radius, 1), min(cx + radius + 1, width - 1)
+            y0, y1 = max(cy - radius, 1), min(cy + radius + 1, height - 1)
+            top, left = max(y0 - halo, 0), max(x0 - halo, 0)
+            window = gray[top:min(y1 + halo, height), left:min(x1 + halo, width)]
+            eigenvalues = cv2.cornerMinEigenVal(window, self.BLOCK_SIZE, ksize=3)
+            eigenvalues = eigenvalues[y0 - top:y1 - top, x0 - left:x1 - left]
+            wy, wx = np.unravel_index(np.argmax(eigenvalues), eigenvalues.shape)
+            refined[index] = (x0 + wx, y0 + wy)
+        return refined
+
+    def detect(self, img_array: np.ndarray, max_corners: int = 400, quality_level: float = 0.01,
+               min_distance: float = 10, level: [int, None] = None) -> np.ndarray:
+        """(N, 2) integer x, y positions of the Shi-Tomasi corners, strongest first
+
+        level picks the pyramid level to detect on, by default the first one below DETECT_PIXELS.
+        """
+        gray = self.gray(img_array)
+        level = self.level_for(gray) if level is None else level
+        level = min(max(level, 0), Pyramid(gray).count - 1)
+        positions, responses, peak = self._cached_candidates(gray, level, quality_level)
+        if not level:
+            corners = self.select(positions, responses, peak, max_corners, quality_level, min_distance)
+            return corners.astype(np.intp)
+        factor = 2 ** level  # Pyramid levels halve the resolution, rounding up
+        corners = self.select(positions, responses, peak, max_corners, quality_level, min_distance / factor)
+        shape = (-(-gray.shape[0] // factor), -(-gray.shape[1] // factor))
+        return self._refine(gray, corners, shape).astype(np.intp)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    @classmethod
+    def marker(cls, radius: int = MARKER_RADIUS) -> tuple[np.ndarray, np.ndarray]:
+        """The y, x offsets of the pixels cv2.circle draws for a one pixel wide circle of the radius"""
+        canvas = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+        cv2.circle(canvas, (radius, radius), radius, 1, 1)
+        dy, dx = np.nonzero(canvas)
+        return dy - radius, dx - radius
+
+    @classmethod
+    def draw(cls, out: np.ndarray, corners: np.ndarray, color: tuple, radius: int = MARKER_RADIUS) -> np.ndarray:
+        """Draw a circle around every corner in a single scatter, clipped to the image"""
+        dy, dx = cls.marker(radius)
+        ys = (corners[:, 1, None] + dy).ravel()
+        xs = (corners[:, 0, None] + dx).ravel()
+        inside = (ys >= 0) & (ys < out.shape[0]) & (xs >= 0) & (xs < out.shape[1])
+        out[ys[inside], xs[inside]] = color
+        return out
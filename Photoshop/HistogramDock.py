@@ -0,0 +1,81 @@
+from PyQt6.QtWidgets import QDockWidget, QWidget, QVBoxLayout, QCheckBox, QLabel
+from PyQt6.QtGui import QPainter, QColor, QPolygonF, QPaintEvent
+from PyQt6.QtCore import Qt, QPointF, QSize
+import numpy as np
+
+
+class HistogramView(QWidget):
+    """Draws the R, G, B counts of a (256, 3) histogram as overlapping filled curves"""
+    COLORS: tuple[QColor, ...] = (QColor(220, 40, 40), QColor(40, 170, 40), QColor(40, 80, 220))
+
+    def __init__(self, parent: [QWidget, None] = None) -> None:
+        super(HistogramView, self).__init__(parent)
+        self.counts: [np.ndarray, None] = None
+        self.logarithmic: bool = False
+        self.setMinimumSize(256, 120)
+
+    def sizeHint(self) -> QSize:
+        return QSize(300, 160)
+
+    def set_histogram(self, counts: [np.ndarray, None]) -> None:
+        self.counts = counts
+        self.update()
+
+    def set_logarithmic(self, logarithmic: bool) -> None:
+        self.logarithmic = logarithmic
+        self.update()
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.GlobalColor.white)
+        if self.counts is None:
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "No image selected")
+            return
+
+        values = np.log1p(self.counts) if self.logarithmic else self.counts.astype(np.float64)
+        peak = values.max() or 1.0
+        width, height = self.width(), self.height()
+        xs = np.arange(256) * (width - 1) / 255
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Multiply)
+        for channel, color in enumerate(self.COLORS):
+            ys = height - values[:, channel] / peak * (height - 4)
+            polygon = QPolygonF([QPointF(0, height)] + [QPointF(x, y) for x, y in zip(xs, ys)] +
+                                [QPointF(width - 1, height)])
+            fill = QColor(color)
+            fill.setAlpha(90)
+            painter.setPen(color)
+            painter.setBrush(fill)
+            painter.drawPolygon(polygon)
+
+
+class HistogramDock(QDockWidget):
+    """Dock showing the histogram of the selected image(s), kept up to date by the application"""
+    SAMPLES: int = 1024 * 1024  # Pixels counted for display, larger images are subsampled
+
+    def __init__(self, parent: [QWidget, None] = None) -> None:
+        super(HistogramDock, self).__init__("Histogram", parent)
+        self.view = HistogramView()
+        self.logarithmic = QCheckBox("Logarithmic")
+        self.logarithmic.toggled.connect(self.view.set_logarithmic)
+        self.info = QLabel()
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.addWidget(self.view, 1)
+        layout.addWidget(self.logarithmic)
+        layout.addWidget(self.info)
+        self.setWidget(widget)
+
+    def set_histograms(self, histograms: list[np.ndarray]) -> None:
+        """Show the sum of the histograms, nothing if the list is empty"""
+        if not histograms:
+            self.view.set_histogram(None)
+            self.info.setText("")
+            return
+        counts = sum(histograms)
+        self.view.set_histogram(counts)
+        total = counts[:, 0].sum()
+        mean = (np.arange(256) @ counts) / max(1, total)
+        self.info.setText(f"{len(histograms)} image(s), {total} pixels counted, "
+                          f"mean R {mean[0]:.1f} G {mean[1]:.1f} B {mean[2]:.1f}")
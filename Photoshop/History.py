@@ -0,0 +1,157 @@
+from PyQt6.QtWidgets import QGraphicsItem, QGraphicsScene
+from ImageTransformations import ImageTransformations, Parked
+from abc import ABC, abstractmethod
+import numpy as np
+import zlib
+
+
+class Command(ABC):
+    """One undoable edit of the scene"""
+
+    def __init__(self, items: list[QGraphicsItem]) -> None:
+        self.items: list[QGraphicsItem] = items
+
+    @property
+    def nbytes(self) -> int:
+        """Memory the command holds on to"""
+        return 0
+
+    @abstractmethod
+    def undo(self) -> None:
+        pass
+
+    @abstractmethod
+    def redo(self) -> None:
+        pass
+
+
+class AddItems(Command):
+    """Images added to the scene, e.g. the copies of a transformation. Undone they are parked, not kept whole"""
+
+    def __init__(self, scene: QGraphicsScene, transformations: ImageTransformations,
+                 items: list[QGraphicsItem]) -> None:
+        super(AddItems, self).__init__(items)
+        self.scene: QGraphicsScene = scene
+        self.transformations: ImageTransformations = transformations
+        self._parked: [list[Parked, None], None] = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(parked.nbytes for parked in self._parked or [] if parked is not None)
+
+    def _remove(self) -> None:
+        # Last added first, so copies of copies are parked while their source is still in the scene
+        self._parked = [self.transformations.park(item) for item in reversed(self.items)][::-1]
+        for item in self.items:
+            if item.scene() is not None:
+                self.scene.removeItem(item)
+
+    def _add(self) -> None:
+        for item, parked in zip(self.items, self._parked):
+            self.scene.addItem(item)
+            self.transformations.unpark(item, parked)
+        self._parked = None
+
+    undo, redo = _remove, _add
+
+
+class RemoveItems(AddItems):
+    """Images taken off the scene, e.g. cut to the clipboard"""
+
+    def __init__(self, scene: QGraphicsScene, transformations: ImageTransformations,
+                 items: list[QGraphicsItem]) -> None:
+        super(RemoveItems, self).__init__(scene, transformations, items)
+        self._remove()
+
+    undo, redo = AddItems._add, AddItems._remove
+
+
+class EditRegion(Command):
+    """A local edit of an image, kept as the compressed XOR of its old and new pixels"""
+
+    def __init__(self, transformations: ImageTransformations, item: QGraphicsItem,
+                 rect: tuple[int, int, int, int], delta: np.ndarray) -> None:
+        super(EditRegion, self).__init__([item])
+        self.transformations: ImageTransformations = transformations
+        self.rect: tuple[int, int, int, int] = rect
+        self.shape: tuple = delta.shape
+        self.data: bytes = zlib.compress(np.ascontiguousarray(delta), 1)  # Zero outside the changed pixels
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def _apply(self) -> None:
+        delta = np.frombuffer(zlib.decompress(self.data), dtype=np.uint8).reshape(self.shape)
+        self.transformations.apply_delta(self.items[0], self.rect, delta)
+
+    undo = redo = _apply
+
+
+class History:
+    """Undo and redo stacks, commands are forgotten when they hold more memory than the budget"""
+    DEFAULT_BUDGET: int = 256 * 1024 * 1024  # 256 MiB
+
+    def __init__(self, budget: int = DEFAULT_BUDGET) -> None:
+        self.budget: int = budget
+        self._undo: list[Command] = []
+        self._redo: list[Command] = []
+
+    @property
+    def used(self) -> int:
+        return sum(command.nbytes for command in self._undo + self._redo)
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def set_budget(self, budget: int) -> None:
+        self.budget = budget
+        self._trim()
+
+    def push(self, command: Command) -> None:
+        """Record a command that was just done, the undone ones cannot be redone anymore"""
+        self._undo.append(command)
+        self._redo = []
+        self._trim()
+
+    def undo(self) -> None:
+        if self._undo:
+            command = self._undo.pop()
+            command.undo()
+            self._redo.append(command)
+            self._trim()
+
+    def redo(self) -> None:
+        if self._redo:
+            command = self._redo.pop()
+            command.redo()
+            self._undo.append(command)
+            self._trim()
+
+    def discard(self, items: list[QGraphicsItem]) -> None:
+        """Forget the commands of items removed by other means, e.g. the copies of a cancelled transformation"""
+        self._undo = [command for command in self._undo if not any(item in items for item in command.items)]
+        self._redo = [command for command in self._redo if not any(item in items for item in command.items)]
+
+    def clear(self) -> None:
+        self._undo, self._redo = [], []
+
+    def _trim(self) -> None:
+        """Forget commands holding memory until the budget is met, the redo ones first, then the oldest undo ones
+
+        The commands only replay in order, so a stack loses everything from its far end up to the command
+        freeing the memory. Commands holding nothing are never dropped on their own.
+        """
+        used = self.used
+        while used > self.budget:
+            stack = self._redo if any(command.nbytes for command in self._redo) else self._undo
+            if not any(command.nbytes for command in stack):
+                break  # Nothing left to free
+            while True:
+                freed = stack.pop(0).nbytes
+                if freed:
+                    used -= freed
+                    break
@@ -0,0 +1,188 @@
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, QSize, QStandardPaths, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader
+from PyQt6.QtWidgets import QGraphicsItem
+import itertools
+import threading
+import hashlib
+import os
+
+
+class ThumbnailCache:
+    """Reduced-size previews of image files kept on disk, keyed by path, modification time and file size
+
+    Editing or replacing a file changes its key, so a stale preview is never shown. Beyond the budget the
+    least recently written previews are deleted.
+    """
+    DEFAULT_BUDGET: int = 256 * 1024 * 1024  # 256 MiB
+    TRIM_EVERY: int = 32  # Writes between two checks of the budget
+
+    def __init__(self, directory: [str, None] = None, budget: int = DEFAULT_BUDGET) -> None:
+        if directory is None:
+            directory = os.path.join(QStandardPaths.writableLocation(
+                QStandardPaths.StandardLocation.GenericCacheLocation), "photoshop", "thumbnails")
+        self.directory: str = directory
+        self.budget: int = budget
+        self._writes = itertools.count(1)
+
+    def _file(self, path: str, size: int) -> [str, None]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{size}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())  # The reader sniffs the format
+
+    def get(self, path: str, size: int) -> [QImage, None]:
+        """The preview of the file at most size pixels wide and high, None if it is not cached"""
+        file = self._file(path, size)
+        if file is None or not os.path.exists(file):
+            return None
+        image = QImage(file)
+        return None if image.isNull() else image
+
+    def put(self, path: str, size: int, image: QImage) -> None:
+        """Store a preview, safe to call from several threads at once"""
+        file = self._file(path, size)
+        if file is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f"{file}.{threading.get_ident()}.tmp"
+        # JPEG is an order of magnitude faster to write than PNG, which is only needed to keep transparency
+        if image.save(temporary, "PNG" if image.hasAlphaChannel() else "JPEG", 90):
+            os.replace(temporary, file)  # Atomic, a concurrent reader sees the whole file or none
+        if next(self._writes) % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self) -> None:
+        """Delete the oldest previews until the cache fits the budget"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if not entry.name.endswith(".tmp")]
+        except OSError:
+            return
+        files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+        used = sum(size for _, size, _ in files)
+        for _, size, file in files:
+            if used <= self.budget:
+                break
+            try:
+                os.remove(file)
+                used -= size
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        budget, self.budget = self.budget, 0
+        self.trim()
+        self.budget = budget
+
+
+class _LoadTask(QRunnable):
+    """Decodes the preview or the full resolution of one file in a pool thread"""
+
+    def __init__(self, loader: "ImageLoader", key: int, path: str, preview: bool) -> None:
+        super(_LoadTask, self).__init__()
+        self.loader = loader
+        self.key = key
+        self.path = path
+        self.preview = preview
+
+    def run(self) -> None:
+        if self.key not in self.loader._items:
+            return  # Cancelled before its turn came
+        try:
+            if self.preview:
+                image, cached = self.loader.read_preview(self.path)
+                if image is not None:
+                    self.loader._preview_ready.emit(self.key, image)
+                if image is not None and not cached:
+                    self.loader.thumbnails.put(self.path, self.loader.PREVIEW_SIZE, image)  # Once it is shown
+            else:
+                self.loader._loaded.emit(self.key, self.loader.read(self.path))
+        except Exception as error:  # Reported on the GUI thread through the failed signal
+            if not self.preview:
+                self.loader._failed.emit(self.key, f"{self.path}: {error}")
+
+
+class ImageLoader(QObject):
+    """Decodes image files in a thread pool, announcing a reduced-size preview first and then the full image
+
+    Previews come from the thumbnail cache, or from a scaled decode, which JPEG files do in the DCT domain
+    at a fraction of the full cost. Images smaller than a preview get none.
+    """
+    PREVIEW_SIZE: int = 1024  # Longest side of the previews
+    preview_ready = pyqtSignal(object, QImage)  # Item, preview
+    loaded = pyqtSignal(object, QImage)  # Item, full resolution image
+    failed = pyqtSignal(object, str)  # Item, error message
+    _preview_ready = pyqtSignal(int, QImage)  # Emitted from the pool threads, delivered on the GUI thread
+    _loaded = pyqtSignal(int, QImage)
+    _failed = pyqtSignal(int, str)
+
+    def __init__(self, thumbnails: [ThumbnailCache, None] = None, pool: [QThreadPool, None] = None) -> None:
+        super(ImageLoader, self).__init__()
+        self.thumbnails: ThumbnailCache = thumbnails or ThumbnailCache()
+        self.pool: QThreadPool = pool or QThreadPool()
+        self._items: dict[int, QGraphicsItem] = {}  # Key of a pending file -> item waiting for it
+        self._keys = itertools.count()
+        self._preview_ready.connect(self._on_preview_ready)
+        self._loaded.connect(self._on_loaded)
+        self._failed.connect(self._on_failed)
+
+    @staticmethod
+    def size(path: str) -> QSize:
+        """Width and height of the image, read from the header of the file only"""
+        reader = QImageReader(path)
+        size = reader.size()
+        if not size.isValid():
+            raise ValueError(f"Cannot read {path}: {reader.errorString()}")
+        return size
+
+    def load(self, path: str, item: QGraphicsItem, size: QSize) -> None:
+        """Decode the file of the given size for the item in the background, previews start before full images"""
+        key = next(self._keys)
+        self._items[key] = item
+        if max(size.width(), size.height()) > self.PREVIEW_SIZE:
+            self.pool.start(_LoadTask(self, key, path, preview=True), priority=1)
+        self.pool.start(_LoadTask(self, key, path, preview=False), priority=0)
+
+    def is_loading(self, item: QGraphicsItem) -> bool:
+        return any(item is loading for loading in self._items.values())
+
+    def cancel_all(self) -> None:
+        """Forget the pending files, those being decoded finish but are not announced"""
+        self._items.clear()
+
+    def read_preview(self, path: str) -> tuple[[QImage, None], bool]:
+        """The preview of the file and whether it came from the thumbnail cache, None if it cannot be decoded"""
+        image = self.thumbnails.get(path, self.PREVIEW_SIZE)
+        if image is not None:
+            return image, True
+        reader = QImageReader(path)
+        size = reader.size()
+        if not size.isValid():
+            return None, False
+        reader.setScaledSize(size.scaled(self.PREVIEW_SIZE, self.PREVIEW_SIZE, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        return (None if image.isNull() else image), False
+
+    @staticmethod
+    def read(path: str) -> QImage:
+        reader = QImageReader(path)
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(reader.errorString())
+        return image
+
+    def _on_preview_ready(self, key: int, image: QImage) -> None:
+        item = self._items.get(key)
+        if item is not None:
+            self.preview_ready.emit(item, image)
+
+    def _on_loaded(self, key: int, image: QImage) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.loaded.emit(item, image)
+
+    def _on_failed(self, key: int, message: str) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.failed.emit(item, message)
@@ -1,220 +1,662 @@
 from PyQt6.QtWidgets import QGraphicsItem, QGraphicsPixmapItem
-from PyQt6.QtGui import QImage, QPixmap, QColor
-from scipy.ndimage import gaussian_filter
-import matplotlib.pyplot as plt
+from PyQt6.QtCore import QCoreApplication, QTimer, Qt
+from OperationGraph import Node, OperationGraph, Step
+from PyQt6.QtGui import QImage, QPixmap
+from PixelBuffer import PixelBuffer, CowBuffer
+from PixelStore import PixelStore
+from Profiler import profiler
+from LookupTable import LookupTable
+from Operations import Operations
+from TiledImageItem import TiledImageItem
+from Jobs import Job, JobRunner
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
+import functools
+import math
+import zlib
+import weakref
 import time
-import cv2
+import os
+
+
+class Parked:
+    """Pixels of an image held by the undo history, either how to recompute them or compressed"""
+    __slots__ = ("source", "steps", "shape", "data")
+
+    def __init__(self, source: [QGraphicsPixmapItem, None] = None, steps: [list[Step], None] = None,
+                 shape: [tuple, None] = None, data: bytes = b"") -> None:
+        self.source = source
+        self.steps = steps
+        self.shape = shape
+        self.data = data
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
 
 
 class ImageTransformations:
+    PREVIEW_MIN_PIXELS: int = 4 * 1024 * 1024  # Smaller images are fast enough without a preview
+
     def __init__(self) -> None:
-        pass
+        self.store = PixelStore()
+        self.operations = Operations()
+        self.convolution = self.operations.convolution
+        self.tiles = self.operations.tiles
+        self.pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="item")
+        self.last_timings: list[tuple[QGraphicsItem, float]] = []
+        self.runner: [JobRunner, None] = None  # Set to run the transformations off the calling thread
+        self.graph = OperationGraph(self.operations)
+        self.lazy: bool = False  # Record the operations and evaluate them together once control returns to Qt
+        self._nodes: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # Item -> node of its pending pixels
+        self._versions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # Item -> number of commits
+        self._pending: list[QGraphicsPixmapItem] = []
+        self._evaluation_scheduled: bool = False
+        self.viewport: [callable, None] = None  # Returns (zoom, visible scene rect), enables previews of large images
+        self._previews: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # Item -> preview overlay item
+        # Copy -> (source, node it started from, commits of the source then), copies follow local edits of it
+        self._origins: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # Item -> {(luminance, row step): (version, counts)}, local edits update the counts instead of dropping them
+        self._histograms: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
     @staticmethod
     def measure_time(func: callable, *args, **kwargs) -> float:
         """Utility function to measure the time taken by any function"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         func(*args, **kwargs)
-        end_time = time.time()
+        end_time = time.perf_counter()
         return end_time - start_time
 
     @staticmethod
     def _q_image_to_np(image: QImage) -> np.ndarray:
         """Helper function to convert QImage to a NumPy array"""
-        image = image.convertToFormat(QImage.Format.Format_RGBA8888)
-        width, height = image.width(), image.height()
-        ptr = image.bits()
-        ptr.setsize(image.sizeInBytes())
-        return np.array(ptr).reshape((height, width, 4)).copy()  # Deep copy to ensure memory is properly managed
+        return PixelBuffer(image).array.copy()
 
     @staticmethod
     def _np_to_q_image(arr: np.ndarray, image_format: QImage.Format) -> QImage:
         """Helper function to convert NumPy array back to QImage"""
-        height, width, _ = arr.shape
-        return QImage(arr.data, width, height, image_format).copy()  # Ensure to not reference unsafe memory
+        return PixelBuffer.from_array(arr).image.convertToFormat(image_format)
 
-    def negate(self, selected_items: list[QGraphicsItem]) -> None:
-        """Invert the colors of the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            if pixmap.isNull():
-                continue
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            img_array[..., :3] = 255 - img_array[..., :3]
-            negated_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(negated_image))
+    def _buffer(self, item: QGraphicsPixmapItem) -> [PixelBuffer, None]:
+        """Return the RGBA8888 buffer backing the item, tiled items have none"""
+        if not isinstance(item, QGraphicsPixmapItem):
+            return None
+        return self.store.get(item)
 
-    def grayscale(self, selected_items: list[QGraphicsItem]) -> None:
-        """Convert the selected image(s) to grayscale"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            grayscale_values = np.dot(img_array[..., :3], [0.299, 0.587, 0.114])
-            img_array[..., :3] = grayscale_values[..., None]
-            gray_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(gray_image))
-
-    def gamma_transformation(self, selected_items: list[QGraphicsItem], gamma_value: float) -> None:
-        """Apply gamma transformation on the selected image(s)"""
-        inv_gamma = 1.0 / gamma_value
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            img_array[..., :3] = (255 * ((img_array[..., :3] / 255) ** inv_gamma)).clip(0, 255).astype(np.uint8)
-            gamma_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(gamma_image))
-
-    def logarithmic_transformation(self, selected_items: list[QGraphicsItem]) -> None:
-        """Apply logarithmic transformation on the selected image(s)"""
-        c: float = 255 / np.log(1 + 255)  # Scaling factor for logarithmic transformation
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            img_array[..., :3] = (c * np.log(1 + img_array[..., :3])).clip(0, 255).astype(np.uint8)
-            log_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(log_image))
-
-    def histogram_create(self, selected_items: list[QGraphicsItem]) -> None:
-        """Create a histogram of the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            plt.hist(img_array[..., :3].ravel(), bins=256, color='black', alpha=0.7, histtype='bar', density=True)
-            plt.xlabel('Pixel Intensity')
-            plt.ylabel('Frequency')
-            plt.title('Histogram')
-            plt.show()
-
-    def histogram_equalize(self, selected_items: list[QGraphicsItem]) -> None:
-        """Apply histogram equalization to the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            for i in range(3):  # Apply equalization on R, G, B channels
-                img_array[..., i] = cv2.equalizeHist(img_array[..., i])
-            eq_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(eq_image))
-
-    def filter_box(self, selected_items: list[QGraphicsItem]) -> None:
-        """Apply a box filter (mean filter) on the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            img_array[..., :3] = cv2.blur(img_array[..., :3], (5, 5))
-            filtered_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(filtered_image))
-
-    def filter_gauss(self, selected_items: list[QGraphicsItem]) -> None:
-        """Apply Gaussian filter on the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            img_array[..., :3] = gaussian_filter(img_array[..., :3], sigma=2)
-            gauss_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(gauss_image))
-
-    def edge_sobel(self, selected_items: list[QGraphicsItem]) -> None:
-        """Apply Sobel edge detection on the selected image(s)"""
+    def _commit(self, item: QGraphicsPixmapItem, buffer: PixelBuffer) -> None:
+        """Mark the edited buffer for display, the pixmap is rebuilt once before the next repaint"""
+        self._versions[item] = self._versions.get(item, 0) + 1
+        self.store.mark_dirty(item, buffer)
+
+    def _loader(self, item: QGraphicsPixmapItem) -> callable:
+        """Reload the current pixels of the item for the graph, as long as nothing was committed to it since"""
+        item_ref, version = weakref.ref(item), self._versions.get(item, 0)
+
+        def load() -> [np.ndarray, None]:
+            target = item_ref()
+            if target is None or self._versions.get(target, 0) != version:
+                return None
+            buffer = self._buffer(target)
+            return None if buffer is None else buffer.pixels
+        return load
+
+    def _node(self, item: QGraphicsPixmapItem) -> [Node, None]:
+        """The graph node producing the pixels of the item, the current pixels become a source node if needed"""
+        node = self._nodes.get(item)
+        if node is None:
+            buffer = self._buffer(item)
+            if buffer is None:
+                return None
+            node = self.graph.source(buffer.pixels, self._loader(item))
+            self._set_node(item, node)
+        return node
+
+    def _set_node(self, item: QGraphicsPixmapItem, node: [Node, None]) -> None:
+        previous = self._nodes.pop(item, None)
+        if previous is not None:
+            previous.users -= 1
+        if node is not None:
+            node.users += 1
+            self._nodes[item] = node
+
+    def derive(self, source: QGraphicsPixmapItem, target: QGraphicsPixmapItem) -> None:
+        """Start a copy of source from its recorded operations, so pending work is shared instead of repeated
+
+        The copy follows local edits of the source (see paste_into) until either of them is transformed in place.
+        """
+        node = self._node(source)
+        self.store.duplicate(source, target)  # Shares the decoded array
+        if node is not None:
+            self._set_node(target, node)
+            self._origins[target] = (weakref.ref(source), node, self._versions.get(source, 0))
+            if source in self._pending:
+                self._pending.append(target)
+
+    def is_pending(self, item: QGraphicsPixmapItem) -> bool:
+        return item in self._pending
+
+    def discard(self, item: QGraphicsPixmapItem) -> None:
+        """Forget the pixels and the recorded operations of an item leaving the scene"""
+        self._hide_preview(item)
+        self.store.discard(item)
+        self._set_node(item, None)
+        self._origins.pop(item, None)
+        self._histograms.pop(item, None)
+        if item in self._pending:
+            self._pending.remove(item)
+
+    def clear(self) -> None:
+        self.store.clear()
+        self._previews.clear()
+        self._nodes.clear()
+        self._origins.clear()
+        self._histograms.clear()
+        self._pending = []
+
+    def pixmap(self, item: QGraphicsPixmapItem) -> QPixmap:
+        """Return an up-to-date pixmap of the item, evaluating its recorded operations first"""
+        if isinstance(item, TiledImageItem):
+            return item.overview()
+        if item in self._pending:
+            self.evaluate_pending([item], background=False)
+        return self.store.pixmap(item)
+
+    def snapshot(self, item: QGraphicsPixmapItem, pins: list[Node]) -> tuple[PixelBuffer, [callable, None]]:
+        """The full resolution pixels of the item as they are now, for reading on another thread
+
+        Nothing is copied here, the buffer shares the pixels copy-on-write. With operations still pending it is
+        uninitialized instead and the returned kernel evaluates them into it, from pixels held in pins until
+        they are released.
+        """
+        node = self._nodes.get(item)
+        if item in self._pending and node is not None:
+            self.graph.pin(node, pins)
+            width, height = self.store.size(item)
+            return self.store.allocate(width, height), functools.partial(self.graph.evaluate, node, pins=pins)
+        return CowBuffer(self.store.get(item), self.store.allocate), None
+
+    @staticmethod
+    def _timed(kernel: callable, buffer: PixelBuffer) -> float:
+        img_array = buffer.array
+        start_time = time.perf_counter_ns()
+        kernel(img_array)
+        ns = time.perf_counter_ns() - start_time
+        profiler.record("kernel", ns, img_array.nbytes, buffer.width, buffer.height, getattr(kernel, "name", None))
+        return ns / 1e9
+
+    def _apply(self, selected_items: list[QGraphicsItem], kernel: callable) -> [Job, None]:
+        """Run kernel(img_array) in place on every selected image, in parallel across the images
+
+        Decoding and committing touch Qt objects and stay on the calling (GUI) thread, each result
+        is committed as soon as its image is done. Per-image times are kept in last_timings.
+        With a runner attached the kernels run in the background and the submitted job is returned.
+        In lazy mode a recorded Step is only added to the operation graph of the images.
+        Tiled images only record the step, it runs on their tiles as they become visible.
+        """
+        selected_items = self._apply_tiled(selected_items, [kernel])
+        profiler.operation = getattr(kernel, "name", "")  # Decoding the images is accounted to it
+        if self.lazy and isinstance(kernel, Step):
+            return self._record(selected_items, kernel)
+
+        self.evaluate_pending([item for item in selected_items if item in self._pending], background=False)
+        work = []
         for item in selected_items:
-            pixmap = item.pixmap()
-            if pixmap.isNull():
+            buffer = self._buffer(item)
+            if buffer is not None:
+                self._edit_in_place(item, buffer)
+                work.append((item, buffer, kernel))
+        return self._run(work, self._commit)
+
+    def _edit_in_place(self, item: QGraphicsPixmapItem, buffer: PixelBuffer) -> None:
+        """Prepare the buffer of the item for a kernel writing it in place, on the GUI thread
+
+        Copies still sharing the pixels get their own now, the graph nodes reading them start over.
+        """
+        self._drop_nodes(item, buffer.writable())
+
+    def _drop_nodes(self, item: QGraphicsPixmapItem, written: np.ndarray, keep: bool = False) -> None:
+        """Drop the graph nodes reading pixels about to be written, their items start over from their own pixels
+
+        With keep the node of the item stays, its result is the written array and follows the edit.
+        """
+        own = self._nodes.get(item) if keep else None
+        for other, node in list(self._nodes.items()):
+            if node is own:
+                if other is not item:
+                    self._set_node(other, None)  # A copy sharing the node, its own pixels do not change
                 continue
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            gray = cv2.cvtColor(img_array[..., :3], cv2.COLOR_RGBA2GRAY)
+            result = node.result()
+            reads = result is not None and np.may_share_memory(result, written)
+            if reads:
+                node.invalidate()  # The pixels change in place, the weak reference would see the edits
+            if reads or other is item:
+                self._set_node(other, None)
+
+    def paste_into(self, item: QGraphicsPixmapItem, arr: np.ndarray, x: int, y: int,
+                   done: [callable, None] = None) -> [Job, None]:
+        """Paste RGBA pixels into the image with their top-left corner at (x, y) of its array
+
+        Only the pasted rectangle is written and uploaded, and the copies derived from the image recompute
+        only the part of their operations it reaches. done receives the (x0, y0, x1, y1) rectangle written and
+        the XOR of its old and new pixels, apply_delta() with them undoes and redoes the paste. The paste waits
+        for the job evaluating pending operations that read the pixels, which is returned.
+        """
+        def paste() -> None:
+            buffer = self._buffer(item)
+            if buffer is None:
+                return
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(buffer.width, x + arr.shape[1]), min(buffer.height, y + arr.shape[0])
+            if x0 >= x1 or y0 >= y1:
+                return
+            pixels = arr[y0 - y:y1 - y, x0 - x:x1 - x]
+            delta = buffer.region(y0, y1, x0, x1) ^ pixels
+            self._origins.pop(item, None)  # Its pixels no longer follow its own source
+            self._write_region(item, buffer, (x0, y0, x1, y1), pixels)
+            if done is not None:
+                done((x0, y0, x1, y1), delta)
+        return self._after_pending(item, paste)
+
+    def apply_delta(self, item: QGraphicsPixmapItem, rect: tuple[int, int, int, int],
+                    delta: np.ndarray) -> [Job, None]:
+        """XOR the delta into the (x0, y0, x1, y1) rectangle of the image, undoing or redoing a local edit"""
+        def apply() -> None:
+            x0, y0, x1, y1 = rect
+            buffer = self._buffer(item)
+            self._write_region(item, buffer, rect, buffer.region(y0, y1, x0, x1) ^ delta)
+        return self._after_pending(item, apply)
+
+    def _after_pending(self, item: QGraphicsPixmapItem, edit: callable) -> [Job, None]:
+        """Run a local edit of the image once no pending or running operation reads its pixels any more
+
+        Those of the image and of the copies following it, which the edit reaches, are evaluated first. In the
+        background with a runner attached, the edit then runs when the last job involved finishes, which is
+        returned, e.g. after an earlier edit still waiting for the same job. Other pending images are left alone.
+        """
+        reading, followers = [], [item]
+        while followers:
+            source = followers.pop()
+            reading.append(source)
+            followers += [target for target, origin in self._origins.items() if origin[0]() is source]
+        waiting = [job for job in (self.runner.jobs if self.runner is not None else [])
+                   if any(other in reading for other in job.items)]
+        job = self.evaluate_pending([other for other in reading if other in self._pending])
+        if job is not None:
+            waiting.append(job)
+        if not waiting:
+            edit()
+            return None
+
+        def resume(job: Job) -> None:
+            if job not in waiting:
+                return
+            waiting.remove(job)
+            if job.is_abandoned() or item in job.unfinished:
+                waiting.clear()  # Deleted or dropped on cancel, the edit is lost with it
+            elif not waiting:
+                edit()
+        for other in waiting:
+            other.finished.connect(functools.partial(lambda job, _: resume(job), other))
+        return waiting[-1]
+
+    def park(self, item: QGraphicsItem) -> [Parked, None]:
+        """Release the pixels of an image leaving the scene for the undo history, unpark() brings them back
+
+        A copy still following its source keeps only the operations recorded on it, any other image its
+        pixels compressed. Tiled images hold no pixels, nothing is released.
+        """
+        if not isinstance(item, QGraphicsPixmapItem) or item.pixmap().isNull():
+            return None
+        parked = self._recipe(item)
+        if parked is None:
+            arr = np.ascontiguousarray(self._buffer(item).pixels)
+            parked = Parked(shape=arr.shape, data=zlib.compress(arr, 1))  # Fast level, edits are mostly runs
+        self.discard(item)
+        item.setPixmap(QPixmap())
+        item.setScale(1.0)
+        return parked
 
-            sobel_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-            sobel_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-            sobel = np.hypot(sobel_x, sobel_y).clip(0, 255).astype(np.uint8)
+    def _recipe(self, item: QGraphicsPixmapItem) -> [Parked, None]:
+        """The source and the operations recorded on a copy since, if they still reproduce its pixels"""
+        origin, node = self._origins.get(item), self._nodes.get(item)
+        if origin is None or node is None:
+            return None
+        source_ref, origin_node, version = origin
+        source = source_ref()
+        if source is None or version != self._versions.get(source, 0):
+            return None
+        steps = []
+        while node is not origin_node:
+            if node is None:
+                return None
+            steps.append(node.step)
+            node = node.parent
+        return Parked(source=source, steps=steps[::-1])
 
-            # Add the detected edges as an overlay on the original image
-            img_array[..., :3] = cv2.cvtColor(sobel, cv2.COLOR_GRAY2RGBA)[..., :3]
-            sobel_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(sobel_image))
+    def unpark(self, item: QGraphicsItem, parked: [Parked, None]) -> None:
+        """Bring back the pixels of an image returning to the scene, its source must be as it was when parked"""
+        if parked is None:
+            return
+        if parked.source is not None:
+            self.derive(parked.source, item)
+            self._apply_chain([item], parked.steps)
+            return
+        arr = np.frombuffer(zlib.decompress(parked.data), dtype=np.uint8).reshape(parked.shape)
+        item.setPixmap(PixelBuffer.from_array(arr).to_pixmap())
+        if self.store.scratch is not None:
+            self.store.get(item)  # Back to the scratch disk
+
+    def _write_region(self, item: QGraphicsPixmapItem, buffer: PixelBuffer, rect: tuple[int, int, int, int],
+                      pixels: np.ndarray, keep: bool = False) -> None:
+        """Write the pixels into the (x0, y0, x1, y1) rectangle of the buffer, show them and pass the edit on"""
+        x0, y0, x1, y1 = rect
+        region = buffer.region(y0, y1, x0, x1)
+        version = self._versions.get(item, 0)
+        counts = [(key, cached[1]) for key, cached in self._histograms.get(item, {}).items() if cached[0] == version]
+        for (luminance, step), histogram in counts:
+            histogram -= self._count(region[(-y0) % step:], step, luminance)  # Rows on the grid of the image
+        region[...] = pixels
+        for (luminance, step), histogram in counts:
+            histogram += self._count(region[(-y0) % step:], step, luminance)
+        self._drop_nodes(item, region, keep)
+        self.store.update_region(item, x0, y0, region)
+        self._follow(item, rect)
+
+    def _follow(self, source: QGraphicsPixmapItem, rect: tuple[int, int, int, int]) -> None:
+        """Recompute the part of the copies derived from source the edited (x0, y0, x1, y1) rectangle reaches"""
+        pixels = None
+        for target, (source_ref, origin, version) in list(self._origins.items()):
+            if source_ref() is not source:
+                continue
+            node = self._nodes.get(target)
+            computed = None
+            if node is not None and version == self._versions.get(source, 0):
+                pixels = self._buffer(source).pixels if pixels is None else pixels
+                computed = self.graph.evaluate_region(node, origin, pixels, rect)
+            if computed is None:
+                del self._origins[target]  # Either of them was transformed in place, it no longer follows
+                continue
+            arr, target_rect = computed
+            self._write_region(target, self._buffer(target), target_rect, arr, keep=True)
 
     @staticmethod
-    def edge_laplace(selected_items: list[QGraphicsItem]) -> None:
-        """Apply Laplacian edge detection to the selected image(s)"""
-        for item in selected_items:
-            if isinstance(item, QGraphicsPixmapItem):
-                pixmap = item.pixmap()
-                image = pixmap.toImage().convertToFormat(QImage.Format.Format_RGBA8888)
-                width, height = image.width(), image.height()
-
-                laplacian_image = QImage(width, height, QImage.Format.Format_RGBA8888)
-                laplacian_kernel = np.array([[0, 1, 0], [1, -4, 1], [0, 1, 0]])
-
-                for x in range(1, width - 1):
-                    for y in range(1, height - 1):
-                        r = g = b = 0
-                        for i in range(3):
-                            for j in range(3):
-                                color = image.pixelColor(x - 1 + i, y - 1 + j)
-                                r += color.red() * laplacian_kernel[i, j]
-                                g += color.green() * laplacian_kernel[i, j]
-                                b += color.blue() * laplacian_kernel[i, j]
-
-                        laplace_color = QColor(min(max(r + 128, 0), 255),
-                                               min(max(g + 128, 0), 255),
-                                               min(max(b + 128, 0), 255),
-                                               255)
-                        laplacian_image.setPixelColor(x, y, laplace_color)
-
-                negated_pixmap = QPixmap.fromImage(laplacian_image)
-                item.setPixmap(negated_pixmap)
-
-    def edge_laplace_optimized(self, selected_items: list[QGraphicsItem]) -> None:
+    def _apply_tiled(selected_items: list[QGraphicsItem], steps: list[callable]) -> list[QGraphicsItem]:
+        """Record the steps on the tiled images, returning the other images"""
+        tiled = [item for item in selected_items if isinstance(item, TiledImageItem)]
+        if not tiled:
+            return selected_items
+        for step in steps:
+            if not isinstance(step, Step) or step.halo() is None:
+                raise ValueError(f"{getattr(step, 'name', 'This transformation')} needs the whole image "
+                                 f"and cannot run on tiled images")
+        for item in tiled:
+            for step in steps:
+                item.apply(step)
+        return [item for item in selected_items if not isinstance(item, TiledImageItem)]
+
+    def _run(self, work: list[tuple[QGraphicsItem, PixelBuffer, callable]], commit: callable,
+             background: bool = True) -> [Job, None]:
+        if self.runner is not None and background:
+            return self.runner.submit(Job(work, commit))
+
+        jobs = {self.pool.submit(self._timed, kernel, buffer): (item, buffer) for item, buffer, kernel in work}
+
+        self.last_timings = []
+        for future in as_completed(jobs):
+            item, buffer = jobs[future]
+            self.last_timings.append((item, future.result()))
+            commit(item, buffer)
+
+    def _record(self, selected_items: list[QGraphicsItem], step: Step) -> None:
+        """Add the step to the graph of every image, the evaluation runs once control returns to the event loop"""
         for item in selected_items:
-            pixmap = item.pixmap()
-            if pixmap.isNull():
+            node = self._node(item)
+            if node is None:
                 continue
+            self._set_node(item, self.graph.apply(node, step))
+            if item not in self._pending:
+                self._pending.append(item)
+        if QCoreApplication.instance() is None:
+            self.evaluate_pending()
+        elif not self._evaluation_scheduled:
+            # Steps recorded before the timer fires are fused into a single pass
+            self._evaluation_scheduled = True
+            QTimer.singleShot(0, self.evaluate_pending)
 
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
+    def evaluate_pending(self, items: [list[QGraphicsItem], None] = None, background: bool = True) -> [Job, None]:
+        """Compute the recorded operations of the (pending) images, each into a new buffer
 
-            # Convert to grayscale for edge detection
-            gray = cv2.cvtColor(img_array[..., :3], cv2.COLOR_RGBA2GRAY)
+        Evaluating never writes into an existing array, so the pixels other branches start from stay intact.
+        """
+        if items is None:
+            self._evaluation_scheduled = False
+            items = self._pending
+        items = [item for item in items if item in self._pending]
+        self._pending = [item for item in self._pending if item not in items]
 
-            # Apply the Laplacian operator using OpenCV
-            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-            laplacian = np.abs(laplacian).clip(0, 255).astype(np.uint8)  # Take absolute value and ensure it's in range
+        work, nodes, pins = [], {}, []
+        for item in items:
+            node = self._nodes.get(item)
+            if node is None or item.pixmap().isNull():
+                continue
+            self.graph.pin(node, pins)
+            width, height = self.store.size(item)
+            if background and self.runner is not None and width * height >= self.PREVIEW_MIN_PIXELS:
+                self._show_preview(item, node)
+            kernel = functools.partial(self.graph.evaluate, node, pins=pins)
+            kernel.name = profiler.operation = self._chain_name(node)
+            buffer = self.store.allocate(width, height)
+            work.append((item, buffer, kernel))
+            nodes[id(item)] = node
+        if not work:
+            self.graph.release(pins)
+            return None
+
+        def commit(item: QGraphicsPixmapItem, buffer: PixelBuffer) -> None:
+            self._hide_preview(item)
+            self._commit(item, buffer)
+            node = nodes[id(item)]
+            node.materialize(buffer.array)
+            node.loader = self._loader(item)
 
-            # Convert back to RGBA format to overlay on original image
-            img_array[..., :3] = cv2.cvtColor(laplacian, cv2.COLOR_GRAY2RGBA)[..., :3]
+        job = self._run(work, commit, background)
+        if job is None:
+            self.graph.release(pins)
+        else:
+            job.finished.connect(lambda _: self.graph.release(pins))
+        return job
 
-            # Convert the result back to QImage and set on the item
-            laplace_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(laplace_image))
+    @staticmethod
+    def _chain_name(node: Node) -> str:
+        """The recorded steps evaluating node runs, e.g. negate+filter_gauss"""
+        names = []
+        while node is not None and node.step is not None and node.result() is None:
+            names.append(node.step.name)
+            node = node.parent
+        return "+".join(reversed(names)) or "copy"
+
+    def _show_preview(self, item: QGraphicsPixmapItem, node: Node) -> None:
+        """Overlay a result computed at the zoom level on the visible part of the item, until the full one arrives"""
+        if self.viewport is None:
+            return
+        scale, visible = self.viewport()
+        rect = item.mapFromScene(visible).boundingRect().intersected(item.boundingRect())
+        if rect.isEmpty():
+            return
+        # Item coordinates are those of its pixmap, which may be shown below the resolution of the array
+        s = item.scale()
+        rect = (int(rect.x() * s), int(rect.y() * s), math.ceil(rect.width() * s), math.ceil(rect.height() * s))
+        arr, (x, y), factor = self.graph.preview(node, scale, rect)
+        overlay = self._previews.get(item)
+        if overlay is None:
+            overlay = QGraphicsPixmapItem(item)  # A child, so it follows the item when moved
+            overlay.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+            overlay.setTransformationMode(Qt.TransformationMode.SmoothTransformation)
+            self._previews[item] = overlay
+        overlay.setPixmap(PixelBuffer.from_array(arr).to_pixmap())
+        overlay.setPos(x / s, y / s)
+        overlay.setScale(1 / (factor * s))
+
+    def _hide_preview(self, item: QGraphicsPixmapItem) -> None:
+        overlay = self._previews.pop(item, None)
+        if overlay is not None and overlay.scene() is not None:
+            overlay.scene().removeItem(overlay)
+
+    def _in_place(self, operation: str, *args) -> Step:
+        """Kernel running the named Operations method in place on the image buffer"""
+        return Step(self.operations, operation, args)
+
+    def apply_steps(self, selected_items: list[QGraphicsItem], steps: list[tuple[str, list]]) -> [Job, None]:
+        """Apply a chain of (Operations method, arguments) on the selected image(s)
+
+        In lazy mode the chain is recorded and evaluated in one fused pass, otherwise it runs as a single job.
+        """
+        return self._apply_chain(selected_items, [self._in_place(operation, *args) for operation, args in steps])
+
+    def _apply_chain(self, selected_items: list[QGraphicsItem], steps: list[Step]) -> [Job, None]:
+        selected_items = self._apply_tiled(selected_items, steps)
+        if self.lazy:
+            for step in steps:
+                self._apply(selected_items, step)
+            return None
+
+        def kernel(img_array: np.ndarray) -> None:
+            for step in steps:
+                step(img_array)
+        kernel.name = "+".join(step.name for step in steps)
+        return self._apply(selected_items, kernel)
+
+    def point_operation(self, selected_items: list[QGraphicsItem], *tables: LookupTable) -> [Job, None]:
+        """Apply one or more point operations on the selected image(s), fused into a single lookup table"""
+        table = LookupTable.compose(*tables)
+        return self._apply(selected_items, self._in_place("point_operation", table))
+
+    def negate(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        """Invert the colors of the selected image(s)"""
+        return self._apply(selected_items, self._in_place("negate"))
+
+    def grayscale(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        """Convert the selected image(s) to grayscale"""
+        return self._apply(selected_items, self._in_place("grayscale"))
+
+    def gamma_transformation(self, selected_items: list[QGraphicsItem], gamma_value: float) -> [Job, None]:
+        """Apply gamma transformation on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("gamma_transformation", gamma_value))
+
+    def logarithmic_transformation(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        """Apply logarithmic transformation on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("logarithmic_transformation"))
+
+    def _count(self, arr: np.ndarray, step: int, luminance: bool) -> np.ndarray:
+        if luminance:
+            return self.operations.luminance_histogram(arr, step)
+        return self.operations.histogram(arr, step)
+
+    def histogram(self, item: QGraphicsItem, max_samples: [int, None] = None, luminance: bool = False,
+                  cached_only: bool = False) -> [np.ndarray, None]:
+        """(256, 3) counts of the R, G, B channels of the image, or (256,) of its luma, cached until it is transformed
+
+        With max_samples only every n-th row is counted, about that many pixels, e.g. for display.
+        Local edits update the cached counts instead of dropping them, a copy not transformed yet shares
+        those of its source. Tiled images are counted on their overview. Pending images are evaluated first,
+        unless cached_only, which returns None instead of counting.
+        """
+        origin = self._origins.get(item)
+        if origin is not None and self._nodes.get(item) is origin[1] and item not in self._pending:
+            source = origin[0]()
+            if source is not None and origin[2] == self._versions.get(source, 0):
+                return self.histogram(source, max_samples, luminance, cached_only)
+
+        if isinstance(item, TiledImageItem):
+            step, version = 1, len(item.steps)  # Steps are only ever appended
+        else:
+            if item in self._pending:
+                if cached_only:
+                    return None
+                self.evaluate_pending([item], background=False)
+            width, height = self.store.size(item)
+            step = max(1, (width * height) // max_samples) if max_samples else 1
+            version = self._versions.get(item, 0)
+        cached = self._histograms.setdefault(item, {})
+        key = (luminance, step)
+        if key in cached and cached[key][0] == version:
+            return cached[key][1]
+        if cached_only:
+            return None
+
+        if isinstance(item, TiledImageItem):
+            if item.error is not None:
+                return None
+            try:
+                overview = item.overview()
+            except ValueError:  # Reported through the failed signal of the item
+                return None
+            if overview is None:  # Still being decoded, counted once it is
+                return None
+            counts = self._count(PixelBuffer.from_pixmap(overview).array, 1, luminance)
+        else:
+            buffer = self._buffer(item)
+            if buffer is None:
+                return None
+            counts = self._count(buffer.pixels, step, luminance)
+        cached[key] = (version, counts)
+        return counts
+
+    def histogram_create(self, selected_items: list[QGraphicsItem]) -> list[np.ndarray]:
+        """Create the (256, 3) histograms of the selected image(s)"""
+        self.last_timings = []
+        histograms = [self.histogram(item) for item in selected_items]
+        return [histogram for histogram in histograms if histogram is not None]
+
+    def histogram_equalize(self, selected_items: list[QGraphicsItem], mode: str = "rgb", shared: bool = False,
+                           clip_limit: float = 2.0) -> [Job, None]:
+        """Apply histogram equalization to the selected image(s), in one of the Operations.EQUALIZE_MODES
+
+        With shared every image is equalized with one reference histogram, the sum of theirs, so they come
+        out consistent. Otherwise the cached histograms are passed on, images without one count their own.
+        """
+        if mode not in Operations.EQUALIZE_MODES:
+            raise ValueError(f"Unknown equalization mode '{mode}'")
+        if mode == "clahe":
+            return self._apply(selected_items, self._in_place("histogram_equalize", mode, None, clip_limit))
+        luminance = mode == "luminance"
+        if shared:
+            histograms = [self.histogram(item, luminance=luminance) for item in selected_items]
+            histograms = [histogram for histogram in histograms if histogram is not None]
+            reference = sum(histograms) if histograms else None
+            return self._apply(selected_items, self._in_place("histogram_equalize", mode, reference))
+        if not self.lazy:
+            return self._apply(selected_items, self._in_place("histogram_equalize", mode))
+        for item in selected_items:  # Recorded only, the evaluation still runs once for all of them
+            histogram = self.histogram(item, luminance=luminance, cached_only=True)
+            self._apply([item], self._in_place("histogram_equalize", mode, histogram))
+        return None
+
+    def filter_box(self, selected_items: list[QGraphicsItem], size: int = 5) -> [Job, None]:
+        """Apply a box filter (mean filter) of any size on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("filter_box", size))
+
+    def filter_gauss(self, selected_items: list[QGraphicsItem], sigma: float = 2.0) -> [Job, None]:
+        """Apply Gaussian filter on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("filter_gauss", sigma))
+
+    def filter_kernel(self, selected_items: list[QGraphicsItem], kernel: np.ndarray) -> [Job, None]:
+        """Apply an arbitrary convolution kernel on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("filter_kernel", kernel))
+
+    def edge_sobel(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        """Apply Sobel edge detection on the selected image(s)"""
+        return self._apply(selected_items, self._in_place("edge_sobel"))
+
+    def edge_laplace(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        """Apply Laplacian edge detection to the selected image(s)"""
+        return self._apply(selected_items, self._in_place("edge_laplace"))
+
+    def edge_laplace_optimized(self, selected_items: list[QGraphicsItem]) -> [Job, None]:
+        return self._apply(selected_items, self._in_place("edge_laplace_optimized"))
 
     def corner_detection_kanade(self, selected_items: list[QGraphicsItem], max_corners: int = 400,
-                                quality_level: float = 0.01, min_distance: int = 10) -> None:
+                                quality_level: float = 0.01, min_distance: int = 10) -> [Job, None]:
         """Detect characteristic corners using the Lucas-Kanade (Shi-Tomasi) Operator on the selected image(s)"""
-        for item in selected_items:
-            pixmap = item.pixmap()
-            if pixmap.isNull():
-                continue
-
-            image = pixmap.toImage()
-            img_array = self._q_image_to_np(image)
-            gray = cv2.cvtColor(img_array[..., :3], cv2.COLOR_RGBA2GRAY)
-
-            # Use Shi-Tomasi corner detection (goodFeaturesToTrack)
-            corners = cv2.goodFeaturesToTrack(gray, maxCorners=max_corners,
-                                              qualityLevel=quality_level, minDistance=min_distance)
-            if corners is not None:
-                corners = np.int0(corners)
-                for corner in corners:
-                    x, y = corner.ravel()
-                    cv2.circle(img_array, (x, y), 5, (255, 0, 0, 255), 1)  # Draw red circles for corners
-
-            final_image = self._np_to_q_image(img_array, image.format())
-            item.setPixmap(QPixmap.fromImage(final_image))
+        return self._apply(selected_items, self._in_place("corner_detection_kanade", max_corners,
+                                                          quality_level, min_distance))
@@ -0,0 +1,150 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtWidgets import QGraphicsPixmapItem
+from PixelBuffer import PixelBuffer
+from Profiler import profiler
+import threading
+import time
+
+
+class _ItemTask(QRunnable):
+    """Runs the kernel of a job on one image in a pool thread"""
+
+    def __init__(self, job: "Job", index: int) -> None:
+        super(_ItemTask, self).__init__()
+        self.job = job
+        self.index = index
+
+    def run(self) -> None:
+        if self.job.is_cancelled():
+            self.job._task_done.emit(self.index, -1.0, "")
+            return
+        try:
+            _, buffer, kernel = self.job.work[self.index]
+            img_array = buffer.array
+            start_time = time.perf_counter_ns()
+            kernel(img_array)
+            ns = time.perf_counter_ns() - start_time
+            profiler.record("kernel", ns, img_array.nbytes, buffer.width, buffer.height, getattr(kernel, "name", None))
+            self.job._task_done.emit(self.index, ns / 1e9, "")
+        except Exception as error:  # Reported on the GUI thread through the failed signal
+            self.job._task_done.emit(self.index, -1.0, f"{type(error).__name__}: {error}")
+
+
+class Job(QObject):
+    """A transformation running off the GUI thread, one pool task per image"""
+    progress = pyqtSignal(int, int)  # Finished images, total images
+    item_finished = pyqtSignal(object, float)  # Item, seconds spent in the kernel
+    finished = pyqtSignal(float)  # Wall time of the whole job
+    cancelled = pyqtSignal(list)  # Items that were not processed
+    failed = pyqtSignal(str)
+    _task_done = pyqtSignal(int, float, str)  # Emitted from the pool threads, delivered on the GUI thread
+
+    def __init__(self, work: list[tuple[QGraphicsPixmapItem, PixelBuffer, callable]], commit: callable) -> None:
+        super(Job, self).__init__()
+        self.work: list[tuple[QGraphicsPixmapItem, PixelBuffer, callable]] = work  # Item, buffer, kernel
+        self.commit: callable = commit
+        self.timings: list[tuple[QGraphicsPixmapItem, float]] = []
+        self._cancel_event = threading.Event()
+        self._abandoned: bool = False
+        self._remaining: int = len(work)
+        self._unfinished: list[QGraphicsPixmapItem] = []
+        self._errors: list[str] = []
+        self._start_time: float = 0.0
+        self._task_done.connect(self._on_task_done)
+
+    @property
+    def items(self) -> list[QGraphicsPixmapItem]:
+        return [item for item, _, _ in self.work]
+
+    @property
+    def unfinished(self) -> list[QGraphicsPixmapItem]:
+        """Items skipped or failed so far, the cancelled signal reports them once the job is done"""
+        return self._unfinished
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def is_abandoned(self) -> bool:
+        return self._abandoned
+
+    def cancel(self) -> None:
+        """Skip every image that has not started yet, running ones complete"""
+        self._cancel_event.set()
+
+    def abandon(self) -> None:
+        """Cancel, ignore the images still running or queued for the GUI thread and finish at once
+
+        For when the items are deleted, e.g. a new file. finished is emitted, so whatever waits for the job
+        to end, like the pins of its evaluation, is released.
+        """
+        if self._abandoned:
+            return
+        self._abandoned = True
+        self.cancel()
+        self.finished.emit(time.perf_counter() - self._start_time)
+
+    def start(self, pool: QThreadPool) -> None:
+        self._start_time = time.perf_counter()
+        if not self.work:
+            self.finished.emit(0.0)
+            return
+        for index in range(len(self.work)):
+            pool.start(_ItemTask(self, index))
+
+    def _on_task_done(self, index: int, seconds: float, error: str) -> None:
+        if self._abandoned:
+            return
+        item, buffer, _ = self.work[index]
+        if seconds >= 0:
+            self.commit(item, buffer)
+            self.timings.append((item, seconds))
+            self.item_finished.emit(item, seconds)
+        else:
+            self._unfinished.append(item)
+            if error:
+                self._errors.append(error)
+        self._remaining -= 1
+        self.progress.emit(len(self.work) - self._remaining, len(self.work))
+        if self._remaining:
+            return
+
+        if self._errors:
+            self.failed.emit("\n".join(self._errors))
+        if self._unfinished:
+            self.cancelled.emit(self._unfinished)
+        self.finished.emit(time.perf_counter() - self._start_time)
+
+
+class JobRunner(QObject):
+    """Schedules jobs on a QThreadPool and keeps track of the images they are writing to"""
+    job_started = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+
+    def __init__(self, pool: [QThreadPool, None] = None) -> None:
+        super(JobRunner, self).__init__()
+        self.pool: QThreadPool = pool or QThreadPool.globalInstance()
+        self.jobs: list[Job] = []
+
+    def submit(self, job: Job) -> Job:
+        self.jobs.append(job)
+        job.finished.connect(lambda _: self._on_finished(job))
+        self.job_started.emit(job)
+        job.start(self.pool)
+        return job
+
+    def is_busy(self, item: QGraphicsPixmapItem) -> bool:
+        """Whether a running job is still writing the pixels of the item"""
+        return any(item is busy for job in self.jobs for busy in job.items)
+
+    def cancel_all(self) -> None:
+        for job in self.jobs:
+            job.cancel()
+
+    def abandon_all(self) -> None:
+        """Forget every running job, none of them commits anything afterwards"""
+        for job in list(self.jobs):
+            job.abandon()  # Finishing removes it from jobs
+
+    def _on_finished(self, job: Job) -> None:
+        self.jobs.remove(job)
+        self.job_finished.emit(job)
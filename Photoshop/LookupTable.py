@@ -0,0 +1,102 @@
+from functools import lru_cache
+import numpy as np
+import cv2
+
+
+class LookupTable:
+    """256-entry intensity mapping for the R, G, B channels, the alpha channel is always kept"""
+
+    def __init__(self, table: np.ndarray) -> None:
+        table = np.asarray(table, dtype=np.uint8)
+        if table.shape == (256,):
+            table = np.repeat(table[:, None], 3, axis=1)
+        if table.shape != (256, 3):
+            raise ValueError(f"Lookup table must have shape (256,) or (256, 3), got {table.shape}")
+        self.table: np.ndarray = table
+        self.table.flags.writeable = False  # Tables are shared through the cache
+
+    @classmethod
+    def from_function(cls, func: callable) -> "LookupTable":
+        """Compile an intensity mapping evaluated on every possible uint8 value"""
+        values = np.arange(256, dtype=np.uint8)
+        return cls(np.asarray(func(values)).clip(0, 255).astype(np.uint8))
+
+    @classmethod
+    def curve(cls, points: list[tuple[float, float]]) -> "LookupTable":
+        """Compile a user-defined tone curve through the given (input, output) control points"""
+        x, y = zip(*sorted(points))
+        return cls.from_function(lambda values: np.rint(np.interp(values, x, y)))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def identity() -> "LookupTable":
+        return LookupTable(np.arange(256))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def negate() -> "LookupTable":
+        return LookupTable.from_function(lambda values: 255 - values)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def gamma(gamma_value: float) -> "LookupTable":
+        inv_gamma = 1.0 / gamma_value
+        return LookupTable.from_function(lambda values: 255 * ((values / 255) ** inv_gamma))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def logarithmic() -> "LookupTable":
+        c: float = 255 / np.log(1 + 255)  # Scaling factor for logarithmic transformation
+        return LookupTable.from_function(lambda values: c * np.log(1 + values.astype(np.float64)))
+
+    @classmethod
+    def equalize(cls, hist: np.ndarray) -> "LookupTable":
+        """Histogram equalization table per channel from (256,) or (256, 3) counts, same rounding as cv2.equalizeHist"""
+        hist = np.asarray(hist, dtype=np.int64).reshape(256, -1)
+        table = np.zeros(hist.shape, dtype=np.uint8)
+        for c in range(hist.shape[1]):
+            counts = hist[:, c]
+            nonzero = np.flatnonzero(counts)
+            if nonzero.size == 0:
+                continue
+            first = nonzero[0]
+            if counts[first] == counts.sum():  # Single intensity, map everything onto it
+                table[:, c] = first
+                continue
+            scale = np.float32(255.0) / np.float32(counts.sum() - counts[first])
+            cumulative = np.cumsum(counts[first + 1:])
+            table[first + 1:, c] = np.rint(cumulative.astype(np.float32) * scale).clip(0, 255)
+        return cls(table if table.shape[1] == 3 else table[:, 0])
+
+    def then(self, other: "LookupTable") -> "LookupTable":
+        """Fuse this mapping followed by another one into a single table"""
+        return LookupTable(np.take_along_axis(other.table, self.table.astype(np.intp), axis=0))
+
+    @staticmethod
+    def compose(*tables: "LookupTable") -> "LookupTable":
+        """Fuse a sequence of point operations, applied left to right"""
+        fused = LookupTable.identity()
+        for table in tables:
+            fused = fused.then(table)
+        return fused
+
+    def _layout(self, channels: int) -> np.ndarray:
+        """The table in the (1, 256, channels) layout cv2.LUT expects, an alpha channel maps to itself"""
+        lut = np.empty((1, 256, channels), dtype=np.uint8)
+        lut[0, :, :3] = self.table
+        if channels == 4:
+            lut[0, :, 3] = np.arange(256)
+        return lut
+
+    def apply(self, arr: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Map an (H, W, 3) RGB or (H, W, 4) RGBA uint8 image in a single gather, in place when out is arr"""
+        if out is None:
+            out = np.empty_like(arr)
+        if arr.flags.c_contiguous and out.flags.c_contiguous:
+            cv2.LUT(arr, self._layout(arr.shape[2]), dst=out)
+        else:
+            for i in range(3):
+                np.take(self.table[:, i], arr[..., i], out=out[..., i])
+            if out is not arr and arr.shape[2] == 4:
+                out[..., 3] = arr[..., 3]
+        return out
@@ -0,0 +1,70 @@
+from PyQt6.QtWidgets import QGraphicsPixmapItem, QStyleOptionGraphicsItem, QStyle, QWidget
+from PyQt6.QtGui import QPainter, QPixmap, QPen
+from PyQt6.QtCore import Qt, QRectF
+from collections import OrderedDict
+import math
+
+
+class MipmapCache:
+    """Downsampled pixmaps shared by every MipmapItem, evicted in LRU order under a memory budget"""
+    DEFAULT_BUDGET: int = 256 * 1024 * 1024  # 256 MiB
+
+    def __init__(self, budget: int = DEFAULT_BUDGET) -> None:
+        self.budget: int = budget
+        self.used: int = 0
+        self._levels: OrderedDict[tuple[int, int], QPixmap] = OrderedDict()
+
+    @staticmethod
+    def _size(pixmap: QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def level(self, pixmap: QPixmap, index: int) -> QPixmap:
+        """The pixmap at 1 / 2**index of its resolution, built from the next finer level"""
+        if index <= 0:
+            return pixmap
+        key = (pixmap.cacheKey(), index)
+        level = self._levels.get(key)
+        if level is not None:
+            self._levels.move_to_end(key)
+            return level
+
+        finer = self.level(pixmap, index - 1)
+        level = finer.scaled(max(1, (finer.width() + 1) // 2), max(1, (finer.height() + 1) // 2),
+                             Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        self._levels[key] = level
+        self.used += self._size(level)
+        self._evict()
+        return level
+
+    def clear(self) -> None:
+        self._levels.clear()
+        self.used = 0
+
+    def _evict(self) -> None:
+        """Evict the least recently used levels, always keeping the newest one"""
+        while self.used > self.budget and len(self._levels) > 1:
+            _, level = self._levels.popitem(last=False)
+            self.used -= self._size(level)
+
+
+class MipmapItem(QGraphicsPixmapItem):
+    """Pixmap item drawing the mip level matching the zoom instead of resampling the full pixmap every repaint"""
+    cache: MipmapCache = MipmapCache()
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: [QWidget, None] = None) -> None:
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        pixmap = self.pixmap()
+        if lod >= 0.5 or pixmap.isNull():
+            super(MipmapItem, self).paint(painter, option, widget)
+            return
+
+        # The coarsest level that still has at least one pixel per screen pixel
+        index = min(int(math.log2(1.0 / lod)), int(math.log2(min(pixmap.width(), pixmap.height()))))
+        level = self.cache.level(pixmap, index)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform,
+                              self.transformationMode() == Qt.TransformationMode.SmoothTransformation)
+        painter.drawPixmap(QRectF(self.offset(), pixmap.size().toSizeF()), level, QRectF(level.rect()))
+        if option.state & QStyle.StateFlag.State_Selected:
+            painter.setPen(QPen(Qt.GlobalColor.black, 0, Qt.PenStyle.DashLine))
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawRect(self.boundingRect())
@@ -0,0 +1,288 @@
+from LookupTable import LookupTable
+from Operations import Operations
+from Pyramid import Pyramid
+import numpy as np
+import threading
+import weakref
+
+
+class Step:
+    """An Operations call recorded by name, runnable in place on an image array"""
+    # Arguments measured in pixels, by position, they shrink with the image when previewing
+    LENGTH_ARGUMENTS: dict[str, int] = {"filter_box": 0, "filter_gauss": 0, "corner_detection_kanade": 2}
+
+    def __init__(self, operations: Operations, name: str, args: tuple = ()) -> None:
+        self.operations: Operations = operations
+        self.name: str = name
+        self.args: tuple = args
+
+    def __call__(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        out = img_array if out is None else out
+        return getattr(self.operations, self.name)(img_array, *self.args, out=out)
+
+    def halo(self) -> [int, None]:
+        """Neighbouring pixels the step reads around each output pixel, None if it needs the whole image"""
+        if self.name in Node.POINT_TABLES or self.name == "grayscale":
+            return 0
+        if self.name == "filter_box":
+            return (self.args[0] if self.args else 5) // 2 + 1
+        if self.name == "filter_gauss":
+            return self.operations.convolution.gaussian_radius(self.args[0] if self.args else 2.0)
+        if self.name == "filter_kernel":
+            return max(np.shape(self.args[0])) // 2 + 1
+        if self.name in ("edge_sobel", "edge_laplace", "edge_laplace_optimized"):
+            return 2
+        return None
+
+    def scaled(self, factor: float) -> "Step":
+        """The same step for an image resized by factor"""
+        index = self.LENGTH_ARGUMENTS.get(self.name)
+        if index is None or index >= len(self.args):
+            return self
+        args = list(self.args)
+        if isinstance(args[index], int):
+            args[index] = max(1, round(args[index] * factor))
+        else:
+            args[index] = max(0.1, args[index] * factor)
+        return Step(self.operations, self.name, tuple(args))
+
+
+class Node:
+    """One recorded operation, its result is computed only when somebody asks for it"""
+    # Point operations become lookup tables, so consecutive ones can be fused
+    POINT_TABLES: dict[str, callable] = {
+        "negate": LookupTable.negate,
+        "gamma_transformation": LookupTable.gamma,
+        "logarithmic_transformation": LookupTable.logarithmic,
+        "point_operation": lambda table: table,
+    }
+
+    def __init__(self, parent: ["Node", None], step: [Step, None] = None,
+                 loader: [callable, None] = None) -> None:
+        self.parent: [Node, None] = parent
+        self.step: [Step, None] = step
+        self.table: [LookupTable, None] = None
+        if step is not None and step.name in self.POINT_TABLES:
+            self.table = self.POINT_TABLES[step.name](*step.args)
+        self.loader: [callable, None] = loader  # Reloads the pixels after eviction, returns None once they changed
+        self.users: int = 0  # Child nodes and items depending on this result
+        self.lock = threading.Lock()
+        self._result: [weakref.ref, None] = None
+        self._pinned: [np.ndarray, None] = None  # Strong reference while an evaluation depends on it
+        self._pins: int = 0  # Evaluation batches holding _pinned
+        if parent is not None:
+            parent.users += 1
+
+    def result(self) -> [np.ndarray, None]:
+        """The computed pixels if they are still alive"""
+        if self._pinned is not None:
+            return self._pinned
+        return self._result() if self._result is not None else None
+
+    def materialize(self, arr: np.ndarray) -> None:
+        """Remember where the result lives without keeping it alive, the pixel store stays in charge of memory"""
+        self._result = weakref.ref(arr)
+
+    def invalidate(self) -> None:
+        """The materialized pixels are about to be edited in place, recompute from the parent from now on"""
+        self._result = None
+        self.loader = None
+
+
+class OperationGraph:
+    """Records operations lazily and evaluates chains of them in a fused pass
+
+    Consecutive point operations are merged into a single lookup table (identities are dropped altogether),
+    the other operations run in place one after the other on a single output array. A node several pending
+    results depend on is computed once per evaluation batch and shared.
+    """
+
+    PREVIEW_MARGIN: int = 16  # Extra proxy pixels around the visible rectangle, so filters see real neighbours
+    PYRAMID_CACHE: int = 4  # Pyramids kept for previews, the most recently used ones
+
+    def __init__(self, operations: Operations) -> None:
+        self.operations: Operations = operations
+        self._pyramids: list[tuple[weakref.ref, Pyramid]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def source(arr: np.ndarray, loader: [callable, None] = None) -> Node:
+        """A root node holding existing pixels"""
+        node = Node(None, loader=loader)
+        node.materialize(arr)
+        return node
+
+    @staticmethod
+    def apply(node: Node, step: Step) -> Node:
+        """Record an operation on top of node, nothing is computed yet"""
+        return Node(node, step)
+
+    def pin(self, node: Node, pins: [list[Node], None] = None) -> list[Node]:
+        """Hold the nearest available ancestor pixels for an evaluation, call it on the thread allowed to load
+
+        The held node is added to pins, the list of one evaluation batch, which is returned for release().
+        """
+        pins = [] if pins is None else pins
+        while True:
+            arr = node.result()
+            if arr is None and node.loader is not None:
+                arr = node.loader()
+                if arr is not None:
+                    node.materialize(arr)
+            if arr is not None:
+                self._hold(node, arr, pins)
+                return pins
+            if node.parent is None:
+                raise RuntimeError("The source pixels of the operation chain are gone")
+            node = node.parent
+
+    def release(self, pins: list[Node]) -> None:
+        """Drop the pins and shared sub-results of a finished evaluation batch, other batches keep theirs"""
+        with self._lock:
+            for node in pins:
+                node._pins -= 1
+                if not node._pins:
+                    node._pinned = None
+            pins.clear()
+
+    def _hold(self, node: Node, arr: np.ndarray, pins: list[Node]) -> None:
+        with self._lock:
+            node._pinned = arr
+            node._pins += 1
+            pins.append(node)
+
+    def evaluate(self, node: Node, out: [np.ndarray, None] = None, pins: [list[Node], None] = None) -> np.ndarray:
+        """Compute the result of node, into out when given
+
+        Shared sub-results are held in pins, the list pin() returned for the batch, until it is released.
+        """
+        return self._evaluate(node, out, [] if pins is None else pins)
+
+    def _evaluate(self, node: Node, out: [np.ndarray, None], pins: list[Node], exclusive: bool = False) -> np.ndarray:
+        """exclusive evaluates a shared node like a private one, it is the one computing the shared result"""
+        if not exclusive and node.users > 1 and node.parent is not None and node.result() is None:
+            shared = self._evaluate_shared(node, pins)
+            if out is None:
+                return shared
+            np.copyto(out, shared)
+            return out
+
+        steps = []
+        current = node
+        base = current.result()
+        while base is None:
+            if current is not node and current.users > 1:
+                base = self._evaluate_shared(current, pins)  # Another branch needs it as well
+                break
+            steps.append(current)
+            current = current.parent
+            if current is None:
+                raise RuntimeError("The source pixels of the operation chain are gone, pin() the node first")
+            base = current.result()
+        steps.reverse()
+        return self._run(base, steps, out)
+
+    def preview(self, node: Node, scale: float,
+                rect: [tuple[int, int, int, int], None] = None) -> tuple[np.ndarray, tuple[int, int], float]:
+        """Compute node on a downsampled proxy, cropped to the (x, y, width, height) rectangle when given
+
+        Returns the proxy result, its top-left corner in full resolution pixels and its size relative to
+        the full resolution. Meant for the thread allowed to run the loaders.
+        """
+        steps = []
+        current = node
+        base = current.result()
+        while base is None:
+            steps.append(current)
+            current = current.parent
+            if current is None:
+                raise RuntimeError("The source pixels of the operation chain are gone")
+            base = current.result()
+            if base is None and current.loader is not None:
+                base = current.loader()
+        steps.reverse()
+
+        pyramid = self._pyramid(current, base)
+        level = pyramid.level_for(scale)
+        proxy, factor = pyramid.level(level), pyramid.factor(level)
+        x0, y0, x1, y1 = 0, 0, proxy.shape[1], proxy.shape[0]
+        if rect is not None:
+            x, y, width, height = rect
+            x0 = max(0, int(x * factor) - self.PREVIEW_MARGIN)
+            y0 = max(0, int(y * factor) - self.PREVIEW_MARGIN)
+            x1 = min(proxy.shape[1], int((x + width) * factor) + 1 + self.PREVIEW_MARGIN)
+            y1 = min(proxy.shape[0], int((y + height) * factor) + 1 + self.PREVIEW_MARGIN)
+        proxy = np.ascontiguousarray(proxy[y0:y1, x0:x1])
+        steps = [Node(None, step.step.scaled(factor)) for step in steps]
+        return self._run(proxy, steps, None), (round(x0 / factor), round(y0 / factor)), factor
+
+    def evaluate_region(self, node: Node, origin: Node, pixels: np.ndarray, rect: tuple[int, int, int, int]
+                        ) -> [tuple[np.ndarray, tuple[int, int, int, int]], None]:
+        """Recompute node over the part a change of the origin pixels inside (x0, y0, x1, y1) reaches
+
+        The steps recorded between origin and node run on the rectangle plus the halo they need. Returns
+        the recomputed pixels and the rectangle they cover, None if node does not descend from origin.
+        """
+        steps = []
+        current = node
+        while current is not origin:
+            if current is None:
+                return None
+            steps.append(current)
+            current = current.parent
+        steps.reverse()
+
+        height, width = pixels.shape[:2]
+        halos = [step.step.halo() for step in steps]
+        if None in halos:  # A step needs the whole image, e.g. histogram equalization
+            rect, halo = (0, 0, width, height), 0
+        else:
+            halo = sum(halos)
+        x0, y0 = max(0, rect[0] - halo), max(0, rect[1] - halo)
+        x1, y1 = min(width, rect[2] + halo), min(height, rect[3] + halo)
+        hx0, hy0, hx1, hy1 = max(0, x0 - halo), max(0, y0 - halo), min(width, x1 + halo), min(height, y1 + halo)
+        region = np.ascontiguousarray(pixels[hy0:hy1, hx0:hx1])
+        self._run(region, steps, region)
+        return region[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0], (x0, y0, x1, y1)
+
+    def _pyramid(self, node: Node, base: np.ndarray) -> Pyramid:
+        for reference, pyramid in self._pyramids:
+            if reference() is node and pyramid.base is base:
+                return pyramid
+        pyramid = Pyramid(base)
+        self._pyramids = [(weakref.ref(node), pyramid)] + self._pyramids[:self.PYRAMID_CACHE - 1]
+        return pyramid
+
+    def _evaluate_shared(self, node: Node, pins: list[Node]) -> np.ndarray:
+        with node.lock:
+            arr = node.result()
+            if arr is None:
+                arr = self._run_chain_of(node, pins)
+                self._hold(node, arr, pins)
+            return arr
+
+    def _run_chain_of(self, node: Node, pins: list[Node]) -> np.ndarray:
+        return self._evaluate(node, None, pins, exclusive=True)  # Without recursing into itself
+
+    def _run(self, base: np.ndarray, steps: list[Node], out: [np.ndarray, None]) -> np.ndarray:
+        """Run the steps on base, the first executed step reads base, the following ones work in place"""
+        if out is None:
+            out = np.empty_like(base)
+        source = base
+        tables: list[LookupTable] = []
+        for step in steps + [None]:
+            if step is not None and step.table is not None:
+                tables.append(step.table)
+                continue
+            if tables:
+                table = LookupTable.compose(*tables)
+                tables = []
+                if not np.array_equal(table.table, LookupTable.identity().table):
+                    table.apply(source, out=out)
+                    source = out
+            if step is not None:
+                step.step(source, out=out)
+                source = out
+        if source is not out:
+            np.copyto(out, source)  # Everything cancelled out, e.g. negate twice
+        return out
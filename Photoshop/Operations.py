@@ -0,0 +1,204 @@
+from TileScheduler import TileScheduler
+from LookupTable import LookupTable
+from Convolution import Convolution
+from Features import Features
+import numpy as np
+import cv2
+
+
+class Operations:
+    """Qt-free image operations on (H, W, 3) RGB or (H, W, 4) RGBA uint8 arrays
+
+    Every operation returns a new array, or writes into `out` when given. Passing the input itself as
+    `out` edits it in place. The alpha channel is kept unless the operation defines it.
+    """
+    SOBEL_KERNEL: np.ndarray = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
+    LAPLACE_KERNEL: np.ndarray = np.array([[0, 1, 0], [1, -4, 1], [0, 1, 0]])
+    EQUALIZE_MODES: tuple[str, ...] = ("rgb", "joint", "luminance", "clahe")
+
+    def __init__(self, tiles: [TileScheduler, None] = None, convolution: [Convolution, None] = None,
+                 features: [Features, None] = None) -> None:
+        self.tiles: TileScheduler = tiles or TileScheduler()
+        self.convolution: Convolution = convolution or Convolution()
+        self.features: Features = features or Features(self.tiles)
+
+    @staticmethod
+    def _output(img_array: np.ndarray, out: [np.ndarray, None]) -> np.ndarray:
+        """The array the operation writes to, holding a copy of the input unless it is the input"""
+        if img_array.ndim != 3 or img_array.shape[2] not in (3, 4) or img_array.dtype != np.uint8:
+            raise ValueError(f"Expected an (H, W, 3) or (H, W, 4) uint8 array, got {img_array.shape} {img_array.dtype}")
+        if out is None:
+            return img_array.copy()
+        if out is not img_array:
+            np.copyto(out, img_array)
+        return out
+
+    def point_operation(self, img_array: np.ndarray, *tables: LookupTable,
+                        out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply one or more point operations, fused into a single lookup table"""
+        self._output(img_array, img_array)  # Validation only, the lookup reads the input directly
+        return LookupTable.compose(*tables).apply(img_array, out=out)
+
+    def negate(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Invert the colors"""
+        return self.point_operation(img_array, LookupTable.negate(), out=out)
+
+    def grayscale(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Convert to grayscale using the luminance formula"""
+        out = self._output(img_array, out)
+        grayscale_values = np.dot(out[..., :3], [0.299, 0.587, 0.114])
+        out[..., :3] = grayscale_values[..., None]
+        return out
+
+    def gamma_transformation(self, img_array: np.ndarray, gamma_value: float,
+                             out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply gamma transformation"""
+        return self.point_operation(img_array, LookupTable.gamma(gamma_value), out=out)
+
+    def logarithmic_transformation(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply logarithmic transformation"""
+        return self.point_operation(img_array, LookupTable.logarithmic(), out=out)
+
+    @staticmethod
+    def _channel_histogram(arr: np.ndarray, channels: int) -> np.ndarray:
+        """(256, channels) counts of the first channels"""
+        rows = max(1, 2 ** 24 // max(1, arr.shape[1]))  # The float32 counts of calcHist are exact up to 2**24
+        counts = np.zeros((256, channels), dtype=np.int64)
+        for y in range(0, arr.shape[0], rows):
+            chunk = arr[y:y + rows]
+            counts += np.stack([cv2.calcHist([chunk], [i], None, [256], [0, 256]).ravel()
+                                for i in range(channels)], axis=1).astype(np.int64)
+        return counts
+
+    @staticmethod
+    def _luma(arr: np.ndarray) -> np.ndarray:
+        """(H, W, 3) YCrCb of the RGB channels"""
+        return cv2.cvtColor(np.ascontiguousarray(arr[..., :3]), cv2.COLOR_RGB2YCrCb)
+
+    def histogram(self, img_array: np.ndarray, step: int = 1) -> np.ndarray:
+        """(256, 3) counts of the R, G, B channels, summed over the tiles, of every step-th row only if given"""
+        return sum(self.tiles.map(lambda tile: self._channel_histogram(tile, 3), img_array[::step]))
+
+    def luminance_histogram(self, img_array: np.ndarray, step: int = 1) -> np.ndarray:
+        """(256,) counts of the luma (Y of YCrCb), summed over the tiles, of every step-th row only if given"""
+        return sum(self.tiles.map(lambda tile: self._channel_histogram(self._luma(tile), 1), img_array[::step]))[:, 0]
+
+    def histogram_equalize(self, img_array: np.ndarray, mode: str = "rgb", hist: [np.ndarray, None] = None,
+                           clip_limit: float = 2.0, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Equalize the histogram
+
+        Modes: "rgb" equalizes each of the R, G, B channels on its own (shifts the hues), "joint" maps the
+        three through one table built from their summed counts, "luminance" equalizes only the Y of YCrCb,
+        "clahe" runs contrast limited adaptive equalization on 8x8 regions of the Y channel.
+        hist gives the counts to equalize with instead of those of the image, e.g. a reference shared by
+        several images: (256, 3) RGB counts for "rgb" and "joint", (256,) luma counts for "luminance".
+        """
+        if mode not in self.EQUALIZE_MODES:
+            raise ValueError(f"Unknown equalization mode '{mode}', choose from: {', '.join(self.EQUALIZE_MODES)}")
+        if mode in ("rgb", "joint"):
+            hist = self.histogram(img_array) if hist is None else np.asarray(hist)
+            table = LookupTable.equalize(hist.reshape(256, -1).sum(axis=1) if mode == "joint" else hist)
+            if out is None:
+                out = np.empty_like(img_array)
+            return self.tiles.run(lambda tile: table.apply(tile), img_array, out=out)
+
+        ycrcb = self.tiles.run(self._luma, img_array)
+        if mode == "luminance":
+            if hist is None:
+                hist = sum(self.tiles.map(lambda tile: self._channel_histogram(tile, 1), ycrcb))
+            luma = LookupTable.equalize(hist).table[:, 0]
+            ycrcb[..., 0] = self.tiles.run(lambda tile: cv2.LUT(tile, luma), ycrcb[..., 0])
+        else:
+            # The regions interpolate into each other, OpenCV parallelizes over them internally
+            clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
+            ycrcb[..., 0] = clahe.apply(np.ascontiguousarray(ycrcb[..., 0]))
+        out = self._output(img_array, out)
+        out[..., :3] = self.tiles.run(lambda tile: cv2.cvtColor(np.ascontiguousarray(tile), cv2.COLOR_YCrCb2RGB),
+                                      ycrcb)
+        return out
+
+    def filter_box(self, img_array: np.ndarray, size: int = 5, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply a box filter (mean filter) of any size"""
+        result = self.tiles.run(lambda tile: self.convolution.box(tile, size), img_array[..., :3], halo=size // 2 + 1)
+        out = self._output(img_array, out)
+        out[..., :3] = result
+        return out
+
+    def filter_gauss(self, img_array: np.ndarray, sigma: float = 2.0, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply Gaussian filter"""
+        result = self.tiles.run(lambda tile: self.convolution.gaussian(tile, sigma),
+                                img_array[..., :3], halo=self.convolution.gaussian_radius(sigma))
+        out = self._output(img_array, out)
+        out[..., :3] = result
+        return out
+
+    def filter_kernel(self, img_array: np.ndarray, kernel: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply an arbitrary convolution kernel"""
+        if self.convolution.method(kernel) == "fft":
+            # The frequency domain path does not grow with the kernel, and tiling it would change the rounding
+            result = self.convolution.filter(img_array[..., :3], kernel)
+        else:
+            result = self.tiles.run(lambda tile: self.convolution.filter(tile, kernel),
+                                    img_array[..., :3], halo=max(np.shape(kernel)) // 2 + 1)
+        out = self._output(img_array, out)
+        out[..., :3] = result
+        return out
+
+    def _sobel(self, rgb: np.ndarray) -> np.ndarray:
+        """Gradient magnitude of the grayscale image"""
+        gray = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY)
+        # Both kernels are separable, so the engine runs them as two 1-D passes
+        sobel_x = self.convolution.filter(gray, self.SOBEL_KERNEL, dtype=np.float32)
+        sobel_y = self.convolution.filter(gray, self.SOBEL_KERNEL.T, dtype=np.float32)
+        return np.hypot(sobel_x, sobel_y).clip(0, 255).astype(np.uint8)
+
+    def edge_sobel(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply Sobel edge detection"""
+        sobel = self.tiles.run(self._sobel, img_array[..., :3], halo=2)
+        # Add the detected edges as an overlay on the original image
+        out = self._output(img_array, out)
+        out[..., :3] = sobel[..., None]
+        return out
+
+    def edge_laplace(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply Laplacian edge detection"""
+        # Per-channel response on the R, G, B channels, biased by 128 so negative edges stay visible.
+        # The sums are exact integers, so this matches the former pixelColor() loop bit-for-bit.
+        laplacian = self.tiles.run(lambda tile: self.convolution.filter(tile, self.LAPLACE_KERNEL, dtype=np.float32),
+                                   img_array[..., :3], halo=2)
+        laplacian = (laplacian[1:-1, 1:-1] + 128).clip(0, 255).astype(np.uint8)
+
+        # Only the interior is defined, the one pixel border stays transparent
+        out = self._output(img_array, out)
+        out[...] = 0
+        out[1:-1, 1:-1, :3] = laplacian
+        if out.shape[2] == 4:
+            out[1:-1, 1:-1, 3] = 255
+        return out
+
+    def edge_laplace_optimized(self, img_array: np.ndarray, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply grayscale Laplacian edge detection, taking the absolute response"""
+        # Convert to grayscale for edge detection
+        gray = cv2.cvtColor(np.ascontiguousarray(img_array[..., :3]), cv2.COLOR_RGB2GRAY)
+
+        # Apply the Laplacian operator
+        laplacian = self.convolution.filter(gray, self.LAPLACE_KERNEL, dtype=np.float32)
+        laplacian = np.abs(laplacian).clip(0, 255).astype(np.uint8)  # Take absolute value and ensure it's in range
+
+        # Overlay the edges on the original image, keeping its alpha channel
+        out = self._output(img_array, out)
+        out[..., :3] = laplacian[..., None]
+        return out
+
+    def corners(self, img_array: np.ndarray, max_corners: int = 400, quality_level: float = 0.01,
+                min_distance: int = 10, level: [int, None] = None) -> np.ndarray:
+        """(N, 2) integer x, y positions of the Shi-Tomasi corners, strongest first"""
+        return self.features.detect(img_array, max_corners, quality_level, min_distance, level)
+
+    def corner_detection_kanade(self, img_array: np.ndarray, max_corners: int = 400, quality_level: float = 0.01,
+                                min_distance: int = 10, level: [int, None] = None,
+                                out: [np.ndarray, None] = None) -> np.ndarray:
+        """Detect characteristic corners using the Lucas-Kanade (Shi-Tomasi) Operator"""
+        corners = self.corners(img_array, max_corners, quality_level, min_distance, level)
+        out = self._output(img_array, out)
+        return Features.draw(out, corners, (255, 0, 0, 255)[:out.shape[2]])  # Red circles around the corners
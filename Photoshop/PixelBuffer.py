@@ -0,0 +1,286 @@
+from PyQt6.QtGui import QImage, QPixmap
+from PyQt6 import sip
+from Profiler import profiler
+import numpy as np
+import contextlib
+import threading
+import tempfile
+import weakref
+import time
+import os
+
+
+class _ImageArray(np.ndarray):
+    """Array view that keeps the QImage owning its memory alive, slices reach it through their base"""
+    owner: QImage = None
+
+
+class PixelBuffer:
+    """RGBA8888 pixel storage shared between a QImage and a writable NumPy view"""
+    FORMAT = QImage.Format.Format_RGBA8888
+    resident: bool = True  # Held in RAM and accounted against the PixelStore budget
+
+    def __init__(self, image: QImage, adopt: bool = False) -> None:
+        # The buffer owns the converted QImage, the array is only a view onto its bits,
+        # so both stay valid for exactly as long as this object is alive
+        if image.format() != self.FORMAT:
+            with profiler.stage("convert", image.width() * image.height() * 4, image.width(), image.height()):
+                image = image.convertToFormat(self.FORMAT)
+        elif not adopt:
+            image = QImage(image)  # Shallow copy, detached by bits() if the caller still holds the data
+        self.image: QImage = image
+        self.array: np.ndarray = self._view(image)
+        self.sharers: weakref.WeakSet = weakref.WeakSet()  # CowBuffers still reading these pixels
+
+    @classmethod
+    def from_pixmap(cls, pixmap: QPixmap) -> "PixelBuffer":
+        """Decode a pixmap once into a new buffer"""
+        with profiler.stage("decode", pixmap.width() * pixmap.height() * pixmap.depth() // 8,
+                            pixmap.width(), pixmap.height()):
+            image = pixmap.toImage()
+        return cls(image, adopt=True)
+
+    @classmethod
+    def empty(cls, width: int, height: int) -> "PixelBuffer":
+        """Create an uninitialized buffer, for results that overwrite every pixel"""
+        with profiler.stage("allocate", width * height * 4, width, height):
+            image = QImage(width, height, cls.FORMAT)
+        return cls(image, adopt=True)
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> "PixelBuffer":
+        """Create a buffer holding a copy of an (H, W, 4) uint8 array"""
+        height, width, _ = arr.shape
+        buffer = cls.empty(width, height)
+        with profiler.stage("copy", buffer.nbytes, width, height):
+            buffer.array[...] = arr
+        return buffer
+
+    @staticmethod
+    def _view(image: QImage) -> np.ndarray:
+        """Wrap the bits of the image without copying them"""
+        width, height = image.width(), image.height()
+        ptr = image.bits()  # Non-const access detaches the image, so the memory is exclusively ours
+        ptr.setsize(image.sizeInBytes())
+        arr = np.frombuffer(ptr, dtype=np.uint8).reshape((height, image.bytesPerLine())).view(_ImageArray)
+        arr.owner = image
+        return arr[:, :width * 4].reshape((height, width, 4))
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """The current pixels, for reading only"""
+        return self.array
+
+    def writable(self) -> np.ndarray:
+        """The array, after giving the copies still sharing it their own pixels"""
+        for sharer in list(self.sharers):
+            sharer.detach()
+        return self.array
+
+    def region(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """Writable view of a rectangle, the copies still sharing it copy the tiles it overlaps first"""
+        for sharer in list(self.sharers):
+            sharer.keep(y0, y1, x0, x1)
+        return self.array[y0:y1, x0:x1]
+
+    @property
+    def width(self) -> int:
+        return self.image.width()
+
+    @property
+    def height(self) -> int:
+        return self.image.height()
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.sizeInBytes()
+
+    def replace(self, arr: np.ndarray) -> None:
+        """Store a result array, reusing the backing memory when the shape allows it"""
+        if arr is self.array:
+            return
+        height, width = arr.shape[:2]
+        if arr.shape != self.array.shape:
+            with profiler.stage("allocate", width * height * 4, width, height):
+                self.image = QImage(width, height, self.FORMAT)
+            self.array = self._view(self.image)
+        with profiler.stage("copy", self.array.nbytes, width, height):
+            np.copyto(self.array, arr, casting='unsafe')
+
+    def to_pixmap(self) -> QPixmap:
+        """Upload the buffer to a pixmap, the only copy Qt makes for displaying it"""
+        with profiler.stage("upload", self.nbytes, self.width, self.height):
+            pixmap = QPixmap.fromImage(self.image)
+        # If the platform pixmap shares the image data instead of converting it, the next bits() call
+        # detaches. Rebind the view then, so later writes never leak into the displayed pixmap.
+        if int(self.image.bits()) != self.array.__array_interface__['data'][0]:
+            self.array = self._view(self.image)
+        return pixmap
+
+
+def _remove_file(path: str) -> None:
+    with contextlib.suppress(OSError):  # Still mapped on Windows, the scratch directory is removed later
+        os.remove(path)
+
+
+class MappedPixelBuffer(PixelBuffer):
+    """RGBA8888 pixels in a memory-mapped scratch file, the OS loads and evicts the pages on demand"""
+    resident: bool = False
+
+    def __init__(self, directory: str, width: int, height: int) -> None:
+        handle, self.path = tempfile.mkstemp(suffix=".rgba", dir=directory)
+        os.close(handle)
+        with profiler.stage("allocate", width * height * 4, width, height):
+            self.array: np.ndarray = np.memmap(self.path, dtype=np.uint8, mode="w+", shape=(height, width, 4))
+        self.sharers: weakref.WeakSet = weakref.WeakSet()
+        weakref.finalize(self, _remove_file, self.path)
+
+    @property
+    def image(self) -> QImage:
+        """A QImage over the mapped pixels, valid while this buffer is alive"""
+        height, width, _ = self.array.shape
+        return QImage(sip.voidptr(self.array.ctypes.data), width, height, width * 4, self.FORMAT)
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def replace(self, arr: np.ndarray) -> None:
+        if arr.shape != self.array.shape:
+            raise ValueError(f"A mapped buffer of shape {self.array.shape} cannot hold {arr.shape}")
+        if arr is not self.array:
+            with profiler.stage("copy", self.array.nbytes, self.width, self.height):
+                np.copyto(self.array, arr, casting='unsafe')
+
+    def to_pixmap(self) -> QPixmap:
+        with profiler.stage("upload", self.nbytes, self.width, self.height):
+            return QPixmap.fromImage(self.image)
+
+
+class CowBuffer(PixelBuffer):
+    """A copy of another buffer sharing its pixels until they are written, copied tile by tile
+
+    Writing through region() copies only the tiles it overlaps. Asking for the whole array copies the rest.
+    Copying is locked, so another thread may take the pixels (e.g. an export) while the owner is written.
+    """
+    TILE_SIZE: int = 256
+
+    def __init__(self, shared: PixelBuffer, allocate: [callable, None] = None) -> None:
+        self.shared: [PixelBuffer, None] = shared
+        self._allocate: callable = allocate or PixelBuffer.empty  # (width, height) -> PixelBuffer
+        self._own: [PixelBuffer, None] = None
+        self._width, self._height = shared.width, shared.height
+        self._copied = np.zeros((-(-self._height // self.TILE_SIZE), -(-self._width // self.TILE_SIZE)), dtype=bool)
+        self.sharers: weakref.WeakSet = weakref.WeakSet()
+        self._lock = threading.RLock()
+        shared.sharers.add(self)
+
+    @property
+    def resident(self) -> bool:
+        return (self._own or self.shared).resident
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes copied so far, the shared pixels are accounted for by their owner"""
+        if self._own is None:
+            return 0
+        return int(self._own.nbytes * self._copied.mean())
+
+    @property
+    def pixels(self) -> np.ndarray:
+        if self._own is None:
+            return self.shared.pixels
+        return self.array
+
+    @property
+    def array(self) -> np.ndarray:
+        """The whole array for writing, every tile not copied yet is copied now"""
+        self.detach()
+        return self._own.array
+
+    @property
+    def image(self) -> QImage:
+        if self._own is None:
+            return self.shared.image
+        self.detach()
+        return self._own.image
+
+    def writable(self) -> np.ndarray:
+        for sharer in list(self.sharers):
+            sharer.detach()
+        return self.array
+
+    def region(self, y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """Writable view of a rectangle, copying only the tiles it overlaps"""
+        for sharer in list(self.sharers):
+            sharer.keep(y0, y1, x0, x1)
+        self.keep(y0, y1, x0, x1)
+        return self._own.array[y0:y1, x0:x1]
+
+    def keep(self, y0: int, y1: int, x0: int, x1: int) -> None:
+        """Copy the tiles a rectangle overlaps, the shared pixels are about to change there"""
+        size = self.TILE_SIZE
+        self._materialize(slice(y0 // size, -(-y1 // size)), slice(x0 // size, -(-x1 // size)))
+
+    def detach(self) -> None:
+        """Copy every remaining tile, the shared buffer may change afterwards"""
+        if self.shared is not None:
+            self._materialize(slice(None), slice(None))
+
+    def _materialize(self, rows: slice, columns: slice) -> None:
+        with self._lock:  # The owner is written once this returns
+            if self.shared is None:
+                return
+            if self._own is None:
+                self._own = self._allocate(self._width, self._height)
+            size = self.TILE_SIZE
+            source = self.shared.pixels
+            start_time, copied = time.perf_counter_ns(), 0
+            for row, column in zip(*np.nonzero(~self._copied[rows, columns])):
+                row += rows.start or 0
+                column += columns.start or 0
+                tile = np.s_[row * size:(row + 1) * size, column * size:(column + 1) * size]
+                self._own.array[tile] = source[tile]
+                self._copied[row, column] = True
+                copied += source[tile].nbytes
+            if copied:
+                profiler.record("copy", time.perf_counter_ns() - start_time, copied, self._width, self._height)
+            if self._copied.all():
+                self.shared.sharers.discard(self)
+                self.shared = None
+
+    def replace(self, arr: np.ndarray) -> None:
+        """Overwrite every pixel, nothing has to be copied from the shared buffer first"""
+        if arr.shape != (self._height, self._width, 4):
+            raise ValueError(f"A copy of shape {(self._height, self._width, 4)} cannot hold {arr.shape}")
+        with self._lock:
+            if self._own is None:
+                self._own = self._allocate(self._width, self._height)
+            if self.shared is not None:
+                self.shared.sharers.discard(self)
+                self.shared = None
+            self._copied[...] = True
+        with profiler.stage("copy", arr.nbytes, self._width, self._height):
+            np.copyto(self._own.array, arr, casting='unsafe')
+
+    def to_pixmap(self) -> QPixmap:
+        if self._own is None:
+            return self.shared.to_pixmap()
+        self.detach()
+        return self._own.to_pixmap()
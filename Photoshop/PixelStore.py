@@ -0,0 +1,266 @@
+from PyQt6.QtWidgets import QGraphicsPixmapItem
+from PyQt6.QtCore import QCoreApplication, QTimer
+from PixelBuffer import PixelBuffer, MappedPixelBuffer, CowBuffer
+from Profiler import profiler
+from collections import OrderedDict
+from PyQt6.QtGui import QPixmap, QPainter
+import numpy as np
+import tempfile
+import weakref
+import shutil
+import math
+import cv2
+
+
+class _Entry:
+    __slots__ = ("item", "buffer", "cache_key", "dirty", "display_factor", "finalizer", "nbytes")
+
+    def __init__(self, item: QGraphicsPixmapItem, buffer: PixelBuffer, cache_key: int) -> None:
+        self.item = weakref.ref(item)
+        self.buffer = buffer
+        self.cache_key = cache_key
+        self.dirty = False
+        self.display_factor = 1.0  # Resolution of the pixmap shown relative to the array
+        self.finalizer: [weakref.finalize, None] = None
+        self.nbytes = 0  # RAM the store accounts for the buffer, refreshed when it is edited
+
+
+class PixelStore:
+    """Per-item cache of the canonical pixel arrays, evicted in LRU order under a memory budget
+
+    With a scratch directory the arrays are memory-mapped files instead. They are never evicted (the OS pages
+    them out), and large ones are shown on the scene through a pixmap at the resolution the zoom needs.
+    """
+    DEFAULT_BUDGET: int = 1024 * 1024 * 1024  # 1 GiB
+    DISPLAY_MIN_PIXELS: int = 4 * 1024 * 1024  # Smaller mapped images are always shown at full resolution
+
+    def __init__(self, budget: int = DEFAULT_BUDGET, scratch: [str, None] = None) -> None:
+        self.budget: int = budget
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._used: int = 0  # Sum of the accounted bytes of the entries
+        self._flush_scheduled: bool = False
+        self.display_scale: float = 1.0
+        self.scratch: [str, None] = None  # Parent directory chosen by the user
+        self._scratch_dir: [str, None] = None  # Our own directory inside it, removed by clear()
+        self.use_scratch(scratch)
+
+    def use_scratch(self, directory: [str, None]) -> None:
+        """Keep the arrays created from now on in memory-mapped files below directory, None keeps them in RAM"""
+        self._remove_scratch()
+        self.scratch = directory
+
+    def _remove_scratch(self) -> None:
+        if self._scratch_dir is not None:
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+            self._scratch_dir = None
+
+    def allocate(self, width: int, height: int, mapped: bool = False) -> PixelBuffer:
+        """A new uninitialized buffer, mapped when a scratch directory is set or mapped (in the temporary one)"""
+        if self.scratch is None and not mapped:
+            return PixelBuffer.empty(width, height)
+        if self._scratch_dir is None:
+            self._scratch_dir = tempfile.mkdtemp(prefix="photoshop-", dir=self.scratch)
+            weakref.finalize(self, shutil.rmtree, self._scratch_dir, True)  # Also on an unclean exit
+        return MappedPixelBuffer(self._scratch_dir, width, height)
+
+    def _copy(self, arr: np.ndarray) -> PixelBuffer:
+        buffer = self.allocate(arr.shape[1], arr.shape[0])
+        with profiler.stage("copy", buffer.nbytes, buffer.width, buffer.height):
+            buffer.array[...] = arr
+        return buffer
+
+    def size(self, item: QGraphicsPixmapItem) -> tuple[int, int]:
+        """Width and height of the array of the item, the pixmap may be displayed at a lower resolution"""
+        entry = self._entries.get(id(item))
+        if entry is not None and entry.item() is item:
+            return entry.buffer.width, entry.buffer.height
+        pixmap = item.pixmap()
+        return pixmap.width(), pixmap.height()
+
+    def get(self, item: QGraphicsPixmapItem) -> [PixelBuffer, None]:
+        """Return the buffer of the item, decoding its pixmap only on a miss"""
+        entry = self._entries.get(id(item))
+        if entry is not None and entry.item() is item:
+            if entry.dirty or entry.cache_key == item.pixmap().cacheKey():
+                self._entries.move_to_end(id(item))
+                return entry.buffer
+            self._remove(id(item))  # The pixmap was replaced behind our back
+
+        pixmap = item.pixmap()
+        if pixmap.isNull():
+            return None
+        buffer = PixelBuffer.from_pixmap(pixmap)
+        if self.scratch is not None:
+            buffer = self._copy(buffer.array)
+        self._insert(item, buffer, pixmap.cacheKey())
+        if not buffer.resident and self._display_factor(buffer) != 1.0:
+            self.mark_dirty(item)  # Swap the full resolution pixmap for one at the zoom level
+        return buffer
+
+    def duplicate(self, source: QGraphicsPixmapItem, target: QGraphicsPixmapItem) -> None:
+        """Seed the store of a copied item from its source without decoding or copying the pixels"""
+        entry = self._entries.get(id(source))
+        if entry is None or entry.item() is not source:
+            return
+        self.flush(source)
+        target.setPixmap(source.pixmap())
+        target.setScale(source.scale())
+        # Copy-on-write, the pixels are copied when either side writes them first
+        self._insert(target, CowBuffer(entry.buffer, self.allocate), target.pixmap().cacheKey())
+        self._entries[id(target)].display_factor = entry.display_factor
+
+    def mark_dirty(self, item: QGraphicsPixmapItem, buffer: [PixelBuffer, None] = None) -> None:
+        """Record that the array changed, the pixmap is regenerated before the next repaint"""
+        entry = self._entries.get(id(item))
+        if buffer is not None and (entry is None or entry.buffer is not buffer):
+            # The buffer was evicted while it was being edited, take it back in
+            self._insert(item, buffer, item.pixmap().cacheKey())
+            entry = self._entries[id(item)]
+        if entry is None:
+            return
+        entry.dirty = True
+        if self._account(entry):  # Edits may resize the buffer, or copy shared tiles
+            self._evict()
+        if QCoreApplication.instance() is None:
+            self.flush(item)
+        elif not self._flush_scheduled:
+            # A zero timer fires once control returns to the event loop, i.e. before the view repaints,
+            # so every edit made within the same slot costs a single upload
+            self._flush_scheduled = True
+            QTimer.singleShot(0, self.flush)
+
+    def update_region(self, item: QGraphicsPixmapItem, x: int, y: int, pixels: np.ndarray) -> None:
+        """Show the edited pixels of a rectangle of the array, without uploading the rest of it again"""
+        entry = self._entries.get(id(item))
+        if entry is None or entry.item() is not item or entry.dirty or entry.display_factor != 1.0:
+            self.mark_dirty(item)
+            return
+        pixmap = item.pixmap()
+        item.setPixmap(QPixmap())  # Drop the reference of the item, so painting does not copy the whole pixmap
+        painter = QPainter(pixmap)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(x, y, PixelBuffer.from_array(pixels).image)
+        painter.end()
+        item.setPixmap(pixmap)
+        entry.cache_key = pixmap.cacheKey()
+
+    def flush(self, item: [QGraphicsPixmapItem, None] = None) -> None:
+        """Regenerate the pixmaps of the dirty item(s)"""
+        if item is None:
+            self._flush_scheduled = False
+            entries = list(self._entries.values())
+        else:
+            entry = self._entries.get(id(item))
+            entries = [entry] if entry is not None else []
+
+        for entry in entries:
+            target = entry.item()
+            if not entry.dirty or target is None:
+                continue
+            factor = self._display_factor(entry.buffer)
+            target.setPixmap(self._display_pixmap(entry.buffer, factor))
+            target.setScale(1.0 / factor)
+            entry.cache_key = target.pixmap().cacheKey()
+            entry.display_factor = factor
+            entry.dirty = False
+
+    def _display_factor(self, buffer: PixelBuffer) -> float:
+        """Power of two resolution a mapped array needs on the scene at the current zoom"""
+        if buffer.resident or self.display_scale >= 1.0 or buffer.width * buffer.height < self.DISPLAY_MIN_PIXELS:
+            return 1.0
+        return 0.5 ** int(math.log2(1.0 / self.display_scale))
+
+    @staticmethod
+    def _display_pixmap(buffer: PixelBuffer, factor: float) -> QPixmap:
+        if factor == 1.0:
+            return buffer.to_pixmap()
+        size = (max(1, round(buffer.width * factor)), max(1, round(buffer.height * factor)))
+        with profiler.stage("resize", size[0] * size[1] * 4, buffer.width, buffer.height):
+            arr = cv2.resize(buffer.pixels, size, interpolation=cv2.INTER_AREA)
+        return PixelBuffer.from_array(arr).to_pixmap()
+
+    def set_display_scale(self, scale: float) -> None:
+        """Follow the zoom of the view, mapped images are shown again when they need another resolution"""
+        self.display_scale = scale
+        for entry in list(self._entries.values()):
+            target = entry.item()
+            if target is not None and not entry.buffer.resident and \
+                    self._display_factor(entry.buffer) != entry.display_factor:
+                self.mark_dirty(target)
+
+    @property
+    def used(self) -> int:
+        """Bytes of the arrays held in RAM"""
+        return self._used
+
+    def _account(self, entry: _Entry) -> bool:
+        """Bring the bytes accounted for the entry up to date, whether they grew"""
+        nbytes = entry.buffer.nbytes if entry.buffer.resident else 0
+        self._used += nbytes - entry.nbytes
+        grew, entry.nbytes = nbytes > entry.nbytes, nbytes
+        return grew
+
+    def memory(self, items: list[QGraphicsPixmapItem]) -> int:
+        """Bytes of RAM held for the items, their arrays (the parts copies do not share) and displayed pixmaps"""
+        total, pixmaps = 0, {}
+        for item in items:
+            entry = self._entries.get(id(item))
+            if entry is not None and entry.item() is item and entry.buffer.resident:
+                total += entry.buffer.nbytes
+            pixmap = item.pixmap()
+            pixmaps[pixmap.cacheKey()] = pixmap.width() * pixmap.height() * pixmap.depth() // 8  # Copies share it
+        return total + sum(pixmaps.values())
+
+    def pixmap(self, item: QGraphicsPixmapItem) -> QPixmap:
+        """Return an up-to-date full resolution pixmap of the item"""
+        self.flush(item)
+        entry = self._entries.get(id(item))
+        if entry is not None and entry.item() is item and entry.display_factor != 1.0:
+            return entry.buffer.to_pixmap()
+        return item.pixmap()
+
+    def discard(self, item: QGraphicsPixmapItem) -> None:
+        """Drop the cached array of the item"""
+        if id(item) in self._entries:
+            self._remove(id(item))
+
+    def clear(self) -> None:
+        """Drop every array, and the scratch files holding them"""
+        for key in list(self._entries):
+            self._remove(key)
+        self._remove_scratch()
+
+    def _insert(self, item: QGraphicsPixmapItem, buffer: PixelBuffer, cache_key: int) -> None:
+        key = id(item)
+        if key in self._entries:
+            self._remove(key)
+        entry = self._entries[key] = _Entry(item, buffer, cache_key)
+        # Forget the entry once the item is garbage collected, so a recycled id never hits a stale array.
+        # The finalizer holds the entry, it is detached when the entry goes so the buffer can be freed
+        entry.finalizer = weakref.finalize(item, self._forget, key, entry)
+        self._account(entry)
+        self._evict()
+
+    def _forget(self, key: int, entry: _Entry) -> None:
+        if self._entries.get(key) is entry:
+            self._remove(key)
+
+    def _remove(self, key: int) -> None:
+        entry = self._entries.pop(key)
+        entry.finalizer.detach()
+        self._used -= entry.nbytes
+
+    def _evict(self) -> None:
+        """Evict the least recently used arrays held in RAM, always keeping the newest one"""
+        if self._used <= self.budget:
+            return
+        newest = next(reversed(self._entries), None)
+        for key, entry in list(self._entries.items()):
+            if self._used <= self.budget:
+                break
+            if key == newest or not entry.buffer.resident:
+                continue  # Mapped arrays are the only full resolution copy, the OS pages them out instead
+            target = entry.item()
+            if entry.dirty and target is not None:
+                self.flush(target)  # The pixmap must hold the edits before the array is dropped
+            self._remove(key)
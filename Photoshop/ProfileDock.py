@@ -0,0 +1,82 @@
+from PyQt6.QtWidgets import (QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QPushButton, QTableWidget,
+                             QTableWidgetItem, QHeaderView, QFileDialog)
+from PyQt6.QtCore import Qt, QTimer
+from Profiler import Profiler
+
+
+class ProfileDock(QDockWidget):
+    """Dock showing where the time of the transformations goes, stage by stage, per operation and image size"""
+    COLUMNS: tuple[str, ...] = ("Operation", "Size", "Stage", "Runs", "Total ms", "Mean ms", "MiB", "Share")
+    REFRESH_MS: int = 500
+
+    def __init__(self, profiler: Profiler, parent: [QWidget, None] = None) -> None:
+        super(ProfileDock, self).__init__("Profiling", parent)
+        self.profiler: Profiler = profiler
+        self._shown: tuple = ()  # Records the table shows, it is only rebuilt when they changed
+
+        self.record = QCheckBox("Record")
+        self.record.setChecked(profiler.enabled)
+        self.record.toggled.connect(self.set_recording)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        save_button = QPushButton("Save Log...")
+        save_button.clicked.connect(self.save_log)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.record)
+        buttons.addStretch(1)
+        buttons.addWidget(clear_button)
+        buttons.addWidget(save_button)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.addLayout(buttons)
+        layout.addWidget(self.table, 1)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(lambda visible: self.timer.start() if visible else self.timer.stop())
+
+    def set_recording(self, enabled: bool) -> None:
+        self.profiler.enabled = enabled
+
+    def clear(self) -> None:
+        self.profiler.clear()
+        self.refresh()
+
+    def save_log(self) -> None:
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profiling Log", "profile.jsonl", "JSON Lines (*.jsonl)")
+        if path:
+            self.profiler.write_log(path)
+
+    def refresh(self) -> None:
+        """Show the records summed per operation, size and stage, with the share of each stage in its group"""
+        records = self.profiler.records
+        shown = (len(records), id(records[-1]) if records else None)
+        if shown == self._shown:
+            return
+        self._shown = shown
+
+        rows = self.profiler.summary()
+        totals: dict[tuple, int] = {}
+        for row in rows:
+            key = (row["operation"], row["width"], row["height"])
+            totals[key] = totals.get(key, 0) + row["ns"]
+        self.table.setRowCount(len(rows))
+        for index, row in enumerate(rows):
+            total = totals[(row["operation"], row["width"], row["height"])]
+            values = (row["operation"] or "-", f"{row['width']}x{row['height']}", row["stage"], str(row["count"]),
+                      f"{row['ns'] / 1e6:.2f}", f"{row['ns'] / row['count'] / 1e6:.3f}",
+                      f"{row['bytes'] / 2 ** 20:.1f}", f"{100 * row['ns'] / total:.0f}%" if total else "-")
+            for column, value in enumerate(values):
+                cell = QTableWidgetItem(value)
+                if column >= 3:
+                    cell.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(index, column, cell)
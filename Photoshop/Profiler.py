@@ -0,0 +1,80 @@
+from collections import deque
+import contextlib
+import threading
+import logging
+import json
+import time
+
+
+class Profiler:
+    """Times the stages of the transformation path and counts the bytes each of them allocates, copies or writes
+
+    Stages: "decode" (pixmap to QImage), "convert" (QImage format conversion), "allocate" (new result buffers),
+    "copy" (array copies, e.g. copy-on-write tiles), "kernel" (the operation itself), "resize" (zoom level
+    pixmaps) and "upload" (QImage to QPixmap). Disabled, a stage costs a single attribute check.
+    Every record is kept in a bounded list and logged as one JSON object per line to the "profile" logger.
+    """
+    HISTORY: int = 100000  # Records kept, the oldest are dropped first
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.operation: str = ""  # Transformation the following stages belong to, set by whoever starts it
+        self.records: deque = deque(maxlen=self.HISTORY)
+        self.logger: logging.Logger = logging.getLogger("profile")
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, nbytes: int = 0, width: int = 0, height: int = 0, operation: [str, None] = None):
+        """Time the body of the with statement as one run of the stage"""
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter_ns() - start_time, nbytes, width, height, operation)
+
+    def record(self, name: str, ns: int, nbytes: int = 0, width: int = 0, height: int = 0,
+               operation: [str, None] = None) -> None:
+        """Add one run of a stage timed by the caller, safe to call from any thread"""
+        if not self.enabled:
+            return
+        record = {"time": time.time(), "stage": name, "operation": self.operation if operation is None else operation,
+                  "width": width, "height": height, "ns": ns, "bytes": nbytes,
+                  "thread": threading.current_thread().name}
+        with self._lock:
+            self.records.append(record)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(json.dumps(record))
+
+    def summary(self) -> list[dict]:
+        """Records summed per operation, image size and stage, in the order they first appeared"""
+        with self._lock:
+            records = list(self.records)
+        groups: dict[tuple, dict] = {}
+        for record in records:
+            key = (record["operation"], record["width"], record["height"], record["stage"])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {"operation": key[0], "width": key[1], "height": key[2], "stage": key[3],
+                                       "count": 0, "ns": 0, "bytes": 0}
+            group["count"] += 1
+            group["ns"] += record["ns"]
+            group["bytes"] += record["bytes"]
+        return list(groups.values())
+
+    def write_log(self, path: str) -> None:
+        """Save the kept records as JSON lines"""
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+
+profiler = Profiler()  # Shared by the modules of the transformation path, off until a user turns it on
@@ -0,0 +1,42 @@
+import numpy as np
+import math
+import cv2
+
+
+class Pyramid:
+    """Downsampled copies of an image, each level halving the resolution, built only when asked for"""
+    MIN_SIZE: int = 32  # The coarsest level still has at least this many pixels along its shorter side
+
+    def __init__(self, arr: np.ndarray, min_size: int = MIN_SIZE) -> None:
+        self.levels: list[np.ndarray] = [arr]
+        self.count: int = 1 + max(0, int(math.log2(max(1, min(arr.shape[:2]) // min_size))))
+
+    @property
+    def base(self) -> np.ndarray:
+        return self.levels[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the downsampled levels, the base belongs to the caller"""
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def level(self, index: int) -> np.ndarray:
+        """The image at 1 / 2**index of the resolution"""
+        index = min(max(index, 0), self.count - 1)
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            height, width = previous.shape[:2]
+            # Area averaging from the previous level, a box filter over 2x2 pixels
+            self.levels.append(cv2.resize(previous, ((width + 1) // 2, (height + 1) // 2),
+                                          interpolation=cv2.INTER_AREA))
+        return self.levels[index]
+
+    def level_for(self, scale: float) -> int:
+        """The coarsest level that still has at least one pixel per displayed pixel at the given scale"""
+        if scale >= 1.0:
+            return 0
+        return min(int(math.floor(math.log2(1.0 / scale))), self.count - 1)
+
+    def factor(self, index: int) -> float:
+        """Size of the level relative to the base"""
+        return self.level(index).shape[1] / self.base.shape[1]
@@ -0,0 +1,219 @@
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage, QImageReader
+from PixelBuffer import PixelBuffer
+from collections.abc import Iterator
+from abc import ABC, abstractmethod
+import numpy as np
+import struct
+import zlib
+import cv2
+
+try:
+    import tifffile
+except ImportError:  # Optional, TIFF files are decoded whole through QImageReader without it
+    tifffile = None
+
+
+class StripDecoder(ABC):
+    """Decodes an image file from the top into an array a few rows at a time, e.g. a memory-mapped file
+
+    Only a strip of rows is held in memory, so neither the size of the image nor the pixel limits of the
+    codecs matter. decode() yields how many rows of the output are complete, stopping the iteration stops
+    the decoding.
+    """
+    STRIP_BYTES: int = 16 * 1024 * 1024  # Decoded bytes per strip
+
+    def __init__(self, path: str, width: int, height: int, channels: int, dtype: np.dtype) -> None:
+        self.path: str = path
+        self.width: int = width
+        self.height: int = height
+        self.channels: int = channels
+        self.dtype: np.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the output array, without a channel axis for gray images"""
+        if self.channels == 1:
+            return self.height, self.width
+        return self.height, self.width, self.channels
+
+    def strip_rows(self) -> int:
+        return max(1, self.STRIP_BYTES // (self.width * self.channels * self.dtype.itemsize))
+
+    @abstractmethod
+    def decode(self, out: np.ndarray) -> Iterator[int]:
+        """Decode into out, of the shape and dtype of the decoder, yielding the number of rows done"""
+
+    @staticmethod
+    def open(path: str) -> "StripDecoder":
+        """A decoder for the file, streaming PNG and (with tifffile) TIFF, decoding other formats whole"""
+        decoder = None
+        if path.lower().endswith(".png"):
+            decoder = PngDecoder.open(path)
+        elif tifffile is not None and path.lower().endswith((".tif", ".tiff")):
+            decoder = TiffDecoder.open(path)
+        return decoder or ReaderDecoder.open(path)
+
+
+class PngDecoder(StripDecoder):
+    """Non-interlaced 8 and 16 bit PNG files, inflated incrementally and unfiltered by libpng strip by strip
+
+    Each strip is handed to OpenCV as a small PNG of its own rows. Rows are filtered against the row above,
+    so the last row of the previous strip goes first, stored unfiltered, and is dropped after decoding.
+    Palette images are unfiltered as gray indices and looked up afterwards.
+    """
+    SIGNATURE: bytes = b"\x89PNG\r\n\x1a\n"
+    CHANNELS: dict[int, int] = {0: 1, 2: 3, 3: 1, 6: 4}  # Color type -> samples, gray with alpha is not streamed
+
+    def __init__(self, path: str, width: int, height: int, depth: int, color_type: int,
+                 palette: [np.ndarray, None] = None) -> None:
+        channels = 4 if color_type == 3 else self.CHANNELS[color_type]
+        super(PngDecoder, self).__init__(path, width, height, channels, np.uint8 if depth == 8 else np.uint16)
+        self.depth: int = depth
+        self.color_type: int = color_type
+        self.palette: [np.ndarray, None] = palette  # (256, 4) RGBA entries of palette images
+
+    @classmethod
+    def open(cls, path: str) -> ["PngDecoder", None]:
+        """None if the file is not a PNG this decoder streams, e.g. interlaced"""
+        with open(path, "rb") as file:
+            if file.read(8) != cls.SIGNATURE:
+                return None
+            header, palette, alpha = None, None, None
+            for kind, data in cls._chunks(file):
+                if kind == b"IHDR":
+                    header = struct.unpack(">IIBBBBB", data)
+                elif kind == b"PLTE":
+                    palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+                elif kind == b"tRNS":
+                    alpha = np.frombuffer(data, dtype=np.uint8)
+                elif kind == b"IDAT":
+                    break
+        if header is None:
+            return None
+        width, height, depth, color_type, _, _, interlace = header
+        if interlace or depth not in (8, 16) or color_type not in cls.CHANNELS:
+            return None
+        if color_type == 3:
+            if palette is None:
+                return None
+            entries = np.zeros((256, 4), dtype=np.uint8)
+            entries[:, 3] = 255
+            entries[:len(palette), :3] = palette
+            if alpha is not None:
+                entries[:len(alpha), 3] = alpha[:256]
+            return cls(path, width, height, depth, color_type, entries)
+        if alpha is not None:
+            return None  # A transparent color, OpenCV would not see it in the strips
+        return cls(path, width, height, depth, color_type)
+
+    @staticmethod
+    def _chunks(file) -> Iterator[tuple[bytes, bytes]]:
+        """Type and data of the chunks from the current position"""
+        while True:
+            head = file.read(8)
+            if len(head) < 8:
+                return
+            length, kind = struct.unpack(">I4s", head)
+            data = file.read(length)
+            file.read(4)  # CRC, libpng checks the one of the strips
+            if len(data) < length:
+                return
+            yield kind, data
+
+    @staticmethod
+    def _chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    def _png(self, lines: bytes, rows: int) -> bytes:
+        """A PNG of the filtered lines, palette indices become gray values"""
+        color_type = 0 if self.color_type == 3 else self.color_type
+        header = struct.pack(">IIBBBBB", self.width, rows, self.depth, color_type, 0, 0, 0)
+        return (self.SIGNATURE + self._chunk(b"IHDR", header) + self._chunk(b"IDAT", zlib.compress(lines, 0)) +
+                self._chunk(b"IEND", b""))
+
+    def _unfilter(self, lines: bytes, rows: int) -> np.ndarray:
+        decoded = cv2.imdecode(np.frombuffer(self._png(lines, rows), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if decoded is None:
+            raise ValueError("Corrupt PNG data")
+        if decoded.ndim == 3:
+            decoded = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB if decoded.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+        return decoded
+
+    def decode(self, out: np.ndarray) -> Iterator[int]:
+        samples = 1 if self.color_type == 3 else self.channels
+        line = 1 + self.width * samples * self.dtype.itemsize  # Filter type byte and the row
+        strip = self.strip_rows() * line
+        inflate = zlib.decompressobj()
+        pending = bytearray()
+        previous = b""  # The last row of the previous strip, unfiltered
+        y = 0
+        with open(self.path, "rb") as file:
+            file.seek(8)
+            chunks = (data for kind, data in self._chunks(file) if kind == b"IDAT")
+            while y < self.height:
+                while len(pending) < strip and not inflate.eof:
+                    data = inflate.unconsumed_tail or next(chunks, None)  # Some files have a single IDAT chunk
+                    if data is None:
+                        break
+                    pending += inflate.decompress(data, strip)
+                rows = min(len(pending) // line, self.height - y)
+                if not rows:
+                    raise ValueError("Truncated PNG data")
+                lines = bytes(previous) + bytes(pending[:rows * line])
+                del pending[:rows * line]
+                decoded = self._unfilter(lines, rows + bool(previous))[bool(previous):]
+                previous = b"\0" + decoded[-1].astype(self.dtype.newbyteorder(">")).tobytes()
+                out[y:y + rows] = self.palette[decoded] if self.palette is not None else decoded
+                y += rows
+                yield y
+
+
+class TiffDecoder(StripDecoder):
+    """Compressed or tiled TIFF files, tifffile decodes them segment by segment into the output"""
+
+    @classmethod
+    def open(cls, path: str) -> ["TiffDecoder", None]:
+        """None if the first page is not an unsigned gray, RGB or RGBA image stored pixel after pixel"""
+        with tifffile.TiffFile(path) as tiff:
+            page = tiff.pages[0]
+            if page.axes not in ("YX", "YXS") or page.dtype.kind != "u":
+                return None
+            channels = page.shape[2] if page.axes == "YXS" else 1
+            if channels not in (1, 3, 4):
+                return None
+            return cls(path, page.shape[1], page.shape[0], channels, page.dtype)
+
+    def decode(self, out: np.ndarray) -> Iterator[int]:
+        with tifffile.TiffFile(self.path) as tiff:
+            tiff.pages[0].asarray(out=out)
+        yield self.height
+
+
+class ReaderDecoder(StripDecoder):
+    """Any format Qt reads, decoded whole, then converted to RGBA strip by strip"""
+
+    def __init__(self, path: str, width: int, height: int) -> None:
+        super(ReaderDecoder, self).__init__(path, width, height, 4, np.uint8)
+
+    @classmethod
+    def open(cls, path: str) -> "ReaderDecoder":
+        size = QImageReader(path).size()
+        return cls(path, size.width(), size.height())
+
+    def decode(self, out: np.ndarray) -> Iterator[int]:
+        reader = QImageReader(self.path)
+        limit = QImageReader.allocationLimit()
+        QImageReader.setAllocationLimit(0)  # The default refuses images of the size files are tiled at
+        try:
+            image = reader.read()
+        finally:
+            QImageReader.setAllocationLimit(limit)
+        if image.isNull():
+            raise ValueError(reader.errorString())
+        rows = self.strip_rows()
+        for y in range(0, self.height, rows):
+            strip = image.copy(QRect(0, y, self.width, min(rows, self.height - y)))
+            out[y:y + strip.height()] = PixelBuffer(strip.convertToFormat(QImage.Format.Format_RGBA8888),
+                                                    adopt=True).array
+            yield y + strip.height()
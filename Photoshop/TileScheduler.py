@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+
+
+class TileScheduler:
+    """Runs image kernels over halo-padded tiles on a thread pool
+
+    OpenCV, SciPy and most NumPy kernels release the GIL, so the tiles are processed truly in parallel.
+    A kernel reading at most `halo` pixels around each output pixel gives exactly the untiled result.
+    """
+    DEFAULT_TILE_SIZE: int = 1024
+
+    def __init__(self, tile_size: int = DEFAULT_TILE_SIZE, workers: [int, None] = None) -> None:
+        self.tile_size: int = tile_size
+        self.workers: int = workers or os.cpu_count() or 1
+        self._pool: [ThreadPoolExecutor, None] = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tile")
+        return self._pool
+
+    def configure(self, tile_size: [int, None] = None, workers: [int, None] = None) -> None:
+        """Change the tile size and/or the number of worker threads"""
+        if tile_size:
+            self.tile_size = tile_size
+        if workers and workers != self.workers:
+            self.workers = workers
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+    def tiles(self, height: int, width: int) -> list[tuple[int, int, int, int]]:
+        """The (y0, y1, x0, x1) output rectangles covering the image"""
+        return [(y, min(y + self.tile_size, height), x, min(x + self.tile_size, width))
+                for y in range(0, height, self.tile_size) for x in range(0, width, self.tile_size)]
+
+    def _is_small(self, arr: np.ndarray) -> bool:
+        return self.workers == 1 or (arr.shape[0] <= self.tile_size and arr.shape[1] <= self.tile_size)
+
+    def run(self, func: callable, arr: np.ndarray, halo: int = 0, out: [np.ndarray, None] = None) -> np.ndarray:
+        """Apply func to every tile and stitch the results
+
+        func maps an (h, w, ...) array to an array with the same height and width.
+        out may only alias arr when halo is 0, otherwise tiles would read pixels already written by others.
+        """
+        if out is not None and halo and np.shares_memory(out, arr):
+            raise ValueError("A haloed kernel cannot write into its own input")
+        if self._is_small(arr):
+            result = func(arr)
+            if out is None:
+                return result
+            out[...] = result
+            return out
+
+        height, width = arr.shape[:2]
+        rects = self.tiles(height, width)
+        if out is None:
+            # The first tile tells the dtype and the channel layout of the output
+            first = self._process(func, arr, halo, rects[0])
+            out = np.empty((height, width) + first.shape[2:], dtype=first.dtype)
+            y0, y1, x0, x1 = rects[0]
+            out[y0:y1, x0:x1] = first
+            rects = rects[1:]
+
+        futures = [self.pool.submit(self._process_into, func, arr, halo, rect, out) for rect in rects]
+        for future in futures:
+            future.result()  # Re-raise the exception of any failed tile
+        return out
+
+    def map(self, func: callable, arr: np.ndarray) -> list:
+        """Apply func to every tile without halo and return the per-tile results, e.g. for reductions"""
+        if self._is_small(arr):
+            return [func(arr)]
+        rects = self.tiles(arr.shape[0], arr.shape[1])
+        return list(self.pool.map(lambda rect: func(arr[rect[0]:rect[1], rect[2]:rect[3]]), rects))
+
+    @staticmethod
+    def _process(func: callable, arr: np.ndarray, halo: int, rect: tuple[int, int, int, int]) -> np.ndarray:
+        """Run func on the tile extended by the halo, clamped to the image, and crop the halo off again"""
+        height, width = arr.shape[:2]
+        y0, y1, x0, x1 = rect
+        top, left = max(y0 - halo, 0), max(x0 - halo, 0)
+        bottom, right = min(y1 + halo, height), min(x1 + halo, width)
+        result = func(arr[top:bottom, left:right])
+        return result[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    def _process_into(self, func: callable, arr: np.ndarray, halo: int, rect: tuple[int, int, int, int],
+                      out: np.ndarray) -> None:
+        y0, y1, x0, x1 = rect
+        out[y0:y1, x0:x1] = self._process(func, arr, halo, rect)
@@ -0,0 +1,372 @@
+from PyQt6.QtWidgets import QGraphicsObject, QGraphicsItem, QStyleOptionGraphicsItem, QStyle, QWidget
+from PyQt6.QtCore import Qt, QRect, QRectF, QSize, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler, QPainter, QPixmap, QPen
+from OperationGraph import Step
+from PixelBuffer import PixelBuffer, _remove_file
+from StripDecoder import StripDecoder
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+import numpy as np
+import itertools
+import threading
+import tempfile
+import weakref
+import math
+import os
+
+try:
+    import tifffile
+except ImportError:  # Optional, TIFF files are region decoded through QImageReader without it
+    tifffile = None
+
+
+def _to_rgba(region: np.ndarray) -> np.ndarray:
+    """Convert a decoded region of any channel count and integer depth to RGBA uint8"""
+    if region.dtype != np.uint8:
+        region = (region / (np.iinfo(region.dtype).max / 255)).astype(np.uint8)
+    if region.ndim == 2:
+        region = region[..., None]
+    channels = region.shape[2]
+    rgba = np.empty(region.shape[:2] + (4,), dtype=np.uint8)
+    rgba[..., :3] = region[..., :3] if channels >= 3 else region[..., :1]
+    rgba[..., 3] = region[..., 3] if channels == 4 else 255
+    return rgba
+
+
+class TileSource(ABC):
+    """Random access to the pixels of an image file, at full resolution or subsampled by 2**level"""
+
+    def __init__(self, path: str, width: int, height: int) -> None:
+        self.path: str = path
+        self.width: int = width
+        self.height: int = height
+
+    @abstractmethod
+    def read(self, x: int, y: int, width: int, height: int, level: int = 0) -> np.ndarray:
+        """(H, W, 4) RGBA pixels of the rectangle given in level coordinates"""
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        step = 2 ** level
+        return -(-self.width // step), -(-self.height // step)
+
+    def ready(self) -> bool:
+        """Whether every pixel can be read without waiting"""
+        return True
+
+
+class ArraySource(TileSource):
+    """Memory-mapped pixels, only the pages of the requested rows are read from the disk"""
+
+    def __init__(self, path: str, arr: np.ndarray) -> None:
+        super(ArraySource, self).__init__(path, arr.shape[1], arr.shape[0])
+        self.arr: np.ndarray = arr
+
+    def read(self, x: int, y: int, width: int, height: int, level: int = 0) -> np.ndarray:
+        step = 2 ** level
+        region = self.arr[y * step:(y + height) * step:step, x * step:(x + width) * step:step]
+        return _to_rgba(np.asarray(region))
+
+
+class ReaderSource(TileSource):
+    """Region decoding through QImageReader, cheap for formats whose plugin supports clip rectangles"""
+
+    def __init__(self, path: str, size: QSize) -> None:
+        super(ReaderSource, self).__init__(path, size.width(), size.height())
+
+    def read(self, x: int, y: int, width: int, height: int, level: int = 0) -> np.ndarray:
+        reader = QImageReader(self.path)  # One reader per call, they are not thread-safe
+        if level:
+            reader.setScaledSize(QSize(*self.level_size(level)))
+            reader.setScaledClipRect(QRect(x, y, width, height))
+        else:
+            reader.setClipRect(QRect(x, y, width, height))
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(f"Cannot decode {self.path}: {reader.errorString()}")
+        return PixelBuffer(image, adopt=True).array
+
+
+class _DecodeTask(QRunnable):
+    """Decodes the file of a DecodedSource into its mapping in a pool thread"""
+
+    def __init__(self, source: "DecodedSource", decoder: StripDecoder) -> None:
+        super(_DecodeTask, self).__init__()
+        self.source = weakref.ref(source)  # Dropping the source, e.g. on a new file, stops the decoding
+        self.arr: np.ndarray = source.arr
+        self.decoder: StripDecoder = decoder
+
+    def run(self) -> None:
+        rows = 0
+        try:
+            for rows in self.decoder.decode(self.arr):
+                source = self.source()
+                if source is None:
+                    return
+                source._decoded(rows)
+                del source
+        except Exception as error:  # Raised by the reads waiting for the rows
+            source = self.source()
+            if source is not None:
+                source._decoded(rows, str(error) or type(error).__name__)
+
+
+class DecodedSource(ArraySource):
+    """Files whose Qt plugin ignores clip rectangles (PNG, TIFF), decoded once into a memory-mapped file
+
+    Region decoding them would decode the whole file for every tile. A pool thread decodes the file strip by
+    strip from the top into a file in the scratch directory, reading a tile waits only for the rows it covers.
+    """
+    pool: QThreadPool = QThreadPool()  # Apart from the tile pool, whose threads wait for the decoded rows
+
+    def __init__(self, path: str, decoder: StripDecoder, scratch: [str, None] = None) -> None:
+        handle, file = tempfile.mkstemp(prefix="photoshop-", suffix=".npy", dir=scratch)
+        os.close(handle)
+        arr = np.lib.format.open_memmap(file, mode="w+", dtype=decoder.dtype, shape=decoder.shape)
+        super(DecodedSource, self).__init__(path, arr)
+        weakref.finalize(self, _remove_file, file)
+        self.rows: int = 0  # Rows decoded so far
+        self.error: [str, None] = None  # Set once the decoding failed, it is not tried again
+        self._condition = threading.Condition()
+        self.pool.start(_DecodeTask(self, decoder))
+
+    def _decoded(self, rows: int, error: [str, None] = None) -> None:
+        with self._condition:
+            self.rows, self.error = rows, error
+            self._condition.notify_all()
+
+    def ready(self) -> bool:
+        return self.rows == self.height or self.error is not None  # Reads of a failed file raise at once
+
+    def read(self, x: int, y: int, width: int, height: int, level: int = 0) -> np.ndarray:
+        needed = min(self.height, (y + height) * 2 ** level)
+        with self._condition:
+            self._condition.wait_for(lambda: self.rows >= needed or self.error is not None)
+        if self.rows < needed:
+            raise ValueError(self.error)
+        return super(DecodedSource, self).read(x, y, width, height, level)
+
+
+def open_source(path: str, scratch: [str, None] = None) -> TileSource:
+    """Map the file if its layout allows it, otherwise region decode it or decode it into the scratch directory"""
+    if path.lower().endswith(".npy"):
+        return ArraySource(path, np.load(path, mmap_mode="r"))
+    if tifffile is not None and path.lower().endswith((".tif", ".tiff")):
+        try:
+            return ArraySource(path, tifffile.memmap(path, mode="r"))
+        except ValueError:  # Compressed or tiled on disk, not mappable
+            pass
+    reader = QImageReader(path)
+    size = reader.size()
+    if not size.isValid():
+        raise ValueError(f"Cannot read {path}: {reader.errorString()}")
+    if not reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+        return DecodedSource(path, StripDecoder.open(path), scratch)
+    return ReaderSource(path, size)
+
+
+class TileCache:
+    """Decoded tile pixmaps of every TiledImageItem, evicted in LRU order under a memory budget"""
+    DEFAULT_BUDGET: int = 256 * 1024 * 1024  # 256 MiB
+
+    def __init__(self, budget: int = DEFAULT_BUDGET) -> None:
+        self.budget: int = budget
+        self.used: int = 0
+        self._tiles: OrderedDict[tuple, QPixmap] = OrderedDict()
+
+    @staticmethod
+    def _size(pixmap: QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def get(self, key: tuple) -> [QPixmap, None]:
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+        return pixmap
+
+    def put(self, key: tuple, pixmap: QPixmap) -> None:
+        if key in self._tiles:
+            self.used -= self._size(self._tiles.pop(key))
+        self._tiles[key] = pixmap
+        self.used += self._size(pixmap)
+        while self.used > self.budget and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self.used -= self._size(evicted)
+
+    def clear(self) -> None:
+        self._tiles.clear()
+        self.used = 0
+
+
+class _TileTask(QRunnable):
+    """Decodes and transforms one tile in a pool thread"""
+
+    def __init__(self, item: "TiledImageItem", key: tuple) -> None:
+        super(_TileTask, self).__init__()
+        self.item = item
+        self.key = key
+
+    def run(self) -> None:
+        try:
+            if self.key[0] != self.item._key or self.key[1] != self.item._level:
+                self.item._tile_failed.emit(self.key, "")  # Transformed or zoomed to another level before its turn
+                return
+            try:
+                image = self.item.render_tile(*self.key[1:])
+            except Exception as error:  # Reported on the GUI thread, the item stops decoding tiles
+                self.item._tile_failed.emit(self.key, f"{self.item.source.path}: {error}")
+                return
+            self.item._tile_loaded.emit(self.key, image)
+        except RuntimeError:  # The item was deleted meanwhile
+            pass
+
+
+class TiledImageItem(QGraphicsObject):
+    """Scene item for images too large for a single pixmap, decoding only the visible tiles at the zoom level
+
+    Transformations are recorded as steps and run on every tile when it is decoded, on the tile plus the
+    halo the steps need. Operations that need the whole image (e.g. histogram equalization) are rejected.
+    """
+    TILE_SIZE: int = 512
+    MIN_PIXELS: int = 64 * 1024 * 1024  # Open images of this size or larger as tiled items
+    cache: TileCache = TileCache()
+    pool: QThreadPool = QThreadPool()
+    _ids = itertools.count()
+    failed = pyqtSignal(str)  # Error message, emitted once when the file cannot be decoded
+    _tile_loaded = pyqtSignal(tuple, QImage)  # Emitted from the pool threads, delivered on the GUI thread
+    _tile_failed = pyqtSignal(tuple, str)  # Key, error message or "" for a tile that was not needed anymore
+
+    def __init__(self, source: TileSource, steps: [list[Step], None] = None) -> None:
+        super(TiledImageItem, self).__init__()
+        self.source: TileSource = source
+        self.steps: list[Step] = list(steps or [])
+        self._key: int = next(self._ids)  # Changes with the steps, so stale tiles are never drawn
+        self._loading: set[tuple] = set()
+        self._level: int = 0  # Level of the last repaint
+        self.error: [str, None] = None  # Why the tiles cannot be decoded, none is tried again
+        self._tile_loaded.connect(self._on_tile_loaded)
+        self._tile_failed.connect(self._on_tile_failed)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)  # For the exposed rectangle
+
+    @classmethod
+    def from_file(cls, path: str, scratch: [str, None] = None) -> "TiledImageItem":
+        return cls(open_source(path, scratch))
+
+    @classmethod
+    def should_tile(cls, path: str) -> bool:
+        """Whether the file is large enough to be opened tiled, decided from its header only"""
+        if path.lower().endswith(".npy"):
+            return True
+        size = QImageReader(path).size()
+        return size.isValid() and size.width() * size.height() >= cls.MIN_PIXELS
+
+    def copy(self) -> "TiledImageItem":
+        """A new item on the same file with the same steps, nothing is decoded"""
+        copied_item = TiledImageItem(self.source, self.steps)
+        copied_item.setFlags(self.flags())
+        copied_item.error = self.error
+        return copied_item
+
+    def apply(self, step: Step) -> None:
+        """Record a transformation, the visible tiles are recomputed"""
+        if step.halo() is None:
+            raise ValueError(f"{step.name} needs the whole image and cannot run on tiles")
+        self.steps.append(step)
+        self._key = next(self._ids)
+        self._loading.clear()
+        self.update()
+
+    def halo(self) -> int:
+        return sum(step.halo() for step in self.steps)
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, self.source.width, self.source.height)
+
+    def level_for(self, lod: float) -> int:
+        """The coarsest level that still has at least one pixel per screen pixel"""
+        if lod >= 1.0:
+            return 0
+        return min(int(math.log2(1.0 / lod)), int(math.log2(max(1, min(self.source.width, self.source.height)))))
+
+    def render_tile(self, level: int, tx: int, ty: int) -> QImage:
+        """Decode a tile with the halo its steps need and run them on it"""
+        return PixelBuffer.from_array(self.render_region(level, tx, ty)).image
+
+    def render_region(self, level: int, tx: int, ty: int) -> np.ndarray:
+        """(H, W, 4) transformed pixels of a tile, safe to call from any thread"""
+        width, height = self.source.level_size(level)
+        x0, y0 = tx * self.TILE_SIZE, ty * self.TILE_SIZE
+        x1, y1 = min(x0 + self.TILE_SIZE, width), min(y0 + self.TILE_SIZE, height)
+        factor = 1 / 2 ** level
+        steps = [step.scaled(factor) for step in self.steps]
+        halo = sum(step.halo() for step in steps)
+        hx0, hy0, hx1, hy1 = max(0, x0 - halo), max(0, y0 - halo), min(width, x1 + halo), min(height, y1 + halo)
+        region = self.source.read(hx0, hy0, hx1 - hx0, hy1 - hy0, level)
+        for step in steps:
+            step(region)
+        return region[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: [QWidget, None] = None) -> None:
+        level = self.level_for(QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform()))
+        extent = self.TILE_SIZE * 2 ** level  # Size of a tile in item coordinates
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        columns = range(int(exposed.left() // extent), int(math.ceil(exposed.right() / extent)))
+        rows = range(int(exposed.top() // extent), int(math.ceil(exposed.bottom() / extent)))
+
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self._level = level
+        for ty in rows:
+            for tx in columns:
+                key = (self._key, level, tx, ty)
+                pixmap = self.cache.get(key)
+                target = QRectF(tx * extent, ty * extent, extent, extent).intersected(self.boundingRect())
+                if pixmap is None:
+                    painter.fillRect(target, Qt.GlobalColor.lightGray)
+                    if key not in self._loading and self.error is None:
+                        self._loading.add(key)
+                        self.pool.start(_TileTask(self, key))
+                    continue
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+        if option.state & QStyle.StateFlag.State_Selected:
+            painter.setPen(QPen(Qt.GlobalColor.black, 0, Qt.PenStyle.DashLine))
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawRect(self.boundingRect())
+
+    def overview(self, max_size: int = 2048) -> [QPixmap, None]:
+        """The whole image, transformed, at a level no larger than max_size along its longer side
+
+        None while the file is still being decoded, it is not waited for.
+        """
+        if not self.source.ready():
+            return None
+        level = max(0, math.ceil(math.log2(max(self.source.width, self.source.height) / max_size)))
+        width, height = self.source.level_size(level)
+        steps = [step.scaled(1 / 2 ** level) for step in self.steps]
+        try:
+            region = self.source.read(0, 0, width, height, level)
+            for step in steps:
+                step(region)
+        except Exception as error:
+            self._fail(f"{self.source.path}: {error}")
+            raise ValueError(self.error) from error
+        return PixelBuffer.from_array(region).to_pixmap()
+
+    def _fail(self, message: str) -> None:
+        if self.error is None:
+            self.error = message
+            self.failed.emit(message)
+
+    def _on_tile_failed(self, key: tuple, message: str) -> None:
+        self._loading.discard(key)
+        if message:
+            self._fail(message)
+
+    def _on_tile_loaded(self, key: tuple, image: QImage) -> None:
+        self._loading.discard(key)
+        if key[0] != self._key:
+            return  # The steps changed while the tile was decoded
+        self.cache.put(key, QPixmap.fromImage(image))
+        _, level, tx, ty = key
+        extent = self.TILE_SIZE * 2 ** level
+        self.update(QRectF(tx * extent, ty * extent, extent, extent))
+
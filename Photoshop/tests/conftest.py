@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The modules of the application import each other by their file names, as when run from its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+from Convolution import Convolution
+import numpy as np
+import pytest
+import cv2
+
+KERNELS = {
+    "row": np.array([[1, 2, 1]]) / 4,
+    "column": np.array([[1], [2], [1]]) / 4,
+    "rank one": np.outer([1, 2, 1], [-1, 0, 1]),
+    "single tap": np.array([[2.0]]),
+}
+
+
+@pytest.mark.parametrize("name", KERNELS)
+@pytest.mark.parametrize("method", ["auto", "separable", "direct", "fft"])
+def test_filter_matches_filter2d(name, method):
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    kernel = KERNELS[name]
+    expected = cv2.filter2D(arr, cv2.CV_32F, kernel.astype(np.float32))
+    result = Convolution().filter(arr, kernel, dtype=np.float32, method=method)
+    np.testing.assert_allclose(result, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("name", KERNELS)
+def test_separate_factors_multiply_back(name):
+    column, row = Convolution.separate(KERNELS[name])
+    np.testing.assert_allclose(column @ row, KERNELS[name])
@@ -0,0 +1,39 @@
+from Operations import Operations
+import numpy as np
+import pytest
+
+
+def laplace_per_pixel(img_array: np.ndarray) -> np.ndarray:
+    """The original per-pixel loop, on an array instead of QImage.pixelColor(), the border is left at 0"""
+    height, width = img_array.shape[:2]
+    kernel = np.array([[0, 1, 0], [1, -4, 1], [0, 1, 0]])
+    result = np.zeros((height, width, 4), dtype=np.uint8)
+    for x in range(1, width - 1):
+        for y in range(1, height - 1):
+            r = g = b = 0
+            for i in range(3):
+                for j in range(3):
+                    red, green, blue = (int(value) for value in img_array[y - 1 + j, x - 1 + i, :3])
+                    r += red * kernel[i, j]
+                    g += green * kernel[i, j]
+                    b += blue * kernel[i, j]
+            result[y, x] = (min(max(r + 128, 0), 255), min(max(g + 128, 0), 255), min(max(b + 128, 0), 255), 255)
+    return result
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize("seed", range(4))
+def test_edge_laplace_matches_per_pixel_loop(channels, seed):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(3, 24, 2)
+    img_array = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+    expected = laplace_per_pixel(img_array)
+    result = Operations().edge_laplace(img_array)
+    np.testing.assert_array_equal(result[1:-1, 1:-1], expected[1:-1, 1:-1, :channels])
+
+
+def test_edge_laplace_in_place():
+    img_array = np.random.default_rng(7).integers(0, 256, (16, 20, 4), dtype=np.uint8)
+    expected = laplace_per_pixel(img_array)
+    Operations().edge_laplace(img_array, out=img_array)
+    np.testing.assert_array_equal(img_array[1:-1, 1:-1], expected[1:-1, 1:-1])
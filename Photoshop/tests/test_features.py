@@ -0,0 +1,52 @@
+from Operations import Operations
+from Features import Features
+import numpy as np
+import pytest
+import cv2
+
+
+def good_features(img_array: np.ndarray, max_corners: int, quality_level: float, min_distance: float) -> np.ndarray:
+    gray = cv2.cvtColor(np.ascontiguousarray(img_array[..., :3]), cv2.COLOR_RGB2GRAY)
+    corners = cv2.goodFeaturesToTrack(gray, maxCorners=max_corners, qualityLevel=quality_level,
+                                      minDistance=min_distance)
+    return np.empty((0, 2), dtype=np.intp) if corners is None else corners.reshape(-1, 2).astype(np.intp)
+
+
+def smooth_image(seed: int) -> np.ndarray:
+    noise = np.random.default_rng(seed).integers(0, 256, (180, 240, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (0, 0), 2)
+
+
+def checkerboard() -> np.ndarray:
+    """Every corner of the squares has the same response, only the tie order decides which ones are kept"""
+    board = ((np.indices((150, 200)) // 10).sum(axis=0) % 2 * 255).astype(np.uint8)
+    return np.repeat(board[..., None], 3, axis=2)
+
+
+@pytest.mark.parametrize("image", [smooth_image(0), smooth_image(1), checkerboard()], ids=["real", "real", "tied"])
+@pytest.mark.parametrize("max_corners, quality_level, min_distance", [
+    (400, 0.01, 10), (50, 0.05, 3), (0, 0.1, 0), (100, 0.01, 7.5), (1000, 0.01, 10)])
+def test_corners_match_good_features_to_track(image, max_corners, quality_level, min_distance):
+    operations = Operations()
+    operations.tiles.configure(tile_size=64)  # Several tiles, so the merge across them is checked too
+    expected = good_features(image, max_corners, quality_level, min_distance)
+    result = operations.corners(image, max_corners, quality_level, min_distance, level=0)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_cached_candidates_give_the_same_corners():
+    features = Features()
+    image = smooth_image(2)
+    first = features.detect(image, 30, level=0)
+    features.detect(image, 300, level=0)
+    np.testing.assert_array_equal(features.detect(image, 30, level=0), first)
+    assert len(features._cache) == 1
+
+
+def test_markers_match_cv2_circle():
+    image = smooth_image(3)
+    corners = np.array([[0, 0], [5, 100], [239, 179], [120, 90]])
+    expected = image.copy()
+    for x, y in corners:
+        cv2.circle(expected, (int(x), int(y)), 5, (255, 0, 0), 1)
+    np.testing.assert_array_equal(Features.draw(image.copy(), corners, (255, 0, 0)), expected)
@@ -0,0 +1,44 @@
+from StripDecoder import StripDecoder, PngDecoder
+import numpy as np
+import pytest
+import cv2
+
+
+def image(channels: int, dtype: type) -> np.ndarray:
+    """Noise beside flat areas, so the encoder picks different row filters"""
+    arr = np.random.default_rng(channels).integers(0, 256, (97, 61, channels), dtype=np.uint8).astype(dtype)
+    arr[:, :30] = 9
+    arr[40:] //= 3
+    if dtype == np.uint16:
+        arr = arr * 257 + 3
+    return arr[..., 0] if channels == 1 else arr
+
+
+def decode(path: str) -> tuple[StripDecoder, np.ndarray, list[int]]:
+    decoder = StripDecoder.open(path)
+    out = np.zeros(decoder.shape, dtype=decoder.dtype)
+    return decoder, out, list(decoder.decode(out))
+
+
+@pytest.mark.parametrize("channels", [1, 3, 4])
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_png_strips_match_the_whole_image(tmp_path, monkeypatch, channels, dtype):
+    monkeypatch.setattr(PngDecoder, "STRIP_BYTES", 5000)  # Several strips
+    arr = image(channels, dtype)
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, arr if channels == 1 else arr[..., [2, 1, 0, 3][:channels]])
+    decoder, out, rows = decode(path)
+    assert isinstance(decoder, PngDecoder)
+    assert len(rows) > 1 and rows[-1] == arr.shape[0]
+    np.testing.assert_array_equal(out, arr)
+
+
+def test_truncated_png_raises(tmp_path):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, image(3, np.uint8))
+    with open(path, "rb") as file:
+        data = file.read()
+    with open(path, "wb") as file:
+        file.write(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        decode(path)